@@ -0,0 +1,297 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import pyotp
+from psycopg2.extras import execute_values
+import crypto_manager
+import db_pool
+import kdf
+import totp_qr
+import vault_keys
+
+# Non-interactive bulk admin tool (create_user.py / delete_user.py do one account at a time):
+#   python admin_cli.py create users.csv                 CSV with username,password columns
+#   python admin_cli.py create users.json                [{"username": ..., "password": ...}, ...]
+#   python admin_cli.py delete leavers.csv --yes         CSV with a username column (or a JSON list)
+#   add --dry-run to see what would happen without writing anything
+# Passwords are derived in a process pool across all cores while finished accounts are
+# inserted in batches, one transaction per batch. New accounts' 2FA secrets are written
+# to a CSV (mode 600) to hand out. Every run ends with per-stage timings.
+
+BANNED_CHARS = [' ', '\t', '\n', '\r', '\\', '^', '~', '"', "'", '{', '}', '[', ']', '|', ';']
+ADMIN_BATCH = 500 # Accounts per transaction
+
+class InputError(Exception):
+    pass
+
+# UTILITY: Wall time per stage, printed at the end of a run
+class StageTimer:
+    def __init__(self):
+        self.stages = [] # [(name, seconds, items)]
+
+    @contextmanager
+    def stage(self, name, items=None):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started, items)
+
+    def add(self, name, seconds, items=None):
+        self.stages.append((name, seconds, items))
+
+    def report(self):
+        print("\nStage timings:")
+        for name, seconds, items in self.stages:
+            rate = f"  {items / seconds:10.1f}/s" if items and seconds > 0 else ""
+            count = f"{items:>8}" if items is not None else " " * 8
+            print(f"  {name:<22}{seconds:9.3f} s{count}{rate}")
+
+# 1. INPUT
+# CSV (header row required) or JSON, picked by the file extension
+def read_records(path, fields):
+    try:
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            if path.lower().endswith('.json'):
+                records = json.load(f)
+            else:
+                reader = csv.DictReader(f)
+                missing = [field for field in fields if field not in (reader.fieldnames or [])]
+                if missing:
+                    raise InputError(f"{path}: missing column(s) {', '.join(missing)}")
+                records = list(reader)
+    except (OSError, ValueError, csv.Error) as e:
+        raise InputError(f"{path}: {e}")
+
+    if not isinstance(records, list):
+        raise InputError(f"{path}: expected a list of users")
+    # A JSON list of plain usernames is fine for deletes
+    return [record if isinstance(record, dict) else {'username': record} for record in records]
+
+# Same rules as /api/register; returns ([(username, password)], [problem lines])
+def validate_new_users(records):
+    users, problems, seen = [], [], set()
+    for line, record in enumerate(records, start=1):
+        username = str(record.get('username') or '').strip()
+        password = str(record.get('password') or '').strip()
+        if not username or not password:
+            problems.append(f"#{line}: username and password required")
+        elif any(char in username for char in BANNED_CHARS):
+            problems.append(f"#{line} {username}: username contains invalid characters")
+        elif any(char in password for char in BANNED_CHARS):
+            problems.append(f"#{line} {username}: password contains invalid characters")
+        elif len(password) < 8:
+            problems.append(f"#{line} {username}: password must be at least 8 characters")
+        elif username in seen:
+            problems.append(f"#{line} {username}: listed twice")
+        else:
+            seen.add(username)
+            users.append((username, password))
+    return users, problems
+
+def read_usernames(records):
+    usernames = (str(record.get('username') or '').strip() for record in records)
+    return list(dict.fromkeys(username for username in usernames if username)) # Unique, in file order
+
+# 2. KEY DERIVATION (runs in the pool processes)
+# Everything that needs the password happens here, so only hashes and wrapped keys come back.
+def derive_account(password, kdf_params):
+    salt = crypto_manager.generate_salt()
+    master_secret = crypto_manager.derive_master_secret(password, salt, kdf_params)
+    keyring = vault_keys.new_keyring()
+    wrapped = keyring.wrapped(crypto_manager.encryption_key_from_secret(master_secret))
+    return salt.hex(), crypto_manager.auth_hash_from_secret(master_secret), keyring.current_version, wrapped
+
+def existing_usernames(cur, usernames):
+    cur.execute('SELECT username FROM users WHERE username = ANY(%s)', (usernames,))
+    return {row[0] for row in cur.fetchall()}
+
+# 3. CREATE
+def insert_accounts(conn, cur, accounts, kdf_params):
+    # accounts: [(username, two_factor_secret, (salt, hash, key version, wrapped keys))]
+    # A username taken since the check is skipped (ON CONFLICT), not an error for the whole batch.
+    created = execute_values(cur, '''
+        INSERT INTO users (username, password_hash, salt, two_factor_secret, kdf_params, data_key_version)
+        VALUES %s ON CONFLICT (username) DO NOTHING RETURNING id, username
+    ''', [(username, password_hash, salt, two_factor_secret, kdf_params, key_version)
+          for username, two_factor_secret, (salt, password_hash, key_version, _) in accounts],
+        page_size=len(accounts), fetch=True)
+    ids = {username: user_id for user_id, username in created}
+
+    keys = [(ids[username], version, wrapped_key)
+            for username, _, (_, _, _, wrapped) in accounts if username in ids
+            for version, wrapped_key in wrapped]
+    if keys:
+        execute_values(cur, 'INSERT INTO data_keys (user_id, version, wrapped_key) VALUES %s', keys, page_size=len(keys))
+    conn.commit()
+    return [account for account in accounts if account[0] in ids]
+
+# Never overwrites: the secrets of an earlier run may not have been handed out yet
+def open_secrets_file(path):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    return open(fd, 'w', encoding='utf-8', newline='')
+
+def print_skipped(reason, usernames, shown=20):
+    if usernames:
+        names = ', '.join(usernames[:shown]) + (f" (+{len(usernames) - shown} more)" if len(usernames) > shown else "")
+        print(f"SKIP {len(usernames)} {reason}: {names}")
+
+def create_users(path, secrets_path, workers, batch_size, dry_run):
+    timer = StageTimer()
+    kdf_params = kdf.DEFAULT_PARAMS
+
+    with timer.stage("read + validate"):
+        users, problems = validate_new_users(read_records(path, ['username', 'password']))
+    for problem in problems:
+        print(f"SKIP {problem}")
+
+    conn = db_pool.get_connection()
+    cur = conn.cursor()
+    try:
+        with timer.stage("check existing", len(users)):
+            taken = existing_usernames(cur, [username for username, _ in users])
+        print_skipped("already exist", sorted(taken))
+        users = [(username, password) for username, password in users if username not in taken]
+        conn.rollback()
+
+        if not users:
+            print("\nNothing to create.")
+            return timer
+
+        if dry_run:
+            # One derivation is enough to estimate the pool's run time
+            with timer.stage("sample KDF run", 1):
+                started = time.perf_counter()
+                derive_account('dry-run-password', kdf_params)
+                one = time.perf_counter() - started
+            print(f"\nDRY RUN: would create {len(users)} users ({kdf_params}), "
+                  f"about {one * len(users) / max(1, workers):.1f} s of key derivation on {workers} processes")
+            return timer
+
+        created = 0
+        insert_seconds = 0.0
+        started = time.perf_counter()
+        # 'spawn' like kdf_executor: the workers do not inherit the database connection
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool, \
+                open_secrets_file(secrets_path) as secrets_file:
+            secrets = csv.writer(secrets_file)
+            secrets.writerow(['username', 'totp_secret', 'totp_uri'])
+
+            derived = pool.map(derive_account, [password for _, password in users], [kdf_params] * len(users),
+                               chunksize=max(1, min(32, len(users) // (workers * 4) or 1)))
+            batch = []
+            # Batches are inserted while the pool keeps deriving the next ones
+            for (username, _), account in zip(users, derived):
+                batch.append((username, pyotp.random_base32(), account))
+                if len(batch) == batch_size:
+                    insert_started = time.perf_counter()
+                    inserted = insert_accounts(conn, cur, batch, kdf_params)
+                    insert_seconds += time.perf_counter() - insert_started
+                    created += write_secrets(secrets, inserted)
+                    print(f"  ...{created} users created")
+                    batch = []
+            if batch:
+                insert_started = time.perf_counter()
+                inserted = insert_accounts(conn, cur, batch, kdf_params)
+                insert_seconds += time.perf_counter() - insert_started
+                created += write_secrets(secrets, inserted)
+
+        timer.add("derive keys (pool)", time.perf_counter() - started - insert_seconds, len(users))
+        timer.add("insert batches", insert_seconds, created)
+        print(f"\nSUCCESS: Created {created} users; 2FA secrets written to {secrets_path}")
+        if created < len(users):
+            print(f"({len(users) - created} usernames were taken while this ran)")
+        return timer
+    finally:
+        cur.close()
+        conn.close()
+
+def write_secrets(secrets, accounts):
+    for username, two_factor_secret, _ in accounts:
+        secrets.writerow([username, two_factor_secret, totp_qr.provisioning_uri(username, two_factor_secret)])
+    return len(accounts)
+
+# 4. DELETE
+# Deleting the users row removes passwords, data keys and tombstones too (ON DELETE CASCADE)
+def delete_users(path, batch_size, dry_run):
+    timer = StageTimer()
+
+    with timer.stage("read"):
+        usernames = read_usernames(read_records(path, ['username']))
+
+    conn = db_pool.get_connection()
+    cur = conn.cursor()
+    try:
+        with timer.stage("look up", len(usernames)):
+            cur.execute('''
+                SELECT u.id, u.username, (SELECT count(*) FROM passwords p WHERE p.user_id = u.id)
+                FROM users u WHERE u.username = ANY(%s) ORDER BY u.id
+            ''', (usernames,))
+            found = cur.fetchall()
+        conn.rollback()
+
+        print_skipped("not found", sorted(set(usernames) - {username for _, username, _ in found}))
+        entries = sum(count for _, _, count in found)
+
+        if dry_run:
+            print(f"\nDRY RUN: would delete {len(found)} users and {entries} password entries")
+            return timer
+
+        deleted = 0
+        with timer.stage("delete batches", len(found)):
+            for start in range(0, len(found), batch_size):
+                ids = [user_id for user_id, _, _ in found[start:start + batch_size]]
+                cur.execute('DELETE FROM users WHERE id = ANY(%s)', (ids,))
+                deleted += cur.rowcount
+                conn.commit()
+                print(f"  ...{deleted} users deleted")
+        print(f"\nSUCCESS: Deleted {deleted} users and their {entries} password entries")
+        return timer
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bulk create or delete users")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    create = commands.add_parser('create', help="create users from a CSV/JSON file (username, password)")
+    create.add_argument('path')
+    create.add_argument('--secrets', help="where to write the new 2FA secrets (default: <input>-2fa.csv)")
+    create.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="key derivation processes (each needs the KDF's memory cost)")
+    create.add_argument('--batch', type=int, default=ADMIN_BATCH, help="users per transaction")
+    create.add_argument('--dry-run', action='store_true', help="validate and estimate, write nothing")
+
+    delete = commands.add_parser('delete', help="delete the users listed in a CSV/JSON file (username)")
+    delete.add_argument('path')
+    delete.add_argument('--batch', type=int, default=ADMIN_BATCH, help="users per transaction")
+    delete.add_argument('--dry-run', action='store_true', help="report what would be deleted")
+    delete.add_argument('--yes', action='store_true', help="really delete (required without --dry-run)")
+    args = parser.parse_args()
+
+    if args.batch < 1 or getattr(args, 'workers', 1) < 1:
+        sys.exit("ERROR: --batch and --workers must be at least 1")
+
+    try:
+        if args.command == 'create':
+            secrets_path = args.secrets or os.path.splitext(args.path)[0] + '-2fa.csv'
+            if not args.dry_run and os.path.exists(secrets_path):
+                sys.exit(f"ERROR: {secrets_path} already exists; move it or pass --secrets")
+            timer = create_users(args.path, secrets_path, args.workers, args.batch, args.dry_run)
+        else:
+            if not args.dry_run and not args.yes:
+                sys.exit("ERROR: Deleting is permanent; pass --yes (or --dry-run to preview)")
+            timer = delete_users(args.path, args.batch, args.dry_run)
+    except InputError as e:
+        sys.exit(f"ERROR: {e}")
+    timer.report()
@@ -1,27 +1,185 @@
-from flask import Flask, request, jsonify, render_template, make_response
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from flask import Blueprint, Flask, current_app, request, jsonify, render_template, make_response, g, Response, stream_with_context, url_for
+from flask.json.provider import DefaultJSONProvider
+from flask_compress import Compress
+from werkzeug.middleware.proxy_fix import ProxyFix
+from psycopg2.extras import RealDictCursor, execute_values
 import pyotp
+import assets
 import crypto_manager
+import kdf
+import db_pool
+import kdf_executor
+import metrics
+import rate_limit
+import session_cache
+import totp_qr
+import user_cache
+import vault_export
+import vault_import
+import vault_keys
 import jwt 
+import csv
 import datetime
+import io
+import json
 import os
-import qrcode
-import base64
-from io import BytesIO
+import shutil
+import tempfile
+import time
 from functools import wraps
 from dotenv import load_dotenv
 
 load_dotenv()
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+# jsonify() output counts as the request's 'json' phase
+class TimedJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        with metrics.phase('json'):
+            return super().dumps(obj, **kwargs)
+
+# All routes and request hooks live on this blueprint; create_app() puts them on an app.
+bp = Blueprint('vault', __name__)
+
+# gzip/brotli/zstd for JSON, HTML and text assets, picked from the client's Accept-Encoding.
+# Streams are compressed as they go; the import progress (NDJSON) is left alone so it stays live.
+compress = Compress()
+
+# Behind a reverse proxy (e.g. Render) the client address is in X-Forwarded-For.
+# Set PROXY_HOPS to the number of proxies in front of gunicorn so the rate limiter sees real IPs.
+PROXY_HOPS = int(os.environ.get('PROXY_HOPS', 0))
+
+# UTILITY: Application factory
+# gunicorn builds the app once in its master process and forks the workers from it
+# (preload_app in gunicorn_config.py), so the imports above are paid once and shared.
+# Per-worker resources (DB pool, KDF pool, cache contents) are still created lazily in each worker.
+def create_app(config=None):
+    app = Flask(__name__)
+    app.json = TimedJSONProvider(app)
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+    if config:
+        app.config.update(config)
+    if PROXY_HOPS:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS)
+    compress.init_app(app)
+    app.register_blueprint(bp)
+    assets.static_hashes(app.static_folder) # Hash the static files before the workers fork
+    return app
+
+# `app` stays importable for `gunicorn app:app`, `python app.py` and scripts; it is built on first use
+def __getattr__(name):
+    if name == 'app':
+        app = globals()['app'] = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+UNLOCK_COOKIE = 'vault_unlock'
+RECENT_WRITE_COOKIE = 'vault_wrote'
+RECENT_WRITE_SECONDS = int(os.environ.get('RECENT_WRITE_SECONDS', 5)) # Longer than the replicas' usual lag
+
+PAGE_SIZE_DEFAULT = 100
+PAGE_SIZE_MAX = 500
+STREAM_BATCH = 200 # Rows fetched per round-trip from the server-side cursor
+SEARCH_LIMIT_DEFAULT = 20
+SEARCH_LIMIT_MAX = 100
+BATCH_MAX_OPS = 1000
 
 # UTILITY: Database Connection
-def get_db_connection():
-    conn = psycopg2.connect(os.environ.get('DATABASE_URL'))
+# Connections come from a per-worker pool; conn.close() hands them back.
+# readonly=True lets a read replica answer (see read_db_connection).
+def get_db_connection(readonly=False):
+    conn = read_db_connection() if readonly else db_pool.get_connection()
+    g.setdefault('db_conns', []).append(conn)
     return conn
 
+# UTILITY: Connection for reads that may come from a replica (streams close it themselves)
+# A client that wrote in the last RECENT_WRITE_SECONDS reads from the primary, so it sees its
+# own changes; everyone else reads from a replica, the same one for the whole request.
+def read_db_connection():
+    if wrote_recently():
+        metrics.DB_REPLICA_READS.labels('recent_write').inc()
+        return db_pool.get_connection()
+    conn = db_pool.get_connection(readonly=True, replica=g.get('replica'))
+    if conn.replica is not None:
+        g.replica = conn.replica
+    return conn
+
+def wrote_recently():
+    if g.get('wrote'):
+        return True
+    try:
+        return float(request.cookies.get(RECENT_WRITE_COOKIE) or 0) > time.time()
+    except ValueError:
+        return False
+
+# UTILITY: Call after a write, so this client's next reads stay on the primary for a while
+def mark_write():
+    g.wrote = True
+
+@bp.after_app_request
+def attach_recent_write_cookie(resp):
+    if g.get('wrote') and db_pool.get_replicas():
+        resp.set_cookie(RECENT_WRITE_COOKIE, str(int(time.time()) + RECENT_WRITE_SECONDS),
+                        max_age=RECENT_WRITE_SECONDS, httponly=True, samesite='Strict')
+    return resp
+
+@bp.teardown_app_request
+def release_db_connections(exc):
+    # Safety net: return anything a route forgot to close (e.g. after an error)
+    for conn in g.pop('db_conns', []):
+        conn.close()
+
+# UTILITY: Per-request timing (see metrics.py)
+@bp.before_app_request
+def start_request_timer():
+    # Metric labels use the plain view name ('login', not 'vault.login')
+    metrics.start_request((request.endpoint or 'unmatched').removeprefix('vault.'), request.method)
+
+@bp.after_app_request
+def finish_request_timer(resp):
+    timer = metrics.current()
+    if timer is not None:
+        resp.headers['Server-Timing'] = timer.server_timing()
+        # Recorded once the body is fully sent, so streamed responses count in full
+        status = resp.status_code
+        resp.call_on_close(lambda: timer.finish(status))
+    return resp
+
+# UTILITY: Content-hashed static URLs for the templates (see assets.py)
+@bp.app_template_global()
+def asset_url(filename):
+    return url_for('static', filename=filename, v=assets.static_hashes(current_app.static_folder).get(filename))
+
+@bp.after_app_request
+def static_cache_headers(resp):
+    if request.endpoint == 'static' and resp.status_code in (200, 304):
+        if assets.is_current(current_app.static_folder, request.view_args.get('filename'), request.args.get('v')):
+            resp.cache_control.no_cache = None
+            resp.cache_control.public = True
+            resp.cache_control.max_age = assets.IMMUTABLE_MAX_AGE
+            resp.cache_control.immutable = True
+        else:
+            resp.cache_control.no_cache = True
+    return resp
+
+@bp.app_errorhandler(kdf_executor.KDFBusy)
+def kdf_busy(e):
+    resp = jsonify({"error": "Server busy, please try again."})
+    resp.headers['Retry-After'] = str(kdf_executor.KDF_RETRY_AFTER)
+    return resp, 503
+
+@bp.app_errorhandler(rate_limit.RateLimited)
+def rate_limited(e):
+    resp = jsonify({"error": "Too many attempts, please try again later."})
+    resp.headers['Retry-After'] = str(e.retry_after)
+    return resp, 429
+
+@bp.app_errorhandler(db_pool.PoolTimeout)
+def pool_exhausted(e):
+    print(f"DB Pool Error: {e}") # Log internally
+    resp = jsonify({"error": "Server busy, please try again."})
+    resp.headers['Retry-After'] = '1'
+    return resp, 503
+
 # UTILITY: The "Bouncer"
 def token_required(f):
     @wraps(f)
@@ -34,7 +192,7 @@ def token_required(f):
             return jsonify({'message': 'Token is missing!'}), 401
         
         try:
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
+            data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
             current_user_id = data['user_id']
         except Exception:
             return jsonify({'message': 'Token is invalid!'}), 401
@@ -43,31 +201,174 @@ def token_required(f):
     
     return decorated
 
-def verify_password_logic(user_id, master_password):
-    conn = get_db_connection()
+# readonly=False for routes that act on the answer (a replica may still have the old password)
+def verify_password_logic(user_id, master_password, readonly=True):
+    conn = get_db_connection(readonly=readonly)
     cur = conn.cursor(cursor_factory=RealDictCursor)
     cur.execute('SELECT * FROM users WHERE id = %s', (user_id,))
     user = cur.fetchone()
     cur.close()
     conn.close()
 
-    if not user: return None
+    if not user:
+        user_cache.invalidate(user_id)
+        return None, None
+    user_cache.put(user)
     
-    if crypto_manager.verify_master_password(master_password, user['salt'], user['password_hash']):
-        return user
-    return None
+    kek = unlock_with_password(user, master_password)
+    if kek is None:
+        return None, None
+    return user, kek
+
+# UTILITY: Public user record (id, username) for a session, from the per-worker cache when possible
+def load_user_record(user_id):
+    record = user_cache.get(user_id)
+    if record is not None:
+        return record
+
+    conn = get_db_connection(readonly=True)
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute('SELECT id, username FROM users WHERE id = %s', (user_id,))
+    user = cur.fetchone()
+    cur.close()
+    conn.close()
+    return user_cache.put(user) if user else None
+
+# UTILITY: Rate limit a request that is about to run the KDF (raises RateLimited, see rate_limit.py)
+# Always limited per client IP, plus any username/account limits passed in.
+def limit_kdf(*limits):
+    rate_limit.hit([rate_limit.ip_limit(request.remote_addr), *limits])
+
+# UTILITY: Check a password against a user row and return its key-encryption key (or None)
+# One KDF run (in the KDF pool) gives us both the password check and the key.
+# The key only unwraps the vault's data keys (see vault_keys.py).
+def unlock_with_password(user, master_password):
+    limit_kdf(rate_limit.account_limit(user['id']))
+    master_secret = kdf_executor.derive_master_secret(master_password, bytes.fromhex(user['salt']), user['kdf_params'])
+    if not crypto_manager.verify_master_secret(master_secret, user['password_hash']):
+        return None
+    return crypto_manager.encryption_key_from_secret(master_secret)
+
+# UTILITY: Get the vault's keyring for a request (see vault_keys.py)
+# Uses the unlocked session when the client sent no master password,
+# otherwise runs the normal check (and optionally unlocks the session).
+def unlock_logic(user_id, data):
+    master_password = data.get('master_password')
+    token = request.cookies.get('token')
+    wrap_secret = request.cookies.get(UNLOCK_COOKIE)
+
+    if not master_password:
+        kek = session_cache.load_key(token, wrap_secret)
+        if kek is None: return None
+        # Another session may have changed the password (or KDF settings) since this key was cached
+        keyring = open_keyring(user_id, kek)
+        if keyring is None:
+            session_cache.clear(token)
+            return None
+        g.vault_unlocked = True
+        return keyring
+
+    user, kek = verify_password_logic(user_id, master_password)
+    if not user: return None
+
+    if data.get('unlock_session') and session_cache.UNLOCK_ENABLED:
+        g.unlock_secret = session_cache.store_key(token, kek, wrap_secret)
+        g.vault_unlocked = True
+    return open_keyring(user_id, kek)
+
+def open_keyring(user_id, kek):
+    conn = get_db_connection()
+    try:
+        keyring = vault_keys.open_keyring(conn, user_id, kek)
+    except vault_keys.KeyringError:
+        keyring = None
+    finally:
+        conn.close()
+    # mark_write() also keeps this request's entry reads on the primary, where no entry
+    # can be on a key that is already gone
+    if keyring is not None and keyring.retired_versions():
+        g.reencrypt = (user_id, keyring)
+        mark_write()
+    return keyring
+
+# UTILITY: `rows` as this keyring can read them
+# A replica can still return entries on a data key the primary has deleted since (their rotation
+# finished in between). Those are read again on the primary, and left out if deleted there.
+def current_entries(user_id, keyring, rows):
+    stale = [row['id'] for row in rows if not keyring.has_version(row['key_version'])]
+    if not stale:
+        return rows
+
+    conn = db_pool.get_connection()
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute('''
+            SELECT id, site_name, site_username, encrypted_password, ciphertext, key_version FROM passwords
+            WHERE user_id = %s AND id = ANY(%s)
+        ''', (user_id, stale))
+        fresh = {row['id']: row for row in cur.fetchall()}
+        cur.close()
+    finally:
+        conn.close()
+
+    entries = []
+    for row in rows:
+        if row['id'] in stale:
+            row = fresh.get(row['id'])
+        if row is not None:
+            entries.append(row)
+    return entries
+
+# UTILITY: Move a batch of entries off retired data keys once the response is sent
+@bp.after_app_request
+def schedule_reencrypt(resp):
+    pending = g.pop('reencrypt', None)
+    if pending:
+        resp.call_on_close(lambda: reencrypt_after_response(*pending))
+    return resp
+
+def reencrypt_after_response(user_id, keyring):
+    conn = db_pool.get_connection()
+    try:
+        vault_keys.reencrypt_batch(conn, user_id, keyring)
+    except Exception as e:
+        print(f"Re-encrypt Error: {e}") # Log internally
+    finally:
+        conn.close()
+
+def locked_response():
+    return jsonify({"error": "Invalid Password"}), 401
+
+@bp.after_app_request
+def attach_unlock_cookie(resp):
+    if g.get('unlock_secret'):
+        resp.set_cookie(UNLOCK_COOKIE, g.unlock_secret, httponly=True, samesite='Strict')
+    if g.get('vault_unlocked'):
+        resp.headers['X-Vault-Unlocked'] = '1'
+    return resp
 
 # --- ROUTES ---
 
-@app.route('/')
+@bp.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/privacy')
+@bp.route('/privacy')
 def privacy():
     return render_template('privacy.html')
 
-@app.route('/api/register', methods=['POST'])
+# Service worker for the offline shell. Served from the root so it controls the whole app;
+# always revalidated, since a changed shell has to reach clients right away.
+@bp.route('/sw.js')
+def service_worker():
+    shell = [url_for('vault.index')] + [asset_url(name) for name in assets.SHELL_ASSETS]
+    shell = list(dict.fromkeys(shell + assets.manifest_urls(current_app.static_folder)))
+    script = render_template('sw.js', shell=shell, version=assets.shell_version(shell, os.path.join(current_app.root_path, current_app.template_folder)))
+    resp = Response(script, mimetype='application/javascript')
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+@bp.route('/api/register', methods=['POST'])
 def register():
     data = request.json
     # MOBILE FIX: Strip whitespace automatically
@@ -93,6 +394,8 @@ def register():
     if len(password) < 8:
         return jsonify({"error": "Password must be at least 8 characters"}), 400
 
+    limit_kdf()
+
     conn = get_db_connection()
     cur = conn.cursor()
 
@@ -104,31 +407,33 @@ def register():
 
         # 3. Create Credentials
         salt = crypto_manager.generate_salt()
-        password_hash = crypto_manager.hash_master_password(password, salt)
+        master_secret = kdf_executor.derive_master_secret(password, salt, kdf.DEFAULT_PARAMS)
+        password_hash = crypto_manager.auth_hash_from_secret(master_secret)
         two_factor_secret = pyotp.random_base32()
 
-        # 4. Save to DB
+        # 4. Save to DB, with the vault's first data key (wrapped by the password's key)
+        keyring = vault_keys.new_keyring()
         cur.execute('''
-            INSERT INTO users (username, password_hash, salt, two_factor_secret)
-            VALUES (%s, %s, %s, %s)
-        ''', (username, password_hash, salt.hex(), two_factor_secret))
+            INSERT INTO users (username, password_hash, salt, two_factor_secret, kdf_params, data_key_version)
+            VALUES (%s, %s, %s, %s, %s, %s) RETURNING id
+        ''', (username, password_hash, salt.hex(), two_factor_secret, kdf.DEFAULT_PARAMS, keyring.current_version))
+        vault_keys.insert_keys(cur, cur.fetchone()[0], crypto_manager.encryption_key_from_secret(master_secret), keyring)
         conn.commit()
+        mark_write()
 
-        # 5. Generate QR Code
-        totp_uri = pyotp.totp.TOTP(two_factor_secret).provisioning_uri(name=username, issuer_name="Password Vault")
-        
-        img = qrcode.make(totp_uri)
-        buffered = BytesIO()
-        img.save(buffered, format="PNG")
-        qr_b64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
+        # 5. Provisioning URI (the page fetches its QR code from /api/2fa_qr with the setup token)
+        totp_uri = totp_qr.provisioning_uri(username, two_factor_secret)
 
         return jsonify({
             "message": "User created", 
-            "qr_code": qr_b64, 
             "secret": two_factor_secret,
-            "totp_uri": totp_uri 
+            "totp_uri": totp_uri,
+            "qr_token": totp_qr.setup_token(totp_uri, current_app.config['SECRET_KEY'])
         }), 201
 
+    except kdf_executor.KDFBusy:
+        conn.rollback()
+        raise
     except Exception as e:
         conn.rollback()
         print(f"Register Error: {e}") # Log internally
@@ -137,12 +442,28 @@ def register():
         cur.close()
         conn.close()
 
-@app.route('/api/login', methods=['POST'])
+# 2FA setup QR code (SVG) for the registration the setup token came from, cached for the setup window
+# POST so the secret inside the token stays out of access logs and browser history
+@bp.route('/api/2fa_qr', methods=['POST'])
+def two_factor_qr():
+    data = request.get_json(silent=True) or {}
+    totp_uri = totp_qr.uri_from_setup_token(data.get('qr_token'), current_app.config['SECRET_KEY'])
+    if totp_uri is None:
+        return jsonify({"error": "Invalid or expired setup token"}), 400
+
+    resp = Response(totp_qr.svg(totp_uri), mimetype='image/svg+xml')
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp, 200
+
+@bp.route('/api/login', methods=['POST'])
 def login():
     data = request.json
     # MOBILE FIX: Strip whitespace to handle auto-correct spaces
     username = data.get('username', '').strip()
     password = data.get('password', '').strip()
+
+    # Before the lookup, so guessing usernames is limited too
+    limit_kdf(rate_limit.username_limit(username))
     
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
@@ -154,17 +475,33 @@ def login():
 
     if not user: return jsonify({"error": "User not found"}), 404
 
-    if not crypto_manager.verify_master_password(password, user['salt'], user['password_hash']):
+    master_secret = kdf_executor.derive_master_secret(password, bytes.fromhex(user['salt']), user['kdf_params'])
+    if not crypto_manager.verify_master_secret(master_secret, user['password_hash']):
         return jsonify({"error": "Invalid Password"}), 401
     
     totp = pyotp.TOTP(user['two_factor_secret'])
     if not totp.verify(data.get('2fa_code')):
         return jsonify({"error": "Invalid 2FA Code"}), 401
 
+    # Move the account to the current KDF settings, or at least to the single-pass hash scheme
+    if user['kdf_params'] != kdf.DEFAULT_PARAMS:
+        upgrade_kdf(user, password, master_secret)
+    elif crypto_manager.needs_rehash(user['password_hash']):
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute('UPDATE users SET password_hash = %s WHERE id = %s',
+                    (crypto_manager.auth_hash_from_secret(master_secret), user['id']))
+        conn.commit()
+        cur.close()
+        conn.close()
+        mark_write()
+
+    user_cache.put(user) # The page calls check_session right after logging in
+
     token = jwt.encode({
         'user_id': user['id'],
         'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=60)
-    }, app.config['SECRET_KEY'], algorithm="HS256")
+    }, current_app.config['SECRET_KEY'], algorithm="HS256")
 
     resp = make_response(jsonify({
         "message": "Login Successful", 
@@ -174,110 +511,367 @@ def login():
     
     return resp, 200
 
-@app.route('/api/logout', methods=['POST'])
+# UTILITY: Re-key an account with the current KDF settings (runs once, at login)
+# The key-encryption key comes from the KDF, so the data keys are rewrapped in the same transaction.
+# A failure is only logged: the account keeps working with its old settings.
+def upgrade_kdf(user, password, master_secret):
+    new_salt = crypto_manager.generate_salt()
+    new_secret = kdf_executor.derive_master_secret(password, new_salt, kdf.DEFAULT_PARAMS)
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        vault_keys.rewrap(conn, user['id'], crypto_manager.encryption_key_from_secret(master_secret),
+                          crypto_manager.encryption_key_from_secret(new_secret))
+        cur.execute('UPDATE users SET password_hash = %s, salt = %s, kdf_params = %s WHERE id = %s',
+                    (crypto_manager.auth_hash_from_secret(new_secret), new_salt.hex(), kdf.DEFAULT_PARAMS, user['id']))
+        conn.commit()
+        mark_write()
+    except Exception as e:
+        conn.rollback()
+        print(f"KDF Upgrade Error: {e}") # Log internally
+    finally:
+        cur.close()
+        conn.close()
+
+@bp.route('/api/logout', methods=['POST'])
 def logout():
+    session_cache.clear(request.cookies.get('token'))
     resp = make_response(jsonify({"message": "Logged out"}))
     resp.set_cookie('token', '', expires=0)
+    resp.set_cookie(UNLOCK_COOKIE, '', expires=0)
     return resp, 200
 
-@app.route('/api/check_session', methods=['GET'])
+@bp.route('/api/check_session', methods=['GET'])
 @token_required
 def check_session(current_user_id):
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute('SELECT username FROM users WHERE id = %s', (current_user_id,))
-    user = cur.fetchone()
-    cur.close()
-    conn.close()
-
+    user = load_user_record(current_user_id)
     if user:
         return jsonify({"status": "valid", "user_id": current_user_id, "username": user['username']}), 200
     return jsonify({"message": "User not found"}), 401
 
-@app.route('/api/add_password', methods=['POST'])
+@bp.route('/api/add_password', methods=['POST'])
 @token_required 
 def add_password_entry(current_user_id):
     data = request.json
-    master_password = data.get('master_password') 
     
-    user = verify_password_logic(current_user_id, master_password)
-    if not user: return jsonify({"error": "Invalid Password"}), 401
-
-    salt_bytes = bytes.fromhex(user['salt'])
-    encryption_key = crypto_manager.derive_encryption_key(master_password, salt_bytes)
-    encrypted_pw = crypto_manager.encrypt_val(encryption_key, data.get('site_password'))
+    keyring = unlock_logic(current_user_id, data)
+    if keyring is None: return locked_response()
+    with metrics.phase('crypto'):
+        encrypted_pw = keyring.encrypt(data.get('site_password'))
 
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute('''
-        INSERT INTO passwords (user_id, site_name, site_username, encrypted_password)
-        VALUES (%s, %s, %s, %s)
-    ''', (current_user_id, data.get('site_name'), data.get('site_username'), encrypted_pw))
+        INSERT INTO passwords (user_id, site_name, site_username, ciphertext, key_version)
+        VALUES (%s, %s, %s, %s, %s)
+    ''', (current_user_id, data.get('site_name'), data.get('site_username'), encrypted_pw, keyring.current_version))
     conn.commit()
+    mark_write()
     cur.close()
     conn.close()
     return jsonify({"message": "Password Saved"}), 201
 
-@app.route('/api/get_passwords', methods=['POST'])
+# UTILITY: Vault version (bumped by the passwords triggers on every add, edit and delete)
+def load_vault_version(user_id):
+    conn = get_db_connection(readonly=True)
+    cur = conn.cursor()
+    cur.execute('SELECT vault_version FROM users WHERE id = %s', (user_id,))
+    row = cur.fetchone()
+    cur.close()
+    conn.close()
+    return row[0] if row else None
+
+# UTILITY: 304 when the client's copy (If-None-Match) is still current
+# Version ETags are weak: they name the content, not the bytes (compression changes those).
+def not_modified(etag):
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    resp = Response(status=304)
+    resp.set_etag(etag, weak=True)
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+@bp.route('/api/get_passwords', methods=['POST'])
 @token_required
 def get_all_passwords(current_user_id):
     data = request.json
-    master_password = data.get('master_password')
 
-    user = verify_password_logic(current_user_id, master_password)
-    if not user: return jsonify({"error": "Invalid Password"}), 401
+    # Paging is opt-in: without 'limit'/'cursor' the whole vault comes back as one (streamed) list
+    paged = 'limit' in data or 'cursor' in data
+    try:
+        after_id = int(data.get('cursor') or 0)
+        limit = min(int(data.get('limit') or PAGE_SIZE_DEFAULT), PAGE_SIZE_MAX)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid cursor or limit"}), 400
+    if limit < 1:
+        return jsonify({"error": "Invalid cursor or limit"}), 400
 
-    salt_bytes = bytes.fromhex(user['salt'])
-    encryption_key = crypto_manager.derive_encryption_key(master_password, salt_bytes)
+    # Unchanged vault: answer before unlocking, so no KDF run and no decryption
+    version = load_vault_version(current_user_id)
+    if version is None: return jsonify({"message": "User not found"}), 401
+    etag = f"v{version}-{after_id}-{limit}" if paged else f"v{version}"
+    unchanged = not_modified(etag)
+    if unchanged: return unchanged
 
-    conn = get_db_connection()
+    keyring = unlock_logic(current_user_id, data)
+    if keyring is None: return locked_response()
+
+    # The stream owns this connection (not the request teardown), it is closed when the last row is sent.
+    # Same replica as the version above, so the rows are at least as new as the ETag.
+    conn = read_db_connection()
+    try:
+        # Named cursor = server-side cursor, rows arrive STREAM_BATCH at a time
+        cur = conn.cursor(name='vault_rows', cursor_factory=RealDictCursor)
+        cur.itersize = STREAM_BATCH
+        if paged:
+            # Keyset pagination: one extra row tells us whether another page exists
+            cur.execute('''
+                SELECT id, site_name, site_username, encrypted_password, ciphertext, key_version FROM passwords
+                WHERE user_id = %s AND id > %s ORDER BY id LIMIT %s
+            ''', (current_user_id, after_id, limit + 1))
+        else:
+            cur.execute('''
+                SELECT id, site_name, site_username, encrypted_password, ciphertext, key_version FROM passwords
+                WHERE user_id = %s ORDER BY id
+            ''', (current_user_id,))
+    except Exception:
+        conn.close()
+        raise
+
+    resp = Response(stream_with_context(stream_vault_json(cur, conn, current_user_id, keyring, paged, limit)),
+                    mimetype='application/json')
+    resp.set_etag(etag, weak=True)
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp, 200
+
+# UTILITY: Stream decrypted entries as JSON, one entry per line
+# Layout (paged):  {"entries": [\n{...},\n{...}\n], "next_cursor": 42}
+# Layout (full):   [\n{...},\n{...}\n]
+# so the client can render each line as soon as it arrives.
+def stream_vault_json(cur, conn, user_id, keyring, paged, limit):
+    try:
+        yield '{"entries": [' if paged else '['
+        count = 0
+        last_id = None
+        has_more = False
+        separator = '\n'
+        for row in cur:
+            if paged and count == limit:
+                has_more = True
+                break
+            count += 1
+            last_id = row['id']
+            entries = current_entries(user_id, keyring, [row])
+            if not entries: continue
+            row = entries[0]
+            try:
+                with metrics.phase('crypto'):
+                    decrypted_pw = keyring.decrypt_entry(row)
+            except Exception: continue
+            with metrics.phase('json'):
+                line = json.dumps({
+                    "id": row['id'],
+                    "site": row['site_name'],
+                    "username": row['site_username'],
+                    "password": decrypted_pw
+                })
+            yield separator + line
+            separator = ',\n'
+
+        if paged:
+            yield '\n], "next_cursor": %s}' % json.dumps(last_id if has_more else None)
+        else:
+            yield '\n]'
+    finally:
+        cur.close()
+        conn.close()
+
+# Vault list without any decryption: just what the UI shows until someone asks for a password
+@bp.route('/api/list_entries', methods=['GET'])
+@token_required
+def list_entries(current_user_id):
+    try:
+        after_id = int(request.args.get('cursor') or 0)
+        limit = min(int(request.args.get('limit') or PAGE_SIZE_DEFAULT), PAGE_SIZE_MAX)
+    except ValueError:
+        return jsonify({"error": "Invalid cursor or limit"}), 400
+    if limit < 1:
+        return jsonify({"error": "Invalid cursor or limit"}), 400
+
+    conn = get_db_connection(readonly=True)
     cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute('SELECT id, site_name, site_username, encrypted_password FROM passwords WHERE user_id = %s', (current_user_id,))
+    # Version first: a change landing in between shows up again in the next delta, never goes missing
+    cur.execute('SELECT vault_version FROM users WHERE id = %s', (current_user_id,))
+    user = cur.fetchone()
+    cur.execute('''
+        SELECT id, site_name, site_username FROM passwords
+        WHERE user_id = %s AND id > %s ORDER BY id LIMIT %s
+    ''', (current_user_id, after_id, limit + 1))
     rows = cur.fetchall()
     cur.close()
     conn.close()
+    if not user: return jsonify({"message": "User not found"}), 401
 
-    results = []
-    for row in rows:
-        try:
-            decrypted_pw = crypto_manager.decrypt_val(encryption_key, row['encrypted_password'])
-            results.append({
-                "id": row['id'],
-                "site": row['site_name'],
-                "username": row['site_username'],
-                "password": decrypted_pw
-            })
-        except Exception: pass
-
-    return jsonify(results), 200
-
-@app.route('/api/update_password', methods=['PUT'])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return jsonify({
+        "entries": [{"id": row['id'], "site": row['site_name'], "username": row['site_username']} for row in rows],
+        "next_cursor": rows[-1]['id'] if has_more else None,
+        "version": user['vault_version']
+    }), 200
+
+# Delta sync: entries added/edited and ids deleted since the client's version (metadata only).
+# "reset" means the client's version is not from this vault (e.g. restored database): reload fully.
+@bp.route('/api/vault_changes', methods=['GET'])
+@token_required
+def vault_changes(current_user_id):
+    try:
+        since = int(request.args.get('since', ''))
+    except ValueError:
+        return jsonify({"error": "Invalid version"}), 400
+
+    conn = get_db_connection(readonly=True)
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cur.execute('SELECT vault_version FROM users WHERE id = %s', (current_user_id,))
+        user = cur.fetchone()
+        if user and since > user['vault_version'] and conn.replica is not None:
+            # The replica is behind the client's copy: only the primary can tell lag from a reset
+            cur.close()
+            conn.close()
+            conn = get_db_connection()
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute('SELECT vault_version FROM users WHERE id = %s', (current_user_id,))
+            user = cur.fetchone()
+        if not user: return jsonify({"message": "User not found"}), 401
+        version = user['vault_version']
+        etag = f"v{version}"
+        unchanged = not_modified(etag)
+        if unchanged: return unchanged
+        if since > version or since < 0:
+            return jsonify({"version": version, "reset": True}), 200
+
+        cur.execute('''
+            SELECT id, site_name, site_username FROM passwords
+            WHERE user_id = %s AND version > %s ORDER BY id
+        ''', (current_user_id, since))
+        changed = cur.fetchall()
+        cur.execute('''
+            SELECT entry_id FROM password_tombstones
+            WHERE user_id = %s AND version > %s ORDER BY entry_id
+        ''', (current_user_id, since))
+        deleted = [row['entry_id'] for row in cur.fetchall()]
+    finally:
+        cur.close()
+        conn.close()
+
+    resp = jsonify({
+        "version": version,
+        "changed": [{"id": row['id'], "site": row['site_name'], "username": row['site_username']} for row in changed],
+        "deleted": deleted
+    })
+    resp.set_etag(etag, weak=True)
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp, 200
+
+# Search site names and usernames in the database instead of in the browser.
+# Prefix matches rank first, then earlier substring matches; no decryption involved.
+@bp.route('/api/search', methods=['GET'])
+@token_required
+def search_entries(current_user_id):
+    query = request.args.get('q', '').strip()
+    try:
+        limit = min(int(request.args.get('limit') or SEARCH_LIMIT_DEFAULT), SEARCH_LIMIT_MAX)
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+    if not query or limit < 1:
+        return jsonify({"results": []}), 200
+
+    # Escape LIKE wildcards so the user's text is matched literally
+    escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+    conn = get_db_connection(readonly=True)
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute('''
+        SELECT id, site_name, site_username FROM passwords
+        WHERE user_id = %(user_id)s
+          AND (site_name ILIKE %(contains)s OR site_username ILIKE %(contains)s)
+        ORDER BY
+            CASE
+                WHEN lower(site_name) = lower(%(query)s) THEN 0
+                WHEN site_name ILIKE %(prefix)s THEN 1
+                WHEN site_username ILIKE %(prefix)s THEN 2
+                ELSE 3
+            END,
+            position(lower(%(query)s) IN lower(site_name || ' ' || site_username)),
+            length(site_name),
+            id
+        LIMIT %(limit)s
+    ''', {
+        "user_id": current_user_id,
+        "query": query,
+        "prefix": escaped + '%',
+        "contains": '%' + escaped + '%',
+        "limit": limit,
+    })
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+
+    return jsonify({
+        "results": [{"id": row['id'], "site": row['site_name'], "username": row['site_username']} for row in rows]
+    }), 200
+
+# Decrypt exactly one entry, on demand (copy / reveal / edit)
+@bp.route('/api/reveal_password', methods=['POST'])
+@token_required
+def reveal_password(current_user_id):
+    data = request.json
+
+    keyring = unlock_logic(current_user_id, data)
+    if keyring is None: return locked_response()
+
+    conn = get_db_connection(readonly=True)
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute('SELECT id, encrypted_password, ciphertext, key_version FROM passwords WHERE id = %s AND user_id = %s', (data.get('id'), current_user_id))
+    row = cur.fetchone()
+    cur.close()
+    conn.close()
+
+    entries = current_entries(current_user_id, keyring, [row]) if row else []
+    if not entries: return jsonify({"error": "Entry not found"}), 404
+    row = entries[0]
+
+    with metrics.phase('crypto'):
+        decrypted_pw = keyring.decrypt_entry(row)
+    return jsonify({"id": row['id'], "password": decrypted_pw}), 200
+
+@bp.route('/api/update_password', methods=['PUT'])
 @token_required
 def update_password_entry(current_user_id):
     data = request.json
     password_id = data.get('id')
-    master_password = data.get('master_password')
     
-    user = verify_password_logic(current_user_id, master_password)
-    if not user: return jsonify({"error": "Invalid Password"}), 401
-
-    salt_bytes = bytes.fromhex(user['salt'])
-    encryption_key = crypto_manager.derive_encryption_key(master_password, salt_bytes)
-    encrypted_pw = crypto_manager.encrypt_val(encryption_key, data.get('site_password'))
+    keyring = unlock_logic(current_user_id, data)
+    if keyring is None: return locked_response()
+    with metrics.phase('crypto'):
+        encrypted_pw = keyring.encrypt(data.get('site_password'))
 
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute('''
         UPDATE passwords 
-        SET site_name = %s, site_username = %s, encrypted_password = %s
+        SET site_name = %s, site_username = %s, ciphertext = %s, encrypted_password = NULL, key_version = %s, updated_at = now()
         WHERE id = %s AND user_id = %s
-    ''', (data.get('site_name'), data.get('site_username'), encrypted_pw, password_id, current_user_id))
+    ''', (data.get('site_name'), data.get('site_username'), encrypted_pw, keyring.current_version, password_id, current_user_id))
     conn.commit()
+    mark_write()
     cur.close()
     conn.close()
     return jsonify({"message": "Updated successfully"}), 200
 
-@app.route('/api/delete_password', methods=['DELETE'])
+@bp.route('/api/delete_password', methods=['DELETE'])
 @token_required
 def delete_password_entry(current_user_id):
     data = request.json
@@ -285,11 +879,207 @@ def delete_password_entry(current_user_id):
     cur = conn.cursor()
     cur.execute('DELETE FROM passwords WHERE id = %s AND user_id = %s', (data.get('id'), current_user_id))
     conn.commit()
+    mark_write()
     cur.close()
     conn.close()
     return jsonify({"message": "Deleted successfully"}), 200
 
-@app.route('/api/update_account', methods=['POST'])
+# Many adds/updates/deletes in one call: one key derivation, one transaction,
+# multi-row statements. Operations are applied grouped as adds, updates, deletes.
+@bp.route('/api/batch', methods=['POST'])
+@token_required
+def batch_operations(current_user_id):
+    data = request.json
+    operations = data.get('operations')
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"error": "operations must be a non-empty list"}), 400
+    if len(operations) > BATCH_MAX_OPS:
+        return jsonify({"error": f"At most {BATCH_MAX_OPS} operations per batch"}), 400
+
+    adds, updates, deletes = [], [], []
+    for i, op in enumerate(operations):
+        kind = op.get('op') if isinstance(op, dict) else None
+        if kind in ('update', 'delete') and not isinstance(op.get('id'), int):
+            return jsonify({"error": f"Operation {i} needs an id"}), 400
+        if kind in ('add', 'update') and not (op.get('site_name') and op.get('site_password')):
+            return jsonify({"error": f"Operation {i} needs site_name and site_password"}), 400
+
+        if kind == 'add': adds.append(op)
+        elif kind == 'update': updates.append(op)
+        elif kind == 'delete': deletes.append(op['id'])
+        else: return jsonify({"error": f"Operation {i} has an unknown type"}), 400
+
+    # Only writes that carry a password need the vault key (deletes never did)
+    if adds or updates:
+        keyring = unlock_logic(current_user_id, data)
+        if keyring is None: return locked_response()
+
+    with metrics.phase('crypto'):
+        new_rows = [(current_user_id, op['site_name'], op.get('site_username') or '',
+                     keyring.encrypt(op['site_password']), keyring.current_version) for op in adds]
+        changed_rows = [(op['id'], current_user_id, op['site_name'], op.get('site_username') or '',
+                         keyring.encrypt(op['site_password']), keyring.current_version) for op in updates]
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        added_ids = []
+        if new_rows:
+            added_ids = [row[0] for row in execute_values(cur, '''
+                INSERT INTO passwords (user_id, site_name, site_username, ciphertext, key_version)
+                VALUES %s RETURNING id
+            ''', new_rows, page_size=len(new_rows), fetch=True)]
+
+        updated = 0
+        if changed_rows:
+            execute_values(cur, '''
+                UPDATE passwords AS p
+                SET site_name = v.site_name, site_username = v.site_username,
+                    ciphertext = v.ciphertext, encrypted_password = NULL, key_version = v.key_version, updated_at = now()
+                FROM (VALUES %s) AS v (id, user_id, site_name, site_username, ciphertext, key_version)
+                WHERE p.id = v.id AND p.user_id = v.user_id
+            ''', changed_rows, page_size=len(changed_rows))
+            updated = cur.rowcount
+
+        deleted = 0
+        if deletes:
+            cur.execute('DELETE FROM passwords WHERE user_id = %s AND id = ANY(%s)', (current_user_id, deletes))
+            deleted = cur.rowcount
+
+        conn.commit()
+        mark_write()
+        return jsonify({"message": "Batch applied", "added": added_ids, "updated": updated, "deleted": deleted}), 200
+    except Exception as e:
+        conn.rollback()
+        print(f"Batch Error: {e}") # Log internally
+        return jsonify({"error": "An internal server error occurred."}), 500
+    finally:
+        cur.close()
+        conn.close()
+
+# Bulk import from a password manager CSV export or a vault archive (multipart upload, field 'file').
+# The file is read and written IMPORT_CHUNK rows at a time; progress is streamed
+# back as one JSON object per line.
+@bp.route('/api/import', methods=['POST'])
+@token_required
+def import_passwords(current_user_id):
+    upload = request.files.get('file')
+    if not upload: return jsonify({"error": "No file uploaded"}), 400
+
+    keyring = unlock_logic(current_user_id, request.form)
+    if keyring is None: return locked_response()
+
+    # Werkzeug closes uploads when the request ends, which is before a streamed
+    # response is sent, so the stream reads from its own copy (spills to disk when large)
+    spool = tempfile.SpooledTemporaryFile(max_size=vault_import.IMPORT_CHUNK * 1024)
+    shutil.copyfileobj(upload.stream, spool)
+    spool.seek(0)
+
+    text_stream = io.TextIOWrapper(spool, encoding='utf-8-sig', newline='')
+    try:
+        importer = open_importer(text_stream, request.form, current_user_id)
+    except (vault_import.ImportFormatError, vault_export.ArchiveError, UnicodeDecodeError, csv.Error) as e:
+        text_stream.close()
+        return jsonify({"error": str(e)}), 400
+    except Exception:
+        text_stream.close()
+        raise
+    if importer is None:
+        text_stream.close()
+        return jsonify({"error": "Invalid archive password"}), 401
+
+    mark_write() # Before the stream starts: the cookie goes out with the headers
+    return Response(stream_with_context(stream_import_progress(importer, text_stream, current_user_id, keyring)),
+                    mimetype='application/x-ndjson'), 200
+
+# UTILITY: Pick the reader for an upload
+# Vault archives (from /api/export) are restored with their archive password,
+# which defaults to the master password. Returns None if that password is wrong.
+def open_importer(text_stream, form, user_id):
+    first_line = text_stream.readline()
+    text_stream.seek(0)
+    if not vault_export.is_archive(first_line):
+        return vault_import.CsvImporter(text_stream)
+
+    importer = vault_export.ArchiveReader(text_stream)
+    archive_password = form.get('archive_password') or form.get('master_password')
+    if not archive_password:
+        return None
+    limit_kdf(rate_limit.account_limit(user_id))
+    if not importer.unlock(archive_password, kdf_executor.derive_master_secret):
+        return None
+    return importer
+
+def stream_import_progress(importer, text_stream, user_id, keyring):
+    # Like get_passwords, the stream owns its connection
+    conn = db_pool.get_connection()
+    imported = 0
+    try:
+        yield json.dumps({"format": importer.format}) + '\n'
+        for imported in vault_import.import_entries(conn, user_id, keyring, importer):
+            yield json.dumps({"imported": imported, "skipped": importer.skipped}) + '\n'
+
+        yield json.dumps({"done": True, "imported": imported, "skipped": importer.skipped}) + '\n'
+    except Exception as e:
+        conn.rollback()
+        print(f"Import Error: {e}") # Log internally
+        metrics.count_error()
+        yield json.dumps({"error": "Import stopped early.", "imported": imported}) + '\n'
+    finally:
+        conn.close()
+        text_stream.close()
+
+# Backup download: the vault is read from a server-side cursor and streamed out
+# as an encrypted archive (default) or a plain CSV. Accepts JSON or a normal form
+# post, so a browser can save the download straight to disk.
+@bp.route('/api/export', methods=['POST'])
+@token_required
+def export_vault(current_user_id):
+    data = request.get_json(silent=True) or request.form
+    export_format = data.get('format') or 'archive'
+    if export_format not in ('archive', 'csv'):
+        return jsonify({"error": "Unknown export format"}), 400
+
+    keyring = unlock_logic(current_user_id, data)
+    if keyring is None: return locked_response()
+
+    if export_format == 'archive':
+        # The archive gets its own password (the master password unless another is given)
+        archive_password = data.get('archive_password') or data.get('master_password')
+        if not archive_password:
+            return jsonify({"error": "An archive password is required"}), 400
+        limit_kdf(rate_limit.account_limit(current_user_id))
+        header, archive_key = vault_export.new_archive(archive_password, kdf_executor.derive_master_secret, kdf.DEFAULT_PARAMS)
+
+    # The stream owns this connection, like get_passwords
+    conn = read_db_connection()
+    rows = (entry for row in vault_export.iter_vault_rows(conn, current_user_id)
+            for entry in current_entries(current_user_id, keyring, [row]))
+    entries = vault_export.decrypted_entries(rows, keyring)
+    if export_format == 'archive':
+        lines = vault_export.archive_lines(entries, header, archive_key)
+        filename, mimetype = 'password-vault-backup.pvault', 'application/x-ndjson'
+    else:
+        lines = vault_export.csv_lines(entries)
+        filename, mimetype = 'password-vault-export.csv', 'text/csv'
+
+    resp = Response(stream_with_context(stream_export(lines, conn)), mimetype=mimetype)
+    resp.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp, 200
+
+def stream_export(lines, conn):
+    try:
+        yield from lines
+    except Exception as e:
+        # Headers are already sent, so all we can do is end the download early
+        print(f"Export Error: {e}") # Log internally
+        metrics.count_error()
+    finally:
+        lines.close()
+        conn.close()
+
+@bp.route('/api/update_account', methods=['POST'])
 @token_required
 def update_account(current_user_id):
     data = request.json
@@ -309,7 +1099,8 @@ def update_account(current_user_id):
     cur.execute('SELECT * FROM users WHERE id = %s', (current_user_id,))
     user = cur.fetchone()
 
-    if not crypto_manager.verify_master_password(current_password, user['salt'], user['password_hash']):
+    old_kek = unlock_with_password(user, current_password)
+    if old_kek is None:
         cur.close()
         conn.close()
         return jsonify({"error": "Current Password incorrect"}), 401
@@ -322,27 +1113,26 @@ def update_account(current_user_id):
             cur.execute('UPDATE users SET username = %s WHERE id = %s', (new_username, current_user_id))
 
         if new_password:
-            old_salt_bytes = bytes.fromhex(user['salt'])
-            old_key = crypto_manager.derive_encryption_key(current_password, old_salt_bytes)
-
-            cur.execute('SELECT id, encrypted_password FROM passwords WHERE user_id = %s', (current_user_id,))
-            rows = cur.fetchall()
-
             new_salt = crypto_manager.generate_salt()
-            new_hash = crypto_manager.hash_master_password(new_password, new_salt)
-            new_key = crypto_manager.derive_encryption_key(new_password, new_salt)
+            new_secret = kdf_executor.derive_master_secret(new_password, new_salt, kdf.DEFAULT_PARAMS)
+            new_hash = crypto_manager.auth_hash_from_secret(new_secret)
+            new_kek = crypto_manager.encryption_key_from_secret(new_secret)
 
-            for row in rows:
-                decrypted = crypto_manager.decrypt_val(old_key, row['encrypted_password'])
-                re_encrypted = crypto_manager.encrypt_val(new_key, decrypted)
-                cur.execute('UPDATE passwords SET encrypted_password = %s WHERE id = %s', (re_encrypted, row['id']))
+            # Only the data keys are rewrapped; the entries stay as they are
+            vault_keys.rewrap(conn, current_user_id, old_kek, new_kek)
 
-            cur.execute('UPDATE users SET password_hash = %s, salt = %s WHERE id = %s', 
-                        (new_hash, new_salt.hex(), current_user_id))
+            cur.execute('UPDATE users SET password_hash = %s, salt = %s, kdf_params = %s WHERE id = %s', 
+                        (new_hash, new_salt.hex(), kdf.DEFAULT_PARAMS, current_user_id))
 
         conn.commit()
+        mark_write()
+        session_cache.clear(request.cookies.get('token'))
+        user_cache.invalidate(current_user_id)
         return jsonify({"message": "Account updated successfully"}), 200
 
+    except kdf_executor.KDFBusy:
+        conn.rollback()
+        raise
     except Exception as e:
         conn.rollback()
         print(f"Account Update Error: {e}") # Log internally
@@ -351,26 +1141,47 @@ def update_account(current_user_id):
         cur.close()
         conn.close()
 
+# Prometheus scrape target (all workers combined under gunicorn, see gunicorn_config.py)
+@bp.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    if not metrics.enabled():
+        return jsonify({"error": "Not found"}), 404
+    if not metrics.authorized(request.headers.get('Authorization')):
+        return jsonify({"error": "Unauthorized"}), 401
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type), 200
+
+@bp.route('/api/stats', methods=['GET'])
+@token_required
+def stats(current_user_id):
+    # Numbers for sizing the worker's resources (this worker only)
+    return jsonify({
+        "db_pool": db_pool.get_pool().stats(),
+        "db_replicas": db_pool.get_replicas().stats() if db_pool.get_replicas() else None,
+        "kdf": kdf_executor.get_executor().stats()
+    }), 200
+
 # NEW: Delete Account Route
-@app.route('/api/delete_account', methods=['DELETE'])
+@bp.route('/api/delete_account', methods=['DELETE'])
 @token_required
 def delete_account(current_user_id):
     data = request.json
     password_check = data.get('password', '').strip() # MOBILE FIX: Strip whitespace
     
     # 1. Verify Password again before deleting
-    user = verify_password_logic(current_user_id, password_check)
+    user, _ = verify_password_logic(current_user_id, password_check, readonly=False)
     if not user: return jsonify({"error": "Invalid Password"}), 401
 
     conn = get_db_connection()
     cur = conn.cursor()
     
     try:
-        # Delete all passwords first
-        cur.execute('DELETE FROM passwords WHERE user_id = %s', (current_user_id,))
-        # Delete the user
+        # Their passwords go with them (ON DELETE CASCADE)
         cur.execute('DELETE FROM users WHERE id = %s', (current_user_id,))
         conn.commit()
+        mark_write()
+        session_cache.clear(request.cookies.get('token'))
+        user_cache.invalidate(current_user_id)
         return jsonify({"message": "Account deleted successfully"}), 200
     except Exception as e:
         conn.rollback()
@@ -381,4 +1192,4 @@ def delete_account(current_user_id):
         conn.close()
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    create_app().run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,55 @@
+import hashlib
+import json
+import os
+
+# Fingerprinted static files and the offline app shell.
+# Templates link static files through asset_url(), which adds ?v=<content hash>.
+# The file behind such a URL never changes (a deploy changes the hash, so the URL),
+# so browsers may keep it for a year without asking again. Plain /static/... URLs,
+# like the icon named in manifest.json, are revalidated on every use instead.
+# The service worker (/sw.js) precaches the shell: the start page, its assets and the
+# manifest's icons. Its cache name is a hash over all of them, so any change to the
+# shell installs a new worker that replaces the old cache.
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+HASH_LENGTH = 12
+
+SHELL_ASSETS = ['style.css', 'app.js', 'manifest.json', 'icon.png'] # Everything index.html loads
+SHELL_TEMPLATES = ['index.html']
+
+_hashes = {}
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:HASH_LENGTH]
+
+# {relative path: hash} for every static file, computed once per process
+# (static files only change with a deploy, which restarts the workers)
+def static_hashes(static_folder):
+    hashes = _hashes.get(static_folder)
+    if hashes is None:
+        hashes = {}
+        for root, _, files in os.walk(static_folder):
+            for name in files:
+                path = os.path.join(root, name)
+                hashes[os.path.relpath(path, static_folder).replace(os.sep, '/')] = file_hash(path)
+        _hashes[static_folder] = hashes
+    return hashes
+
+# True when ?v= names the current content of the file, i.e. the response may be cached for good
+def is_current(static_folder, filename, version):
+    return version is not None and static_hashes(static_folder).get(filename) == version
+
+# The shell as the manifest declares it: start page and icons
+def manifest_urls(static_folder):
+    with open(os.path.join(static_folder, 'manifest.json'), encoding='utf-8') as f:
+        manifest = json.load(f)
+    return [manifest.get('start_url', '/')] + [icon['src'] for icon in manifest.get('icons', [])]
+
+def shell_version(urls, template_folder):
+    digest = hashlib.sha256()
+    for url in urls:
+        digest.update(url.encode() + b'\n')
+    for name in SHELL_TEMPLATES:
+        digest.update(file_hash(os.path.join(template_folder, name)).encode())
+    return digest.hexdigest()[:HASH_LENGTH]
@@ -0,0 +1,1203 @@
+# Async serving mode: the same /api/* routes and JSON contract as app.py,
+# on Quart + asyncpg so one worker can hold many sessions that are waiting on Postgres.
+# Run it with: hypercorn --config python:hypercorn_config async_app:app
+from quart import Quart, Response, request, jsonify, render_template, make_response, g, stream_with_context, url_for
+from quart.json.provider import DefaultJSONProvider
+from hypercorn.middleware import ProxyFixMiddleware
+import asyncpg
+import asyncio
+import contextlib
+import contextvars
+import itertools
+import pyotp
+import assets
+import crypto_manager
+import db_pool
+import kdf
+import kdf_executor
+import metrics
+import rate_limit
+import session_cache
+import totp_qr
+import user_cache
+import vault_export
+import vault_import
+import vault_keys
+import jwt
+import csv
+import datetime
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from functools import partial, wraps
+from dotenv import load_dotenv
+
+load_dotenv()
+
+class TimedJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        with metrics.phase('json'):
+            return super().dumps(obj, **kwargs)
+
+app = Quart(__name__)
+app.json = TimedJSONProvider(app)
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+
+# Number of reverse proxies in front of hypercorn (see app.py)
+PROXY_HOPS = int(os.environ.get('PROXY_HOPS', 0))
+if PROXY_HOPS:
+    app.asgi_app = ProxyFixMiddleware(app.asgi_app, mode='legacy', trusted_hops=PROXY_HOPS)
+
+# Responses are not compressed in this mode (Flask-Compress is WSGI only); leave that to the proxy.
+
+UNLOCK_COOKIE = 'vault_unlock'
+RECENT_WRITE_COOKIE = 'vault_wrote'
+RECENT_WRITE_SECONDS = int(os.environ.get('RECENT_WRITE_SECONDS', 5)) # Longer than the replicas' usual lag
+PAGE_SIZE_DEFAULT = 100
+PAGE_SIZE_MAX = 500
+STREAM_BATCH = 200 # Rows fetched per round-trip from the server-side cursor
+SEARCH_LIMIT_DEFAULT = 20
+SEARCH_LIMIT_MAX = 100
+BATCH_MAX_OPS = 1000
+
+BANNED_CHARS = [' ', '\t', '\n', '\r', '\\', '^', '~', '"', "'", '{', '}', '[', ']', '|', ';']
+
+# UTILITY: Database Pool
+# asyncpg keeps its own pool per worker, sized with the same settings as db_pool.
+@app.before_serving
+async def open_db_pool():
+    app.db = await asyncpg.create_pool(
+        os.environ.get('DATABASE_URL'),
+        min_size=int(os.environ.get('DB_POOL_MIN', 1)),
+        max_size=int(os.environ.get('DB_POOL_MAX', 10)),
+    )
+    # Read replicas (see db_pool.py): no connections up front, so one that is down does not stop startup
+    app.replicas = [await asyncpg.create_pool(
+        dsn,
+        min_size=0,
+        max_size=int(os.environ.get('DB_POOL_MAX', 10)),
+        timeout=db_pool.REPLICA_CONNECT_TIMEOUT,
+    ) for dsn in db_pool.replica_dsns()]
+    app.replica_down_until = [0.0] * len(app.replicas)
+    app.replica_turn = itertools.count()
+
+@app.after_serving
+async def close_db_pool():
+    await app.db.close()
+    for pool in app.replicas:
+        await pool.close()
+
+# UTILITY: Connection for reads that may come from a replica (same rules as read_db_connection in app.py)
+# Use as `async with read_connection() as conn:`; streams are wrapped in stream_with_context for it.
+@contextlib.asynccontextmanager
+async def read_connection():
+    pool, conn = await acquire_read()
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
+# (pool, connection); g.read_replica tells where it came from (None = primary)
+async def acquire_read():
+    g.read_replica = None
+    if wrote_recently():
+        metrics.DB_REPLICA_READS.labels('recent_write').inc()
+        return app.db, await app.db.acquire()
+
+    count = len(app.replicas)
+    if g.get('replica') is not None:
+        candidates = [g.replica]
+    elif count:
+        start = next(app.replica_turn) % count
+        candidates = [(start + offset) % count for offset in range(count)]
+    else:
+        candidates = []
+
+    for index in candidates:
+        if app.replica_down_until[index] > time.monotonic():
+            continue
+        pool = app.replicas[index]
+        try:
+            conn = await pool.acquire(timeout=db_pool.DB_POOL_TIMEOUT)
+        except asyncio.TimeoutError as e:
+            if pool.get_size() < pool.get_max_size():
+                mark_replica_down(index, e)
+            continue # Otherwise busy, not down: try the next one, then the primary
+        except (OSError, asyncpg.PostgresError) as e:
+            mark_replica_down(index, e)
+            continue
+        try:
+            lag = await conn.fetchval(db_pool.REPLICA_LAG_QUERY) if db_pool.REPLICA_MAX_LAG_SECONDS else 0
+        except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError, asyncpg.InternalClientError) as e:
+            # An idle connection to a replica that went away fails here, before the request uses it
+            await pool.release(conn)
+            mark_replica_down(index, e)
+            continue
+        if db_pool.REPLICA_MAX_LAG_SECONDS and lag > db_pool.REPLICA_MAX_LAG_SECONDS:
+            await pool.release(conn)
+            mark_replica_down(index, f"{lag:.1f}s behind")
+            continue
+        g.replica = g.read_replica = index
+        metrics.DB_REPLICA_READS.labels('replica').inc()
+        return app.replicas[index], conn
+
+    metrics.DB_REPLICA_READS.labels('primary').inc()
+    return app.db, await app.db.acquire()
+
+def mark_replica_down(index, error):
+    app.replica_down_until[index] = time.monotonic() + db_pool.REPLICA_RETRY_SECONDS
+    metrics.DB_REPLICA_FAILURES.inc()
+    print(f"Replica {index} Error: {error}") # Log internally
+
+def wrote_recently():
+    if g.get('wrote'):
+        return True
+    try:
+        return float(request.cookies.get(RECENT_WRITE_COOKIE) or 0) > time.time()
+    except ValueError:
+        return False
+
+# UTILITY: Call after a write, so this client's next reads stay on the primary for a while
+def mark_write():
+    g.wrote = True
+
+@app.after_request
+async def attach_recent_write_cookie(resp):
+    if g.get('wrote') and app.replicas:
+        resp.set_cookie(RECENT_WRITE_COOKIE, str(int(time.time()) + RECENT_WRITE_SECONDS),
+                        max_age=RECENT_WRITE_SECONDS, httponly=True, samesite='Strict')
+    return resp
+
+# UTILITY: Per-request timing (see metrics.py)
+# Quart has no close callback, so a streamed body's own time is not in the latency histogram here.
+@app.before_request
+async def start_request_timer():
+    metrics.start_request(request.endpoint or 'unmatched', request.method)
+
+@app.after_request
+async def finish_request_timer(resp):
+    timer = metrics.current()
+    if timer is not None:
+        resp.headers['Server-Timing'] = timer.server_timing()
+        timer.finish(resp.status_code)
+    return resp
+
+# UTILITY: Content-hashed static URLs for the templates (see assets.py)
+@app.template_global()
+def asset_url(filename):
+    return url_for('static', filename=filename, v=assets.static_hashes(app.static_folder).get(filename))
+
+@app.after_request
+async def static_cache_headers(resp):
+    if request.endpoint == 'static' and resp.status_code in (200, 304):
+        if assets.is_current(app.static_folder, request.view_args.get('filename'), request.args.get('v')):
+            resp.cache_control.no_cache = None
+            resp.cache_control.public = True
+            resp.cache_control.max_age = assets.IMMUTABLE_MAX_AGE
+            resp.cache_control.immutable = True
+        else:
+            resp.cache_control.max_age = None
+            resp.cache_control.no_cache = True
+    return resp
+
+@app.errorhandler(kdf_executor.KDFBusy)
+async def kdf_busy(e):
+    resp = jsonify({"error": "Server busy, please try again."})
+    resp.headers['Retry-After'] = str(kdf_executor.KDF_RETRY_AFTER)
+    return resp, 503
+
+@app.errorhandler(rate_limit.RateLimited)
+async def rate_limited(e):
+    resp = jsonify({"error": "Too many attempts, please try again later."})
+    resp.headers['Retry-After'] = str(e.retry_after)
+    return resp, 429
+
+# UTILITY: The "Bouncer"
+def token_required(f):
+    @wraps(f)
+    async def decorated(*args, **kwargs):
+        token = request.cookies.get('token')
+
+        if not token:
+            return jsonify({'message': 'Token is missing!'}), 401
+
+        try:
+            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
+            current_user_id = data['user_id']
+        except Exception:
+            return jsonify({'message': 'Token is invalid!'}), 401
+
+        return await f(current_user_id, *args, **kwargs)
+
+    return decorated
+
+# UTILITY: Run blocking CPU work (QR rendering, bulk Fernet, SQLite) off the event loop
+# (the request's context goes along, so phases timed in the thread still count)
+async def run_blocking(func, *args):
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(None, partial(context.run, func, *args))
+
+# UTILITY: Rate limit a request that is about to run the KDF (see app.py / rate_limit.py)
+# The SQLite update can wait on another worker's lock, so it runs off the event loop.
+async def limit_kdf(*limits):
+    await run_blocking(rate_limit.hit, [rate_limit.ip_limit(request.remote_addr), *limits])
+
+async def unlock_with_password(user, master_password):
+    await limit_kdf(rate_limit.account_limit(user['id']))
+    master_secret = await kdf_executor.derive_master_secret_async(master_password, bytes.fromhex(user['salt']), user['kdf_params'])
+    if not crypto_manager.verify_master_secret(master_secret, user['password_hash']):
+        return None
+    return crypto_manager.encryption_key_from_secret(master_secret)
+
+# UTILITY: Public user record (id, username), from the per-worker cache when possible
+async def load_user_record(user_id):
+    record = user_cache.get(user_id)
+    if record is not None:
+        return record
+    async with read_connection() as conn:
+        user = await conn.fetchrow('SELECT id, username FROM users WHERE id = $1', user_id)
+    return user_cache.put(user) if user else None
+
+# readonly=False for routes that act on the answer (a replica may still have the old password)
+async def verify_password_logic(user_id, master_password, readonly=True):
+    async with (read_connection() if readonly else app.db.acquire()) as conn:
+        user = await conn.fetchrow('SELECT * FROM users WHERE id = $1', user_id)
+    if not user:
+        user_cache.invalidate(user_id)
+        return None, None
+    user_cache.put(user)
+
+    kek = await unlock_with_password(user, master_password)
+    if kek is None:
+        return None, None
+    return user, kek
+
+async def unlock_logic(user_id, data):
+    master_password = data.get('master_password')
+    token = request.cookies.get('token')
+    wrap_secret = request.cookies.get(UNLOCK_COOKIE)
+
+    if not master_password:
+        kek = session_cache.load_key(token, wrap_secret)
+        if kek is None: return None
+        # Another session may have changed the password (or KDF settings) since this key was cached
+        keyring = await open_keyring(user_id, kek)
+        if keyring is None:
+            session_cache.clear(token)
+            return None
+        g.vault_unlocked = True
+        return keyring
+
+    user, kek = await verify_password_logic(user_id, master_password)
+    if not user: return None
+
+    if data.get('unlock_session') and session_cache.UNLOCK_ENABLED:
+        g.unlock_secret = session_cache.store_key(token, kek, wrap_secret)
+        g.vault_unlocked = True
+    return await open_keyring(user_id, kek)
+
+# UTILITY: The vault's keyring for a request (same steps as vault_keys.open_keyring, on asyncpg)
+# Entries left on retired data keys are moved one batch at a time in the background.
+async def open_keyring(user_id, kek):
+    try:
+        keyring = await load_keyring(user_id, kek)
+    except vault_keys.KeyringError:
+        return None
+    # mark_write() also keeps this request's entry reads on the primary, where no entry
+    # can be on a key that is already gone
+    if keyring is not None and keyring.retired_versions():
+        app.add_background_task(reencrypt_batch, user_id, keyring)
+        mark_write()
+    return keyring
+
+# UTILITY: `rows` as this keyring can read them (see current_entries in app.py)
+async def current_entries(user_id, keyring, rows):
+    stale = [row['id'] for row in rows if not keyring.has_version(row['key_version'])]
+    if not stale:
+        return rows
+
+    fresh = {row['id']: row for row in await app.db.fetch('''
+        SELECT id, site_name, site_username, encrypted_password, ciphertext, key_version FROM passwords
+        WHERE user_id = $1 AND id = ANY($2::int[])
+    ''', user_id, stale)}
+    entries = []
+    for row in rows:
+        if row['id'] in stale:
+            row = fresh.get(row['id'])
+        if row is not None:
+            entries.append(row)
+    return entries
+
+async def load_keyring(user_id, kek):
+    async with app.db.acquire() as conn:
+        while True:
+            user = await conn.fetchrow('SELECT password_hash, data_key_version FROM users WHERE id = $1', user_id)
+            if user is None or not crypto_manager.key_matches_hash(kek, user['password_hash']):
+                return None
+            current_version = user['data_key_version']
+
+            if current_version is None:
+                keyring = vault_keys.new_keyring(legacy_key=kek)
+                versions = None
+            else:
+                rows = await conn.fetch('SELECT version, wrapped_key, created_at, fernet_entries FROM data_keys WHERE user_id = $1', user_id)
+                keyring = vault_keys.Keyring.unwrap(kek, current_version, rows)
+                if not keyring.needs_rotation():
+                    return keyring
+                keyring = keyring.rotated()
+                versions = [keyring.current_version]
+
+            async with conn.transaction():
+                status = await conn.execute('''
+                    UPDATE users SET data_key_version = $1
+                    WHERE id = $2 AND data_key_version IS NOT DISTINCT FROM $3 AND password_hash = $4
+                ''', keyring.current_version, user_id, current_version, user['password_hash'])
+                if status == 'UPDATE 1':
+                    await insert_keys(conn, user_id, kek, keyring, versions)
+                    return keyring
+            # Another request converted/rotated first (or the password changed): use what is there now
+
+async def insert_keys(conn, user_id, kek, keyring, versions=None):
+    await conn.executemany('INSERT INTO data_keys (user_id, version, wrapped_key) VALUES ($1, $2, $3)',
+                           [(user_id, version, wrapped) for version, wrapped in keyring.wrapped(kek, versions)])
+
+# UTILITY: Wrap the keyring with a new KEK, inside the caller's transaction (see vault_keys.rewrap)
+async def rewrap_keys(conn, user_id, old_kek, new_kek):
+    current_version = await conn.fetchval('SELECT data_key_version FROM users WHERE id = $1 FOR UPDATE', user_id)
+
+    if current_version is None:
+        keyring = vault_keys.new_keyring(legacy_key=old_kek)
+        await conn.execute('UPDATE users SET data_key_version = $1 WHERE id = $2', keyring.current_version, user_id)
+        await insert_keys(conn, user_id, new_kek, keyring)
+        return keyring
+
+    rows = await conn.fetch('SELECT version, wrapped_key, created_at, fernet_entries FROM data_keys WHERE user_id = $1', user_id)
+    keyring = vault_keys.Keyring.unwrap(old_kek, current_version, rows)
+    await conn.executemany('UPDATE data_keys SET wrapped_key = $3 WHERE user_id = $1 AND version = $2',
+                           [(user_id, version, wrapped) for version, wrapped in keyring.wrapped(new_kek)])
+    return keyring
+
+# UTILITY: Move one batch of entries off retired data keys (see vault_keys.reencrypt_batch)
+async def reencrypt_batch(user_id, keyring):
+    retired = keyring.retired_versions()
+    try:
+        async with app.db.acquire() as conn:
+            async with conn.transaction():
+                rows = await conn.fetch('''
+                    SELECT id, encrypted_password, ciphertext, key_version FROM passwords
+                    WHERE user_id = $1 AND COALESCE(key_version, 0) = ANY($2::int[]) AND quarantined_at IS NULL
+                    ORDER BY id LIMIT $3 FOR UPDATE SKIP LOCKED
+                ''', user_id, retired, vault_keys.REENCRYPT_BATCH)
+                moved, unreadable = await run_blocking(reencrypt_rows, keyring, rows)
+                if moved:
+                    ids, encrypted = zip(*moved)
+                    await conn.execute('''
+                        UPDATE passwords AS p
+                        SET ciphertext = v.ciphertext, encrypted_password = NULL, key_version = $2
+                        FROM unnest($3::int[], $4::bytea[]) AS v (id, ciphertext)
+                        WHERE p.id = v.id AND p.user_id = $1
+                    ''', user_id, keyring.current_version, ids, encrypted)
+                if unreadable:
+                    await conn.execute('UPDATE passwords SET quarantined_at = now() WHERE user_id = $1 AND id = ANY($2::int[])',
+                                       user_id, unreadable)
+                if not rows:
+                    await conn.execute('''
+                        DELETE FROM data_keys AS k
+                        WHERE k.user_id = $1 AND k.version = ANY($2::int[])
+                          AND NOT EXISTS (SELECT 1 FROM passwords AS p
+                                          WHERE p.user_id = k.user_id AND COALESCE(p.key_version, 0) = k.version)
+                    ''', user_id, retired)
+    except Exception as e:
+        print(f"Re-encrypt Error: {e}") # Log internally
+
+# Entries that do not decrypt are quarantined (see vault_keys.py)
+def reencrypt_rows(keyring, rows):
+    moved, unreadable = [], []
+    for row in rows:
+        try:
+            password = decrypt_timed(keyring, row)
+        except vault_keys.UNREADABLE_ENTRY_ERRORS:
+            print(f"Re-encrypt Error: entry {row['id']} does not decrypt, quarantined") # Log internally
+            unreadable.append(row['id'])
+            continue
+        moved.append((row['id'], encrypt_timed(keyring, password)))
+    return moved, unreadable
+
+def locked_response():
+    return jsonify({"error": "Invalid Password"}), 401
+
+@app.after_request
+async def attach_unlock_cookie(resp):
+    if g.get('unlock_secret'):
+        resp.set_cookie(UNLOCK_COOKIE, g.unlock_secret, httponly=True, samesite='Strict')
+    if g.get('vault_unlocked'):
+        resp.headers['X-Vault-Unlocked'] = '1'
+    return resp
+
+# `row` needs ciphertext, encrypted_password and key_version
+def decrypt_timed(keyring, row):
+    with metrics.phase('crypto'):
+        return keyring.decrypt_entry(row)
+
+def encrypt_timed(keyring, password):
+    with metrics.phase('crypto'):
+        return keyring.encrypt(password)
+
+def decrypt_rows(keyring, rows):
+    results = []
+    for row in rows:
+        try:
+            results.append({
+                "id": row['id'],
+                "site": row['site_name'],
+                "username": row['site_username'],
+                "password": decrypt_timed(keyring, row)
+            })
+        except Exception: pass
+    return results
+
+# --- ROUTES ---
+
+@app.route('/')
+async def index():
+    return await render_template('index.html')
+
+@app.route('/privacy')
+async def privacy():
+    return await render_template('privacy.html')
+
+# Service worker for the offline shell (same as app.py)
+@app.route('/sw.js')
+async def service_worker():
+    shell = [url_for('index')] + [asset_url(name) for name in assets.SHELL_ASSETS]
+    shell = list(dict.fromkeys(shell + assets.manifest_urls(app.static_folder)))
+    script = await render_template('sw.js', shell=shell, version=assets.shell_version(shell, os.path.join(app.root_path, app.template_folder)))
+    return Response(script, mimetype='application/javascript', headers={'Cache-Control': 'no-cache'})
+
+@app.route('/api/register', methods=['POST'])
+async def register():
+    data = await request.get_json()
+    # MOBILE FIX: Strip whitespace automatically
+    username = data.get('username', '').strip()
+    password = data.get('password', '').strip()
+
+    if not username or not password:
+        return jsonify({"error": "Username and Password required"}), 400
+
+    for char in BANNED_CHARS:
+        if char in password:
+            return jsonify({"error": "Password contains invalid characters"}), 400
+
+    for char in BANNED_CHARS:
+        if char in username:
+            return jsonify({"error": "Username contains invalid characters"}), 400
+
+    if len(password) < 8:
+        return jsonify({"error": "Password must be at least 8 characters"}), 400
+
+    await limit_kdf()
+
+    try:
+        if await app.db.fetchval('SELECT id FROM users WHERE username = $1', username):
+            return jsonify({"error": "Username already exists"}), 400
+
+        salt = crypto_manager.generate_salt()
+        master_secret = await kdf_executor.derive_master_secret_async(password, salt, kdf.DEFAULT_PARAMS)
+        password_hash = crypto_manager.auth_hash_from_secret(master_secret)
+        two_factor_secret = pyotp.random_base32()
+
+        # The vault's first data key, wrapped by the password's key
+        keyring = vault_keys.new_keyring()
+        async with app.db.acquire() as conn:
+            async with conn.transaction():
+                user_id = await conn.fetchval('''
+                    INSERT INTO users (username, password_hash, salt, two_factor_secret, kdf_params, data_key_version)
+                    VALUES ($1, $2, $3, $4, $5, $6) RETURNING id
+                ''', username, password_hash, salt.hex(), two_factor_secret, kdf.DEFAULT_PARAMS, keyring.current_version)
+                await insert_keys(conn, user_id, crypto_manager.encryption_key_from_secret(master_secret), keyring)
+        mark_write()
+
+        totp_uri = totp_qr.provisioning_uri(username, two_factor_secret)
+
+        return jsonify({
+            "message": "User created",
+            "secret": two_factor_secret,
+            "totp_uri": totp_uri,
+            "qr_token": totp_qr.setup_token(totp_uri, app.config['SECRET_KEY'])
+        }), 201
+
+    except kdf_executor.KDFBusy:
+        raise
+    except Exception as e:
+        print(f"Register Error: {e}") # Log internally
+        return jsonify({"error": "An internal server error occurred."}), 500
+
+# 2FA setup QR code (same as app.py); only a cache miss renders, off the event loop
+@app.route('/api/2fa_qr', methods=['POST'])
+async def two_factor_qr():
+    data = await request.get_json(silent=True) or {}
+    totp_uri = totp_qr.uri_from_setup_token(data.get('qr_token'), app.config['SECRET_KEY'])
+    if totp_uri is None:
+        return jsonify({"error": "Invalid or expired setup token"}), 400
+
+    image = totp_qr.cached_svg(totp_uri) or await run_blocking(totp_qr.svg, totp_uri)
+    return Response(image, mimetype='image/svg+xml', headers={'Cache-Control': 'no-store'}), 200
+
+@app.route('/api/login', methods=['POST'])
+async def login():
+    data = await request.get_json()
+    # MOBILE FIX: Strip whitespace to handle auto-correct spaces
+    username = data.get('username', '').strip()
+    password = data.get('password', '').strip()
+
+    # Before the lookup, so guessing usernames is limited too
+    await limit_kdf(rate_limit.username_limit(username))
+
+    user = await app.db.fetchrow('SELECT * FROM users WHERE username = $1', username)
+    if not user: return jsonify({"error": "User not found"}), 404
+
+    master_secret = await kdf_executor.derive_master_secret_async(password, bytes.fromhex(user['salt']), user['kdf_params'])
+    if not crypto_manager.verify_master_secret(master_secret, user['password_hash']):
+        return jsonify({"error": "Invalid Password"}), 401
+
+    totp = pyotp.TOTP(user['two_factor_secret'])
+    if not totp.verify(data.get('2fa_code')):
+        return jsonify({"error": "Invalid 2FA Code"}), 401
+
+    # Move the account to the current KDF settings, or at least to the single-pass hash scheme
+    if user['kdf_params'] != kdf.DEFAULT_PARAMS:
+        await upgrade_kdf(user, password, master_secret)
+    elif crypto_manager.needs_rehash(user['password_hash']):
+        await app.db.execute('UPDATE users SET password_hash = $1 WHERE id = $2',
+                             crypto_manager.auth_hash_from_secret(master_secret), user['id'])
+        mark_write()
+
+    user_cache.put(user) # The page calls check_session right after logging in
+
+    token = jwt.encode({
+        'user_id': user['id'],
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=60)
+    }, app.config['SECRET_KEY'], algorithm="HS256")
+
+    resp = await make_response(jsonify({
+        "message": "Login Successful",
+        "username": user['username']
+    }))
+    resp.set_cookie('token', token, httponly=True, samesite='Strict')
+
+    return resp, 200
+
+# UTILITY: Re-key an account with the current KDF settings (same as app.py)
+async def upgrade_kdf(user, password, master_secret):
+    new_salt = crypto_manager.generate_salt()
+    new_secret = await kdf_executor.derive_master_secret_async(password, new_salt, kdf.DEFAULT_PARAMS)
+    try:
+        async with app.db.acquire() as conn:
+            async with conn.transaction():
+                await rewrap_keys(conn, user['id'], crypto_manager.encryption_key_from_secret(master_secret),
+                                  crypto_manager.encryption_key_from_secret(new_secret))
+                await conn.execute('UPDATE users SET password_hash = $1, salt = $2, kdf_params = $3 WHERE id = $4',
+                                   crypto_manager.auth_hash_from_secret(new_secret), new_salt.hex(),
+                                   kdf.DEFAULT_PARAMS, user['id'])
+        mark_write()
+    except Exception as e:
+        print(f"KDF Upgrade Error: {e}") # Log internally
+
+@app.route('/api/logout', methods=['POST'])
+async def logout():
+    session_cache.clear(request.cookies.get('token'))
+    resp = await make_response(jsonify({"message": "Logged out"}))
+    resp.set_cookie('token', '', expires=0)
+    resp.set_cookie(UNLOCK_COOKIE, '', expires=0)
+    return resp, 200
+
+@app.route('/api/check_session', methods=['GET'])
+@token_required
+async def check_session(current_user_id):
+    user = await load_user_record(current_user_id)
+    if user:
+        return jsonify({"status": "valid", "user_id": current_user_id, "username": user['username']}), 200
+    return jsonify({"message": "User not found"}), 401
+
+@app.route('/api/add_password', methods=['POST'])
+@token_required
+async def add_password_entry(current_user_id):
+    data = await request.get_json()
+
+    keyring = await unlock_logic(current_user_id, data)
+    if keyring is None: return locked_response()
+
+    encrypted_pw = encrypt_timed(keyring, data.get('site_password'))
+
+    await app.db.execute('''
+        INSERT INTO passwords (user_id, site_name, site_username, ciphertext, key_version)
+        VALUES ($1, $2, $3, $4, $5)
+    ''', current_user_id, data.get('site_name'), data.get('site_username'), encrypted_pw, keyring.current_version)
+    mark_write()
+    return jsonify({"message": "Password Saved"}), 201
+
+# UTILITY: 304 when the client's copy (If-None-Match) is still current
+# Version ETags are weak: they name the content, not the bytes (compression changes those).
+def not_modified(etag):
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    resp = Response('', status=304)
+    resp.set_etag(etag, weak=True)
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+@app.route('/api/get_passwords', methods=['POST'])
+@token_required
+async def get_all_passwords(current_user_id):
+    data = await request.get_json()
+
+    # Paging is opt-in: without 'limit'/'cursor' the whole vault comes back as one (streamed) list
+    paged = 'limit' in data or 'cursor' in data
+    try:
+        after_id = int(data.get('cursor') or 0)
+        limit = min(int(data.get('limit') or PAGE_SIZE_DEFAULT), PAGE_SIZE_MAX)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid cursor or limit"}), 400
+    if limit < 1:
+        return jsonify({"error": "Invalid cursor or limit"}), 400
+
+    # Unchanged vault: answer before unlocking, so no KDF run and no decryption
+    async with read_connection() as conn:
+        version = await conn.fetchval('SELECT vault_version FROM users WHERE id = $1', current_user_id)
+    if version is None: return jsonify({"message": "User not found"}), 401
+    etag = f"v{version}-{after_id}-{limit}" if paged else f"v{version}"
+    unchanged = not_modified(etag)
+    if unchanged: return unchanged
+
+    keyring = await unlock_logic(current_user_id, data)
+    if keyring is None: return locked_response()
+
+    return stream_with_context(stream_vault_json)(current_user_id, keyring, paged, after_id, limit), 200, {
+        'Content-Type': 'application/json', 'ETag': f'W/"{etag}"', 'Cache-Control': 'no-cache'
+    }
+
+# UTILITY: Stream decrypted entries as JSON, one entry per line (same layout as app.py)
+# Reads from the same replica as the version check, so the rows are at least as new as the ETag.
+async def stream_vault_json(user_id, keyring, paged, after_id, limit):
+    yield '{"entries": [' if paged else '['
+    count = 0
+    last_id = None
+    has_more = False
+    separator = '\n'
+
+    async with read_connection() as conn:
+        async with conn.transaction():
+            if paged:
+                # Keyset pagination: one extra row tells us whether another page exists
+                cursor = await conn.cursor('''
+                    SELECT id, site_name, site_username, encrypted_password, ciphertext, key_version FROM passwords
+                    WHERE user_id = $1 AND id > $2 ORDER BY id LIMIT $3
+                ''', user_id, after_id, limit + 1)
+            else:
+                cursor = await conn.cursor('''
+                    SELECT id, site_name, site_username, encrypted_password, ciphertext, key_version FROM passwords
+                    WHERE user_id = $1 ORDER BY id
+                ''', user_id)
+
+            while not has_more:
+                rows = await cursor.fetch(STREAM_BATCH)
+                if not rows:
+                    break
+                if paged and count + len(rows) > limit:
+                    rows = rows[:limit - count]
+                    has_more = True
+                count += len(rows)
+                if rows:
+                    last_id = rows[-1]['id']
+
+                rows = await current_entries(user_id, keyring, rows)
+                for entry in await run_blocking(decrypt_rows, keyring, rows):
+                    yield separator + json.dumps(entry)
+                    separator = ',\n'
+
+    if paged:
+        yield '\n], "next_cursor": %s}' % json.dumps(last_id if has_more else None)
+    else:
+        yield '\n]'
+
+# Vault list without any decryption: just what the UI shows until someone asks for a password
+@app.route('/api/list_entries', methods=['GET'])
+@token_required
+async def list_entries(current_user_id):
+    try:
+        after_id = int(request.args.get('cursor') or 0)
+        limit = min(int(request.args.get('limit') or PAGE_SIZE_DEFAULT), PAGE_SIZE_MAX)
+    except ValueError:
+        return jsonify({"error": "Invalid cursor or limit"}), 400
+    if limit < 1:
+        return jsonify({"error": "Invalid cursor or limit"}), 400
+
+    # Version first: a change landing in between shows up again in the next delta, never goes missing
+    async with read_connection() as conn:
+        version = await conn.fetchval('SELECT vault_version FROM users WHERE id = $1', current_user_id)
+        rows = await conn.fetch('''
+            SELECT id, site_name, site_username FROM passwords
+            WHERE user_id = $1 AND id > $2 ORDER BY id LIMIT $3
+        ''', current_user_id, after_id, limit + 1)
+    if version is None: return jsonify({"message": "User not found"}), 401
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return jsonify({
+        "entries": [{"id": row['id'], "site": row['site_name'], "username": row['site_username']} for row in rows],
+        "next_cursor": rows[-1]['id'] if has_more else None,
+        "version": version
+    }), 200
+
+# Delta sync: entries added/edited and ids deleted since the client's version (metadata only).
+# "reset" means the client's version is not from this vault (e.g. restored database): reload fully.
+@app.route('/api/vault_changes', methods=['GET'])
+@token_required
+async def vault_changes(current_user_id):
+    try:
+        since = int(request.args.get('since', ''))
+    except ValueError:
+        return jsonify({"error": "Invalid version"}), 400
+
+    pool, conn = await acquire_read()
+    try:
+        version = await conn.fetchval('SELECT vault_version FROM users WHERE id = $1', current_user_id)
+        if version is not None and since > version and g.read_replica is not None:
+            # The replica is behind the client's copy: only the primary can tell lag from a reset
+            await pool.release(conn)
+            pool, conn = app.db, await app.db.acquire()
+            version = await conn.fetchval('SELECT vault_version FROM users WHERE id = $1', current_user_id)
+        if version is None: return jsonify({"message": "User not found"}), 401
+        etag = f"v{version}"
+        unchanged = not_modified(etag)
+        if unchanged: return unchanged
+        if since > version or since < 0:
+            return jsonify({"version": version, "reset": True}), 200
+
+        changed = await conn.fetch('''
+            SELECT id, site_name, site_username FROM passwords
+            WHERE user_id = $1 AND version > $2 ORDER BY id
+        ''', current_user_id, since)
+        deleted = await conn.fetch('''
+            SELECT entry_id FROM password_tombstones
+            WHERE user_id = $1 AND version > $2 ORDER BY entry_id
+        ''', current_user_id, since)
+    finally:
+        await pool.release(conn)
+
+    resp = jsonify({
+        "version": version,
+        "changed": [{"id": row['id'], "site": row['site_name'], "username": row['site_username']} for row in changed],
+        "deleted": [row['entry_id'] for row in deleted]
+    })
+    resp.set_etag(etag, weak=True)
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp, 200
+
+# Search site names and usernames in the database instead of in the browser.
+# Prefix matches rank first, then earlier substring matches; no decryption involved.
+@app.route('/api/search', methods=['GET'])
+@token_required
+async def search_entries(current_user_id):
+    query = request.args.get('q', '').strip()
+    try:
+        limit = min(int(request.args.get('limit') or SEARCH_LIMIT_DEFAULT), SEARCH_LIMIT_MAX)
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+    if not query or limit < 1:
+        return jsonify({"results": []}), 200
+
+    # Escape LIKE wildcards so the user's text is matched literally
+    escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+    async with read_connection() as conn:
+        rows = await conn.fetch('''
+            SELECT id, site_name, site_username FROM passwords
+            WHERE user_id = $1
+              AND (site_name ILIKE $4 OR site_username ILIKE $4)
+            ORDER BY
+                CASE
+                    WHEN lower(site_name) = lower($2) THEN 0
+                    WHEN site_name ILIKE $3 THEN 1
+                    WHEN site_username ILIKE $3 THEN 2
+                    ELSE 3
+                END,
+                position(lower($2) IN lower(site_name || ' ' || site_username)),
+                length(site_name),
+                id
+            LIMIT $5
+        ''', current_user_id, query, escaped + '%', '%' + escaped + '%', limit)
+
+    return jsonify({
+        "results": [{"id": row['id'], "site": row['site_name'], "username": row['site_username']} for row in rows]
+    }), 200
+
+# Decrypt exactly one entry, on demand (copy / reveal / edit)
+@app.route('/api/reveal_password', methods=['POST'])
+@token_required
+async def reveal_password(current_user_id):
+    data = await request.get_json()
+
+    keyring = await unlock_logic(current_user_id, data)
+    if keyring is None: return locked_response()
+
+    async with read_connection() as conn:
+        row = await conn.fetchrow('SELECT id, encrypted_password, ciphertext, key_version FROM passwords WHERE id = $1 AND user_id = $2',
+                                  data.get('id'), current_user_id)
+    entries = await current_entries(current_user_id, keyring, [row]) if row else []
+    if not entries: return jsonify({"error": "Entry not found"}), 404
+    row = entries[0]
+
+    return jsonify({
+        "id": row['id'],
+        "password": decrypt_timed(keyring, row)
+    }), 200
+
+@app.route('/api/update_password', methods=['PUT'])
+@token_required
+async def update_password_entry(current_user_id):
+    data = await request.get_json()
+    password_id = data.get('id')
+
+    keyring = await unlock_logic(current_user_id, data)
+    if keyring is None: return locked_response()
+
+    encrypted_pw = encrypt_timed(keyring, data.get('site_password'))
+
+    await app.db.execute('''
+        UPDATE passwords
+        SET site_name = $1, site_username = $2, ciphertext = $3, encrypted_password = NULL, key_version = $4, updated_at = now()
+        WHERE id = $5 AND user_id = $6
+    ''', data.get('site_name'), data.get('site_username'), encrypted_pw, keyring.current_version, password_id, current_user_id)
+    mark_write()
+    return jsonify({"message": "Updated successfully"}), 200
+
+@app.route('/api/delete_password', methods=['DELETE'])
+@token_required
+async def delete_password_entry(current_user_id):
+    data = await request.get_json()
+    await app.db.execute('DELETE FROM passwords WHERE id = $1 AND user_id = $2', data.get('id'), current_user_id)
+    mark_write()
+    return jsonify({"message": "Deleted successfully"}), 200
+
+# Many adds/updates/deletes in one call: one key derivation, one transaction,
+# multi-row statements. Operations are applied grouped as adds, updates, deletes.
+@app.route('/api/batch', methods=['POST'])
+@token_required
+async def batch_operations(current_user_id):
+    data = await request.get_json()
+    operations = data.get('operations')
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"error": "operations must be a non-empty list"}), 400
+    if len(operations) > BATCH_MAX_OPS:
+        return jsonify({"error": f"At most {BATCH_MAX_OPS} operations per batch"}), 400
+
+    adds, updates, deletes = [], [], []
+    for i, op in enumerate(operations):
+        kind = op.get('op') if isinstance(op, dict) else None
+        if kind in ('update', 'delete') and not isinstance(op.get('id'), int):
+            return jsonify({"error": f"Operation {i} needs an id"}), 400
+        if kind in ('add', 'update') and not (op.get('site_name') and op.get('site_password')):
+            return jsonify({"error": f"Operation {i} needs site_name and site_password"}), 400
+
+        if kind == 'add': adds.append(op)
+        elif kind == 'update': updates.append(op)
+        elif kind == 'delete': deletes.append(op['id'])
+        else: return jsonify({"error": f"Operation {i} has an unknown type"}), 400
+
+    # Only writes that carry a password need the vault key (deletes never did)
+    if adds or updates:
+        keyring = await unlock_logic(current_user_id, data)
+        if keyring is None: return locked_response()
+
+    new_rows = [(op['site_name'], op.get('site_username') or '',
+                 encrypt_timed(keyring, op['site_password'])) for op in adds]
+    changed_rows = [(op['id'], op['site_name'], op.get('site_username') or '',
+                     encrypt_timed(keyring, op['site_password'])) for op in updates]
+
+    try:
+        async with app.db.acquire() as conn:
+            async with conn.transaction():
+                added_ids = []
+                if new_rows:
+                    site_names, site_usernames, encrypted = zip(*new_rows)
+                    added_ids = [row['id'] for row in await conn.fetch('''
+                        INSERT INTO passwords (user_id, key_version, site_name, site_username, ciphertext)
+                        SELECT $1, $2, * FROM unnest($3::text[], $4::text[], $5::bytea[])
+                        RETURNING id
+                    ''', current_user_id, keyring.current_version, site_names, site_usernames, encrypted)]
+
+                updated = 0
+                if changed_rows:
+                    ids, site_names, site_usernames, encrypted = zip(*changed_rows)
+                    status = await conn.execute('''
+                        UPDATE passwords AS p
+                        SET site_name = v.site_name, site_username = v.site_username,
+                            ciphertext = v.ciphertext, encrypted_password = NULL, key_version = $2, updated_at = now()
+                        FROM unnest($3::int[], $4::text[], $5::text[], $6::bytea[])
+                            AS v (id, site_name, site_username, ciphertext)
+                        WHERE p.id = v.id AND p.user_id = $1
+                    ''', current_user_id, keyring.current_version, ids, site_names, site_usernames, encrypted)
+                    updated = int(status.split()[-1])
+
+                deleted = 0
+                if deletes:
+                    status = await conn.execute('DELETE FROM passwords WHERE user_id = $1 AND id = ANY($2::int[])',
+                                                current_user_id, deletes)
+                    deleted = int(status.split()[-1])
+
+        mark_write()
+        return jsonify({"message": "Batch applied", "added": added_ids, "updated": updated, "deleted": deleted}), 200
+    except Exception as e:
+        print(f"Batch Error: {e}") # Log internally
+        return jsonify({"error": "An internal server error occurred."}), 500
+
+# Bulk import from a password manager CSV export or a vault archive (multipart upload, field 'file').
+# Parsing and encryption run off the event loop, IMPORT_CHUNK rows at a time;
+# progress is streamed back as one JSON object per line.
+@app.route('/api/import', methods=['POST'])
+@token_required
+async def import_passwords(current_user_id):
+    files = await request.files
+    upload = files.get('file')
+    if not upload: return jsonify({"error": "No file uploaded"}), 400
+
+    form = await request.form
+    keyring = await unlock_logic(current_user_id, form)
+    if keyring is None: return locked_response()
+
+    # Uploads are closed when the request ends, so the stream reads from its own copy
+    spool = tempfile.SpooledTemporaryFile(max_size=vault_import.IMPORT_CHUNK * 1024)
+    shutil.copyfileobj(upload.stream, spool)
+    spool.seek(0)
+
+    text_stream = io.TextIOWrapper(spool, encoding='utf-8-sig', newline='')
+    try:
+        importer = await open_importer(text_stream, form, current_user_id)
+    except (vault_import.ImportFormatError, vault_export.ArchiveError, UnicodeDecodeError, csv.Error) as e:
+        text_stream.close()
+        return jsonify({"error": str(e)}), 400
+    except Exception:
+        text_stream.close()
+        raise
+    if importer is None:
+        text_stream.close()
+        return jsonify({"error": "Invalid archive password"}), 401
+
+    mark_write() # Before the stream starts: the cookie goes out with the headers
+    return stream_import_progress(importer, text_stream, current_user_id, keyring), 200, {'Content-Type': 'application/x-ndjson'}
+
+# UTILITY: Pick the reader for an upload (same rules as app.py)
+async def open_importer(text_stream, form, user_id):
+    first_line = text_stream.readline()
+    text_stream.seek(0)
+    if not vault_export.is_archive(first_line):
+        return vault_import.CsvImporter(text_stream)
+
+    importer = vault_export.ArchiveReader(text_stream)
+    archive_password = form.get('archive_password') or form.get('master_password')
+    if not archive_password:
+        return None
+    await limit_kdf(rate_limit.account_limit(user_id))
+    master_secret = await kdf_executor.derive_master_secret_async(archive_password, importer.salt, importer.kdf_params)
+    if not importer.unlock_with_secret(master_secret):
+        return None
+    return importer
+
+def next_encrypted_chunk(chunks, keyring):
+    chunk = next(chunks, None)
+    if chunk is None:
+        return None
+    return [(site_name, site_username, encrypt_timed(keyring, password))
+            for site_name, site_username, password in chunk]
+
+async def stream_import_progress(importer, text_stream, user_id, keyring):
+    imported = 0
+    chunks = vault_import.chunked(importer, vault_import.IMPORT_CHUNK)
+    try:
+        yield json.dumps({"format": importer.format}) + '\n'
+        async with app.db.acquire() as conn:
+            while True:
+                rows = await run_blocking(next_encrypted_chunk, chunks, keyring)
+                if not rows:
+                    break
+                site_names, site_usernames, encrypted = zip(*rows)
+                await conn.execute('''
+                    INSERT INTO passwords (user_id, key_version, site_name, site_username, ciphertext)
+                    SELECT $1, $2, * FROM unnest($3::text[], $4::text[], $5::bytea[])
+                ''', user_id, keyring.current_version, site_names, site_usernames, encrypted)
+                imported += len(rows)
+                yield json.dumps({"imported": imported, "skipped": importer.skipped}) + '\n'
+
+        yield json.dumps({"done": True, "imported": imported, "skipped": importer.skipped}) + '\n'
+    except Exception as e:
+        print(f"Import Error: {e}") # Log internally
+        metrics.count_error()
+        yield json.dumps({"error": "Import stopped early.", "imported": imported}) + '\n'
+    finally:
+        text_stream.close()
+
+# Backup download (same formats as app.py): rows come from a server-side cursor and
+# are decrypted/re-encoded off the event loop one batch at a time.
+@app.route('/api/export', methods=['POST'])
+@token_required
+async def export_vault(current_user_id):
+    data = await request.get_json(silent=True) or await request.form
+    export_format = data.get('format') or 'archive'
+    if export_format not in ('archive', 'csv'):
+        return jsonify({"error": "Unknown export format"}), 400
+
+    keyring = await unlock_logic(current_user_id, data)
+    if keyring is None: return locked_response()
+
+    if export_format == 'archive':
+        archive_password = data.get('archive_password') or data.get('master_password')
+        if not archive_password:
+            return jsonify({"error": "An archive password is required"}), 400
+        await limit_kdf(rate_limit.account_limit(current_user_id))
+        salt = crypto_manager.generate_salt()
+        master_secret = await kdf_executor.derive_master_secret_async(archive_password, salt, kdf.DEFAULT_PARAMS)
+        header, archive_key = vault_export.archive_from_secret(salt, master_secret, kdf.DEFAULT_PARAMS)
+        first_line = json.dumps(header) + '\n'
+        encode = partial(vault_export.archive_entry_lines, archive_key=archive_key)
+        filename, mimetype = 'password-vault-backup.pvault', 'application/x-ndjson'
+    else:
+        first_line = vault_export.csv_line(vault_export.CSV_HEADER)
+        encode = vault_export.csv_entry_lines
+        filename, mimetype = 'password-vault-export.csv', 'text/csv'
+
+    return stream_with_context(stream_export)(current_user_id, keyring, first_line, encode), 200, {
+        'Content-Type': mimetype,
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Cache-Control': 'no-store'
+    }
+
+def encode_export_batch(rows, keyring, encode):
+    return ''.join(encode(vault_export.decrypted_entries(rows, keyring)))
+
+async def stream_export(user_id, keyring, first_line, encode):
+    yield first_line
+    try:
+        async with read_connection() as conn:
+            async with conn.transaction():
+                cursor = await conn.cursor('''
+                    SELECT id, site_name, site_username, encrypted_password, ciphertext, key_version FROM passwords
+                    WHERE user_id = $1 ORDER BY id
+                ''', user_id)
+                while True:
+                    rows = await cursor.fetch(vault_export.EXPORT_BATCH)
+                    if not rows:
+                        break
+                    rows = await current_entries(user_id, keyring, rows)
+                    yield await run_blocking(encode_export_batch, rows, keyring, encode)
+    except Exception as e:
+        # Headers are already sent, so all we can do is end the download early
+        print(f"Export Error: {e}") # Log internally
+        metrics.count_error()
+
+@app.route('/api/update_account', methods=['POST'])
+@token_required
+async def update_account(current_user_id):
+    data = await request.get_json()
+    current_password = data.get('current_password')
+    new_username = data.get('new_username')
+    new_password = data.get('new_password')
+
+    if new_password:
+        for char in BANNED_CHARS:
+            if char in new_password:
+                return jsonify({"error": "Password contains invalid characters"}), 400
+
+    user = await app.db.fetchrow('SELECT * FROM users WHERE id = $1', current_user_id)
+
+    old_kek = await unlock_with_password(user, current_password)
+    if old_kek is None:
+        return jsonify({"error": "Current Password incorrect"}), 401
+
+    try:
+        if new_password:
+            new_salt = crypto_manager.generate_salt()
+            new_secret = await kdf_executor.derive_master_secret_async(new_password, new_salt, kdf.DEFAULT_PARAMS)
+            new_hash = crypto_manager.auth_hash_from_secret(new_secret)
+            new_kek = crypto_manager.encryption_key_from_secret(new_secret)
+
+        async with app.db.acquire() as conn:
+            async with conn.transaction():
+                if new_username and new_username != user['username']:
+                    if await conn.fetchval('SELECT id FROM users WHERE username = $1', new_username):
+                        raise Exception("Username already taken")
+                    await conn.execute('UPDATE users SET username = $1 WHERE id = $2', new_username, current_user_id)
+
+                if new_password:
+                    await rewrap_keys(conn, current_user_id, old_kek, new_kek)
+                    await conn.execute('UPDATE users SET password_hash = $1, salt = $2, kdf_params = $3 WHERE id = $4',
+                                       new_hash, new_salt.hex(), kdf.DEFAULT_PARAMS, current_user_id)
+
+        mark_write()
+        session_cache.clear(request.cookies.get('token'))
+        user_cache.invalidate(current_user_id)
+        return jsonify({"message": "Account updated successfully"}), 200
+
+    except kdf_executor.KDFBusy:
+        raise
+    except Exception as e:
+        print(f"Account Update Error: {e}") # Log internally
+        return jsonify({"error": "An internal server error occurred."}), 500
+
+@app.route('/metrics', methods=['GET'])
+async def prometheus_metrics():
+    if not metrics.enabled():
+        return jsonify({"error": "Not found"}), 404
+    if not metrics.authorized(request.headers.get('Authorization')):
+        return jsonify({"error": "Unauthorized"}), 401
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type), 200
+
+@app.route('/api/stats', methods=['GET'])
+@token_required
+async def stats(current_user_id):
+    # Numbers for sizing the worker's resources (this worker only)
+    return jsonify({
+        "db_pool": pool_stats(app.db),
+        "db_replicas": [{
+            "healthy": app.replica_down_until[index] <= time.monotonic(),
+            "pool": pool_stats(pool),
+        } for index, pool in enumerate(app.replicas)] or None,
+        "kdf": kdf_executor.get_executor().stats()
+    }), 200
+
+def pool_stats(pool):
+    return {
+        "min_size": pool.get_min_size(),
+        "max_size": pool.get_max_size(),
+        "size": pool.get_size(),
+        "idle": pool.get_idle_size(),
+        "in_use": pool.get_size() - pool.get_idle_size(),
+    }
+
+@app.route('/api/delete_account', methods=['DELETE'])
+@token_required
+async def delete_account(current_user_id):
+    data = await request.get_json()
+    password_check = data.get('password', '').strip() # MOBILE FIX: Strip whitespace
+
+    # 1. Verify Password again before deleting
+    user, _ = await verify_password_logic(current_user_id, password_check, readonly=False)
+    if not user: return jsonify({"error": "Invalid Password"}), 401
+
+    try:
+        # Their passwords go with them (ON DELETE CASCADE)
+        await app.db.execute('DELETE FROM users WHERE id = $1', current_user_id)
+        mark_write()
+        session_cache.clear(request.cookies.get('token'))
+        user_cache.invalidate(current_user_id)
+        return jsonify({"message": "Account deleted successfully"}), 200
+    except Exception as e:
+        print(f"Delete Account Error: {e}") # Log internally
+        return jsonify({"error": "An internal server error occurred."}), 500
+
+if __name__ == '__main__':
+    app.run(debug=True, port=5000)
@@ -0,0 +1,292 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import uuid
+
+# Non-interactive benchmark suite.
+#   python benchmark.py                          run and compare against bench_baseline.json
+#   python benchmark.py --save                   run and store the results as the new baseline
+#   python benchmark.py --threshold 0.1          fail if anything is more than 10% slower
+#   python benchmark.py --skip-routes            crypto only (no database needed)
+#   python benchmark.py --skip-startup           without the cold start / worker memory checks
+#
+# Route timings go through the Flask test client against BENCH_DATABASE_URL, or an
+# embedded throwaway Postgres when the optional 'pgserver' package is installed.
+# The benchmark only touches its own (randomly named) user and deletes it at the end.
+# Baselines are machine specific: compare runs made on the same box.
+
+BASELINE_FILE = os.environ.get('BENCH_BASELINE', 'bench_baseline.json')
+THRESHOLD = float(os.environ.get('BENCH_THRESHOLD', 0.20)) # Allowed slowdown before a result counts as a regression
+VAULT_SIZES = [10, 100, 1000]
+KDF_RUNS = 3   # The KDF is slow on purpose, a few runs are enough
+FAST_RUNS = 20
+STARTUP_RUNS = 5
+STARTUP_WORKERS = 2
+STARTUP_TIMEOUT = 30 # Seconds to wait for gunicorn to answer
+
+BENCH_PASSWORD = 'bench-master-password'
+
+# UTILITY: Time a function; returns stats in milliseconds
+def measure(func, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return {
+        "median_ms": round(statistics.median(timings), 3),
+        "min_ms": round(min(timings), 3),
+        "max_ms": round(max(timings), 3),
+        "runs": runs
+    }
+
+# 1. CRYPTO
+def bench_crypto(results, sizes):
+    from cryptography.fernet import Fernet
+    import crypto_manager
+    import kdf
+
+    # One KDF run with the settings new accounts get (KDF_PARAMS): password check + key, as on login
+    salt = crypto_manager.generate_salt()
+    password_hash = crypto_manager.auth_hash_from_secret(
+        crypto_manager.derive_master_secret(BENCH_PASSWORD, salt, kdf.DEFAULT_PARAMS))
+    results['crypto.unlock_vault'] = measure(
+        lambda: crypto_manager.unlock_vault(BENCH_PASSWORD, salt.hex(), password_hash, kdf.DEFAULT_PARAMS), KDF_RUNS)
+
+    # Vault entries: binary envelope, one cipher per data key (vault_keys.Keyring).
+    # Old entries are Fernet tokens, which the same cipher still decrypts.
+    key = crypto_manager.generate_data_key()
+    cipher = crypto_manager.EntryCipher(key)
+    for size in sizes:
+        plain = [f"site-password-{i}" for i in range(size)]
+        envelopes = [cipher.encrypt(p) for p in plain]
+        tokens = [Fernet(key).encrypt(p.encode()).decode() for p in plain]
+        runs = max(3, FAST_RUNS * 100 // size)
+        results[f'crypto.entry_encrypt[{size}]'] = measure(
+            lambda: [cipher.encrypt(p) for p in plain], runs)
+        results[f'crypto.entry_decrypt[{size}]'] = measure(
+            lambda: [cipher.decrypt(e) for e in envelopes], runs)
+        results[f'crypto.entry_decrypt_fernet[{size}]'] = measure(
+            lambda: [cipher.decrypt(t) for t in tokens], runs)
+
+# 2. ROUTES
+def start_database():
+    # Returns (database url, server to keep alive) or (None, None) when there is nothing to run against
+    url = os.environ.get('BENCH_DATABASE_URL')
+    if url:
+        return url, None
+    try:
+        import pgserver
+    except ImportError:
+        return None, None
+    server = pgserver.get_server(tempfile.mkdtemp(prefix='vault-bench-'), cleanup_mode='delete')
+    return server.get_uri(), server
+
+def bench_routes(results, sizes):
+    url, server = start_database()
+    if not url:
+        print("Skipping route benchmarks: set BENCH_DATABASE_URL or install pgserver.")
+        return
+
+    # Must be set before the app modules read them
+    os.environ['DATABASE_URL'] = url
+    os.environ['UNLOCK_SESSIONS'] = '1'
+    os.environ['RATE_LIMIT'] = '0' # The login/KDF routes are called faster than the limiter allows
+    os.environ.setdefault('SECRET_KEY', uuid.uuid4().hex)
+
+    import pyotp
+    import db_setup
+    from app import create_app
+
+    db_setup.migrate()
+    client = create_app().test_client()
+
+    def call(method, path, expected, **kwargs):
+        resp = client.open(path, method=method, **kwargs)
+        body = resp.get_data() # Drains streamed responses
+        if resp.status_code != expected:
+            raise RuntimeError(f"{method} {path} returned {resp.status_code}: {body[:200]!r}")
+        return resp
+
+    username = f"bench_{uuid.uuid4().hex[:12]}"
+    account = {'username': username, 'password': BENCH_PASSWORD}
+    totp_secret = call('POST', '/api/register', 201, json=account).get_json()['secret']
+
+    def login():
+        call('POST', '/api/login', 200, json=dict(account, **{'2fa_code': pyotp.TOTP(totp_secret).now()}))
+
+    try:
+        results['route.login'] = measure(login, KDF_RUNS)
+        results['route.check_session'] = measure(lambda: call('GET', '/api/check_session', 200), FAST_RUNS)
+
+        # Password check path (one KDF run), then the unlocked session for everything else
+        entry = {'site_name': 'bench', 'site_username': 'user', 'site_password': 'secret'}
+        results['route.add_password (password)'] = measure(
+            lambda: call('POST', '/api/add_password', 201, json=dict(entry, master_password=BENCH_PASSWORD)), KDF_RUNS)
+        call('POST', '/api/get_passwords', 200, json={'master_password': BENCH_PASSWORD, 'unlock_session': True, 'limit': 1})
+        results['route.add_password'] = measure(lambda: call('POST', '/api/add_password', 201, json=entry), FAST_RUNS)
+
+        entry_id = call('GET', '/api/list_entries?limit=1', 200).get_json()['entries'][0]['id']
+        results['route.reveal_password'] = measure(
+            lambda: call('POST', '/api/reveal_password', 200, json={'id': entry_id}), FAST_RUNS)
+        results['route.update_password'] = measure(
+            lambda: call('PUT', '/api/update_password', 200, json=dict(entry, id=entry_id)), FAST_RUNS)
+
+        count = len(call('POST', '/api/get_passwords', 200, json={}).get_json())
+        for size in sizes:
+            # Grow the vault to `size` entries with batched inserts
+            while count < size:
+                chunk = min(size - count, 1000)
+                call('POST', '/api/batch', 200, json={'operations': [
+                    {'op': 'add', 'site_name': f'site{count + i}.example.com', 'site_username': f'user{count + i}',
+                     'site_password': f'password-{count + i}'} for i in range(chunk)]})
+                count += chunk
+
+            runs = max(3, FAST_RUNS * 100 // size)
+            results[f'route.get_passwords[{size}]'] = measure(
+                lambda: call('POST', '/api/get_passwords', 200, json={}), runs)
+            results[f'route.list_entries[{size}]'] = measure(
+                lambda: call('GET', f'/api/list_entries?limit={min(size, 500)}', 200), runs)
+            results[f'route.search[{size}]'] = measure(
+                lambda: call('GET', '/api/search?q=site1', 200), runs)
+            results[f'route.export_csv[{size}]'] = measure(
+                lambda: call('POST', '/api/export', 200, json={'format': 'csv'}), runs)
+    finally:
+        call('DELETE', '/api/delete_account', 200, json={'password': BENCH_PASSWORD})
+        if server is not None:
+            server.cleanup()
+
+# 3. STARTUP
+# Cold start = a fresh interpreter importing and building the app (what every worker
+# paid before preloading). Worker memory is the PSS of each gunicorn worker, which
+# counts pages shared with the master (preloaded code) only in part. Linux only.
+def bench_startup(results):
+    env = dict(os.environ, SECRET_KEY=os.environ.get('SECRET_KEY') or uuid.uuid4().hex)
+    results['startup.python'] = measure(
+        lambda: subprocess.run([sys.executable, '-c', 'pass'], check=True, env=env), STARTUP_RUNS)
+    results['startup.create_app'] = measure(
+        lambda: subprocess.run([sys.executable, '-c', 'import app; app.create_app()'], check=True, env=env), STARTUP_RUNS)
+
+    if not os.path.exists('/proc/self/smaps_rollup'):
+        print("Skipping worker memory benchmark: needs Linux /proc.")
+        return
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    env['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='vault-bench-metrics-')
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_config.py',
+                               '--workers', str(STARTUP_WORKERS), '--bind', f'127.0.0.1:{port}'],
+                              env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        ready_ms = wait_for_http(f'http://127.0.0.1:{port}/', started)
+        results['startup.gunicorn_ready'] = {"median_ms": round(ready_ms, 3), "min_ms": round(ready_ms, 3),
+                                             "max_ms": round(ready_ms, 3), "runs": 1}
+
+        for _ in range(STARTUP_WORKERS * 10): # Let every worker serve a few pages first
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/').read()
+        workers = worker_pids(server.pid)
+        pss = [proc_pss_mib(pid) for pid in workers]
+        results['startup.worker_pss'] = {
+            "median_mib": round(statistics.median(pss), 2),
+            "min_mib": round(min(pss), 2),
+            "max_mib": round(max(pss), 2),
+            "runs": len(pss)
+        }
+    finally:
+        server.terminate()
+        server.wait(timeout=STARTUP_TIMEOUT)
+
+def wait_for_http(url, started):
+    while time.perf_counter() - started < STARTUP_TIMEOUT:
+        try:
+            urllib.request.urlopen(url, timeout=1).read()
+            return (time.perf_counter() - started) * 1000
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"gunicorn did not answer within {STARTUP_TIMEOUT}s")
+
+def worker_pids(master_pid):
+    pids = []
+    for task in os.listdir(f'/proc/{master_pid}/task'):
+        with open(f'/proc/{master_pid}/task/{task}/children') as f:
+            pids.extend(int(pid) for pid in f.read().split())
+    return pids
+
+def proc_pss_mib(pid):
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            if line.startswith('Pss:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+# 4. BASELINE
+def compare(results, baseline, threshold):
+    # Timings are compared on median_ms, memory on median_mib
+    regressions = []
+    print(f"\n{'benchmark':<40} {'median':>12} {'baseline':>12} {'change':>9}")
+    for name, stats in results.items():
+        unit = 'ms' if 'median_ms' in stats else 'mib'
+        value = stats[f'median_{unit}']
+        before = baseline.get(name, {}).get(f'median_{unit}')
+        if before:
+            change = value / before - 1
+            flag = '  << REGRESSION' if change > threshold else ''
+            print(f"{name:<40} {value:>9.3f} {unit:<2} {before:>12.3f} {change:>+8.1%}{flag}")
+            if flag:
+                regressions.append(name)
+        else:
+            print(f"{name:<40} {value:>9.3f} {unit:<2} {'-':>12} {'new':>9}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Password Vault benchmarks")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="baseline JSON file")
+    parser.add_argument('--save', action='store_true', help="write these results as the new baseline")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help="allowed slowdown, e.g. 0.2 = 20%%")
+    parser.add_argument('--sizes', default=','.join(map(str, VAULT_SIZES)), help="vault sizes, comma separated")
+    parser.add_argument('--skip-routes', action='store_true', help="do not run the route benchmarks")
+    parser.add_argument('--skip-startup', action='store_true', help="do not run the startup benchmarks")
+    args = parser.parse_args()
+
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+    results = {}
+    bench_crypto(results, sizes)
+    if not args.skip_startup:
+        bench_startup(results)
+    if not args.skip_routes:
+        bench_routes(results, sizes)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get('results', {})
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({
+                "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cpu_count": os.cpu_count(),
+                "results": results
+            }, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+
+    if regressions and not args.save:
+        print(f"\n{len(regressions)} benchmark(s) slower than the baseline by more than {args.threshold:.0%}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
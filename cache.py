@@ -0,0 +1,48 @@
+import threading
+import time
+from collections import OrderedDict
+
+# A small in-memory cache for one gunicorn worker.
+# - Entries expire after `ttl` seconds without being read (idle timeout),
+#   or `ttl` seconds after they were stored when sliding=False (fixed lifetime).
+# - Once `max_size` is reached, the least recently used entry is evicted.
+class TTLCache:
+    def __init__(self, max_size, ttl, sliding=True):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.sliding = sliding
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+
+            value, last_used = item
+            now = time.monotonic()
+            if now - last_used > self.ttl:
+                del self._items[key]
+                return None
+
+            # Reading an entry counts as activity and makes it "recent" again
+            if self.sliding:
+                self._items[key] = (value, now)
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (value, time.monotonic())
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            item = self._items.pop(key, None)
+        return item[0] if item else None
+
+    def __len__(self):
+        return len(self._items)
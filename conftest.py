@@ -0,0 +1,15 @@
+import os
+import pytest
+import db_pool # Loads .env, like the app does
+
+# Manual scripts that prompt for input and need a running server, not pytest tests
+collect_ignore = ['test_login.py', 'test_vault.py']
+
+# The database tests run against DATABASE_URL (migrated first) and are skipped without it.
+# Each test creates its own throwaway users and deletes them afterwards.
+@pytest.fixture(scope='session')
+def database():
+    if not os.environ.get('DATABASE_URL'):
+        pytest.skip("DATABASE_URL is not set")
+    import db_setup
+    db_setup.migrate()
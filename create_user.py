@@ -1,11 +1,9 @@
 import psycopg2
 import pyotp 
 import crypto_manager
-import os
-from dotenv import load_dotenv
-
-# Load the connection string from .env
-load_dotenv()
+import kdf
+import db_pool
+import vault_keys
 
 def register_user():
     print("--- CREATE ADMIN USER (CLOUD) ---")
@@ -14,19 +12,22 @@ def register_user():
 
     # 1. Generate the security bits
     salt = crypto_manager.generate_salt()
-    password_hash = crypto_manager.hash_master_password(password, salt)
+    master_secret = crypto_manager.derive_master_secret(password, salt, kdf.DEFAULT_PARAMS)
+    password_hash = crypto_manager.auth_hash_from_secret(master_secret)
     two_factor_secret = pyotp.random_base32()
+    keyring = vault_keys.new_keyring()
 
     # 2. Connect to NEON (Cloud)
     try:
-        conn = psycopg2.connect(os.environ.get('DATABASE_URL'))
+        conn = db_pool.get_connection()
         cur = conn.cursor()
 
         # Postgres uses %s for placeholders
         cur.execute('''
-            INSERT INTO users (username, password_hash, salt, two_factor_secret)
-            VALUES (%s, %s, %s, %s)
-        ''', (username, password_hash, salt.hex(), two_factor_secret))
+            INSERT INTO users (username, password_hash, salt, two_factor_secret, kdf_params, data_key_version)
+            VALUES (%s, %s, %s, %s, %s, %s) RETURNING id
+        ''', (username, password_hash, salt.hex(), two_factor_secret, kdf.DEFAULT_PARAMS, keyring.current_version))
+        vault_keys.insert_keys(cur, cur.fetchone()[0], crypto_manager.encryption_key_from_secret(master_secret), keyring)
         
         conn.commit()
         print(f"\nSUCCESS: User '{username}' created in the Cloud Database!")
@@ -1,56 +1,120 @@
 import base64
+import hmac
 import os
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, InvalidToken
 from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+import kdf
+
+# Hashes written by the single-pass scheme start with this marker.
+# Anything without it is a legacy hash (plain base64 of the PBKDF2 output).
+AUTH_HASH_PREFIX = 'v2$'
 
 # 1. UTILITY: Generate a random salt
-# A 'salt' is random data added to a password before hashing. 
-# It ensures that if two users have the password "123456", 
+# A 'salt' is random data added to a password before hashing.
+# It ensures that if two users have the password "123456",
 # their hashes look completely different.
 def generate_salt():
     return os.urandom(16) # Returns 16 random bytes
 
-# 2. HASHING: For the Master Password (One-Way)
-def hash_master_password(plain_password, salt):
-    # We use PBKDF2, a standard algorithm that is intentionally slow 
-    # to stop hackers from guessing billions of passwords a second.
-    kdf = PBKDF2HMAC(
+# 2. MASTER SECRET: The one expensive step
+# We use a KDF (PBKDF2, scrypt or Argon2id, see kdf.py), an algorithm that is
+# intentionally slow to stop hackers from guessing billions of passwords a second.
+# Everything else (login check + vault key) is split from this result,
+# so each request only pays for it once.
+# `kdf_params` is required everywhere: the user's stored setting, or kdf.DEFAULT_PARAMS for a new one.
+def derive_master_secret(plain_password, salt_bytes, kdf_params):
+    return kdf.derive(kdf_params, plain_password, salt_bytes)
+
+# 3. SPLITTING THE SECRET
+# The login verifier is a one-way HKDF branch of it, so the stored hash
+# can no longer be used as the vault key.
+def encryption_key_from_secret(master_secret):
+    return base64.urlsafe_b64encode(master_secret)
+
+def auth_hash_from_secret(master_secret):
+    hkdf = HKDF(
         algorithm=hashes.SHA256(),
         length=32,
-        salt=salt,
-        iterations=480000, # Repeat the math 480,000 times
+        salt=None,
+        info=b'password-vault auth verifier',
     )
-    # We encode it in base64 so it's safe to store as text in the DB
-    return base64.urlsafe_b64encode(kdf.derive(plain_password.encode())).decode()
+    return AUTH_HASH_PREFIX + base64.urlsafe_b64encode(hkdf.derive(master_secret)).decode()
+
+def verify_master_secret(master_secret, stored_hash):
+    # Legacy rows stored the raw PBKDF2 output, new rows store the HKDF verifier
+    if needs_rehash(stored_hash):
+        candidate = encryption_key_from_secret(master_secret).decode()
+    else:
+        candidate = auth_hash_from_secret(master_secret)
+    return hmac.compare_digest(candidate.encode(), stored_hash.encode())
 
-def verify_master_password(plain_password, stored_salt_hex, stored_hash):
-    # To verify, we just run the same math on the input
-    # and check if the result matches what we have in the DB.
-    
+def needs_rehash(stored_hash):
+    return not stored_hash.startswith(AUTH_HASH_PREFIX)
+
+# A cached vault key is still the right one only while it matches the stored hash
+# (it changes when the password or the KDF settings change). No KDF run needed.
+def key_matches_hash(encryption_key, stored_hash):
+    return verify_master_secret(base64.urlsafe_b64decode(encryption_key), stored_hash)
+
+# 4. UNLOCK: Check the password and get the vault key from a single KDF run
+# Returns the encryption key, or None if the password is wrong.
+def unlock_vault(plain_password, stored_salt_hex, stored_hash, kdf_params):
     # Convert the stored salt from Hex (text) back to bytes
     salt_bytes = bytes.fromhex(stored_salt_hex)
-    
-    new_hash = hash_master_password(plain_password, salt_bytes)
-    return new_hash == stored_hash
-
-# 3. ENCRYPTION KEY DERIVATION
-# We turn the Master Password into a key for the "Safe"
-def derive_encryption_key(master_password, salt_bytes):
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=salt_bytes,
-        iterations=480000,
-    )
-    return base64.urlsafe_b64encode(kdf.derive(master_password.encode()))
 
-# 4. ENCRYPTION: For the Vault Data (Two-Way)
-def encrypt_val(key, plain_text):
-    f = Fernet(key)
-    # Fernet handles the heavy lifting of AES encryption
-    return f.encrypt(plain_text.encode()).decode()
+    master_secret = derive_master_secret(plain_password, salt_bytes, kdf_params)
+    if not verify_master_secret(master_secret, stored_hash):
+        return None
+    return encryption_key_from_secret(master_secret)
+
+# 5. ENVELOPE: Data keys wrapped by the vault key (see vault_keys.py)
+# Entries are encrypted with a random data key; the key derived from the master
+# password only encrypts ("wraps") that data key.
+def generate_data_key():
+    return Fernet.generate_key()
+
+def wrap_key(wrapping_key, data_key):
+    return Fernet(wrapping_key).encrypt(data_key).decode()
+
+def unwrap_key(wrapping_key, wrapped_key):
+    return Fernet(wrapping_key).decrypt(wrapped_key.encode())
+
+# 6. ENTRY ENVELOPE: How vault entries are stored (passwords.ciphertext, BYTEA)
+# 1 format byte + 12-byte nonce + AES-256-GCM ciphertext and tag: 29 bytes on top of
+# the password, where a Fernet token adds ~100 and is base64 text on top of that.
+# The AES key is an HKDF branch of the data key, so Fernet and AES-GCM never share a key.
+# Entries written before this format are Fernet tokens (text) and still decrypt.
+ENVELOPE_AESGCM_V1 = 1
+NONCE_SIZE = 12
+
+# Build once per data key and reuse for every entry (key setup is the costly part)
+class EntryCipher:
+    def __init__(self, key):
+        self.key = key
+        self._fernet = None
+        hkdf = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=b'password-vault entry aes-gcm v1',
+        )
+        self._aead = AESGCM(hkdf.derive(base64.urlsafe_b64decode(key)))
+
+    def encrypt(self, plain_text):
+        header = bytes([ENVELOPE_AESGCM_V1])
+        nonce = os.urandom(NONCE_SIZE)
+        return header + nonce + self._aead.encrypt(nonce, plain_text.encode(), header)
 
-def decrypt_val(key, encrypted_text):
-    f = Fernet(key)
-    return f.decrypt(encrypted_text.encode()).decode()
\ No newline at end of file
+    # `stored` is an envelope (bytes/memoryview from BYTEA) or a legacy Fernet token (str)
+    def decrypt(self, stored):
+        if isinstance(stored, str):
+            if self._fernet is None:
+                self._fernet = Fernet(self.key)
+            return self._fernet.decrypt(stored.encode()).decode()
+        stored = bytes(stored)
+        if len(stored) <= 1 + NONCE_SIZE or stored[0] != ENVELOPE_AESGCM_V1:
+            raise InvalidToken("Unknown entry format")
+        nonce = stored[1:1 + NONCE_SIZE]
+        return self._aead.decrypt(nonce, stored[1 + NONCE_SIZE:], stored[:1]).decode()
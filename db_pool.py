@@ -0,0 +1,303 @@
+import os
+import threading
+import time
+import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2 import extensions
+from dotenv import load_dotenv
+import metrics
+
+# Load the connection string from .env
+load_dotenv()
+
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))         # Seconds to wait for a free connection
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', 30)) # Idle seconds before a checkout pings the server
+
+# Read replicas (optional): DATABASE_REPLICA_URLS lists one or more DSNs, comma separated.
+# get_connection(readonly=True) takes turns between them; a replica that cannot be reached, or
+# is more than REPLICA_MAX_LAG_SECONDS behind, is left out for REPLICA_RETRY_SECONDS, and reads
+# go to the primary while none is usable (or while the usable ones have no free connection).
+# Replicas lag a little behind, so callers that must see their own writes use the primary.
+REPLICA_RETRY_SECONDS = float(os.environ.get('REPLICA_RETRY_SECONDS', 30))
+REPLICA_CONNECT_TIMEOUT = int(os.environ.get('REPLICA_CONNECT_TIMEOUT', 2)) # Seconds, so a dead host fails fast
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 5)) # 0 = no lag check
+
+# Seconds of replay lag, checked on every replica checkout. A replica that has replayed
+# everything it received counts as 0 (the last replayed commit gets old on a quiet primary).
+REPLICA_LAG_QUERY = '''
+    SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END
+'''
+
+class PoolTimeout(Exception):
+    pass
+
+# A connection borrowed from the pool.
+# It behaves like a normal psycopg2 connection, except close() hands it back.
+class PooledConnection:
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        self.replica = pool.replica # Index into the replica list, None = primary
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    @property
+    def closed(self):
+        return self._conn is None or self._conn.closed
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.putconn(conn)
+
+# Connections from the pool time every execute() as the request's 'db' phase
+class _TimedExecute:
+    def execute(self, query, vars=None):
+        with metrics.phase('db'):
+            return super().execute(query, vars)
+
+_timed_cursor_classes = {}
+
+class TimedConnection(extensions.connection):
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or extensions.cursor
+        if factory not in _timed_cursor_classes:
+            _timed_cursor_classes[factory] = type('Timed' + factory.__name__, (_TimedExecute, factory), {})
+        kwargs['cursor_factory'] = _timed_cursor_classes[factory]
+        return super().cursor(*args, **kwargs)
+
+class ConnectionPool:
+    def __init__(self, dsn, min_size=DB_POOL_MIN, max_size=DB_POOL_MAX,
+                 timeout=DB_POOL_TIMEOUT, check_after=DB_POOL_CHECK_AFTER, replica=None, on_broken=None,
+                 **connect_kwargs):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_after = check_after
+        self.replica = replica
+        self.on_broken = on_broken # Called when a connection comes back unusable
+
+        self._pool = pg_pool.ThreadedConnectionPool(min_size, max_size, dsn, connection_factory=TimedConnection,
+                                                    **connect_kwargs)
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._last_used = {} # id(conn) -> when it was last handed back
+
+        self._checkouts = 0
+        self._in_use = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+        self._recycled = 0
+
+    def getconn(self):
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._timeouts += 1
+            metrics.DB_TIMEOUTS.inc()
+            raise PoolTimeout(f"No database connection free after {self.timeout}s")
+
+        try:
+            conn = self._checkout_healthy()
+        except Exception:
+            self._slots.release()
+            raise
+
+        waited = time.monotonic() - start
+        with self._lock:
+            self._checkouts += 1
+            self._in_use += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        metrics.DB_CHECKOUTS.inc()
+        metrics.DB_IN_USE.inc()
+        return PooledConnection(self, conn)
+
+    def putconn(self, conn):
+        # psycopg2's pool rolls back unfinished transactions for us,
+        # we only have to drop connections that are no longer usable.
+        broken = conn.closed or conn.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN
+        metrics.DB_IN_USE.dec()
+        with self._lock:
+            self._in_use -= 1
+            if broken:
+                self._recycled += 1
+                self._last_used.pop(id(conn), None)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+        try:
+            self._pool.putconn(conn, close=broken)
+        finally:
+            self._slots.release()
+        if broken and self.on_broken:
+            self.on_broken()
+
+    def _checkout_healthy(self):
+        # Idle connections may have been dropped by the server (or a proxy),
+        # so test them before use and replace any that fail.
+        for _ in range(self.max_size + 1):
+            conn = self._pool.getconn()
+            if self._is_healthy(conn):
+                return conn
+            with self._lock:
+                self._recycled += 1
+                self._last_used.pop(id(conn), None)
+            self._pool.putconn(conn, close=True)
+        raise psycopg2.OperationalError("Could not get a healthy database connection")
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+
+        last_used = self._last_used.get(id(conn))
+        if last_used is None or time.monotonic() - last_used < self.check_after:
+            return True # Brand new or recently used
+
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "in_use": self._in_use,
+                "idle": len(self._pool._pool),
+                "checkouts": self._checkouts,
+                "wait_avg_ms": round(self._wait_total / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+                "wait_max_ms": round(self._wait_max * 1000, 3),
+                "timeouts": self._timeouts,
+                "recycled": self._recycled,
+            }
+
+# The replicas' pools, each opened on first use (a replica that is down at startup is fine)
+class ReplicaSet:
+    def __init__(self, dsns, retry_after=REPLICA_RETRY_SECONDS):
+        self.dsns = dsns
+        self.retry_after = retry_after
+        self._pools = [None] * len(dsns)
+        self._down_until = [0.0] * len(dsns)
+        self._next = 0
+        self._lock = threading.Lock()
+        self._failures = 0
+
+    # A replica connection, or None when no replica is usable right now.
+    # `replica` asks for that one only (a request keeps reading from the same replica).
+    def getconn(self, replica=None):
+        if replica is not None:
+            candidates = [replica]
+        else:
+            with self._lock:
+                start = self._next
+                self._next = (self._next + 1) % len(self.dsns)
+            candidates = [(start + offset) % len(self.dsns) for offset in range(len(self.dsns))]
+
+        for index in candidates:
+            if self._down_until[index] > time.monotonic():
+                continue
+            try:
+                conn = self._get_pool(index).getconn()
+            except PoolTimeout:
+                continue # Busy, not down: try the next one, then the primary
+            except psycopg2.OperationalError as e:
+                self._mark_down(index, e)
+                continue
+            try:
+                lag = self._lag(conn)
+            except psycopg2.Error as e:
+                conn.close()
+                self._mark_down(index, e)
+                continue
+            if REPLICA_MAX_LAG_SECONDS and lag > REPLICA_MAX_LAG_SECONDS:
+                conn.close()
+                self._mark_down(index, f"{lag:.1f}s behind")
+                continue
+            return conn
+        return None
+
+    def _lag(self, conn):
+        if not REPLICA_MAX_LAG_SECONDS:
+            return 0.0
+        cur = conn.cursor()
+        try:
+            cur.execute(REPLICA_LAG_QUERY)
+            return float(cur.fetchone()[0] or 0)
+        finally:
+            cur.close()
+            conn.rollback()
+
+    def _get_pool(self, index):
+        pool = self._pools[index]
+        if pool is None:
+            with self._lock:
+                pool = self._pools[index]
+                if pool is None:
+                    # A connection lost mid-query means the others are likely gone too
+                    pool = self._pools[index] = ConnectionPool(
+                        self.dsns[index], replica=index, connect_timeout=REPLICA_CONNECT_TIMEOUT,
+                        on_broken=lambda: self._mark_down(index, "connection lost"))
+        return pool
+
+    def _mark_down(self, index, error):
+        with self._lock:
+            self._failures += 1
+            self._down_until[index] = time.monotonic() + self.retry_after
+        metrics.DB_REPLICA_FAILURES.inc()
+        print(f"Replica {index} Error: {error}") # Log internally
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            "failures": self._failures,
+            "replicas": [{
+                "healthy": self._down_until[index] <= now,
+                "pool": pool.stats() if pool else None,
+            } for index, pool in enumerate(self._pools)],
+        }
+
+def replica_dsns():
+    return [dsn.strip() for dsn in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if dsn.strip()]
+
+# One pool per process: gunicorn workers must not share sockets after fork
+_pool = None
+_replicas = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool, _replicas, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ConnectionPool(os.environ.get('DATABASE_URL'))
+                dsns = replica_dsns()
+                _replicas = ReplicaSet(dsns) if dsns else None
+                _pool_pid = os.getpid()
+    return _pool
+
+# None when no replicas are configured
+def get_replicas():
+    get_pool()
+    return _replicas
+
+# readonly=True: the caller only reads and can live with a replica's slight lag
+def get_connection(readonly=False, replica=None):
+    with metrics.phase('db_wait'):
+        if readonly:
+            replicas = get_replicas()
+            conn = replicas.getconn(replica) if replicas else None
+            metrics.DB_REPLICA_READS.labels('replica' if conn else 'primary').inc()
+            if conn is not None:
+                return conn
+        return get_pool().getconn()
@@ -1,16 +1,15 @@
-import psycopg2
-import os
-from dotenv import load_dotenv
+import db_pool
+import kdf
 
-# Load the connection string from .env
-load_dotenv()
+# Schema migrations, applied in order and recorded in the schema_migrations table.
+# Every step is written to be safe on a database created by the old
+# create-tables script, so existing deployments just pick up the missing ones.
+# Run `python db_setup.py` after every deploy; it only applies what is new.
 
-def create_tables():
-    print("Connecting to Neon Database...")
-    conn = psycopg2.connect(os.environ.get('DATABASE_URL'))
-    cur = conn.cursor()
+MIGRATIONS_LOCK = 72_613_001 # Advisory lock id: two deploys cannot migrate at the same time
 
-    # 1. Create Users Table
+# 1. Original tables
+def create_base_tables(cur):
     # Note: 'SERIAL' is the Postgres way of saying Auto-Increment
     cur.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -21,8 +20,6 @@ def create_tables():
             two_factor_secret TEXT
         )
     ''')
-
-    # 2. Create Passwords Table
     cur.execute('''
         CREATE TABLE IF NOT EXISTS passwords (
             id SERIAL PRIMARY KEY,
@@ -34,10 +31,253 @@ def create_tables():
         )
     ''')
 
-    conn.commit()
-    cur.close()
-    conn.close()
-    print("SUCCESS: Tables created in the Cloud!")
+# 2. Every vault query is "WHERE user_id = ? ORDER BY id" (plus keyset paging on id),
+# so one composite index serves all of them and the cascade below.
+def index_passwords_by_owner(cur):
+    create_index_concurrently(cur, 'passwords_user_id_id_idx', 'passwords (user_id, id)')
+
+# 3. Deleting a user removes their passwords in the same statement.
+# Swapping the constraint takes an exclusive lock, so it is added NOT VALID (no scan) and
+# committed; the scan then runs in its own transaction (VALIDATE does not block reads or writes).
+def cascade_password_deletes(cur):
+    cur.execute('ALTER TABLE passwords DROP CONSTRAINT IF EXISTS passwords_user_id_fkey')
+    cur.execute('''
+        ALTER TABLE passwords ADD CONSTRAINT passwords_user_id_fkey
+        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE NOT VALID
+    ''')
+
+def validate_cascade_password_deletes(cur):
+    cur.execute('ALTER TABLE passwords VALIDATE CONSTRAINT passwords_user_id_fkey')
+
+# 4. Change tracking for entries (new/edited rows get the current time)
+def add_password_timestamps(cur):
+    cur.execute('ALTER TABLE passwords ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ NOT NULL DEFAULT now()')
+    cur.execute('ALTER TABLE passwords ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now()')
+
+# 5. Search indexes (trigram = fast substring/prefix matching for /api/search)
+# Search still works without them, just slower, so a missing extension is not fatal.
+def create_search_indexes(cur):
+    cur.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    create_index_concurrently(cur, 'passwords_site_name_trgm_idx', 'passwords USING gin (site_name gin_trgm_ops)')
+    create_index_concurrently(cur, 'passwords_site_username_trgm_idx', 'passwords USING gin (site_username gin_trgm_ops)')
+
+# 6. Per-user key derivation settings (see kdf.py); existing accounts used PBKDF2 at 480k
+def add_user_kdf_params(cur):
+    cur.execute(f"ALTER TABLE users ADD COLUMN IF NOT EXISTS kdf_params TEXT NOT NULL DEFAULT '{kdf.LEGACY_PARAMS}'")
+
+# 7. Vault versions for ETags and delta sync.
+# Every change to a user's entries bumps users.vault_version once per transaction and
+# stamps the changed rows with it; deleted entries leave a tombstone with the version.
+# Triggers do this, so every writer (routes, importer, CLI tools, async app) is covered.
+# The UPDATE on the users row also serializes a vault's writers, so versions are
+# committed in order and "changed since N" never misses a row.
+def add_vault_versions(cur):
+    cur.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS vault_version BIGINT NOT NULL DEFAULT 0')
+    cur.execute('ALTER TABLE passwords ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS password_tombstones (
+            user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            entry_id INTEGER NOT NULL,
+            version BIGINT NOT NULL,
+            deleted_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (user_id, entry_id)
+        )
+    ''')
+    cur.execute('CREATE INDEX IF NOT EXISTS password_tombstones_user_id_version_idx ON password_tombstones (user_id, version)')
+
+    # The version is remembered in a transaction-local setting, so a 500-row import bumps it once
+    cur.execute('''
+        CREATE OR REPLACE FUNCTION vault_next_version(owner INTEGER) RETURNS BIGINT AS $$
+        DECLARE
+            setting TEXT := 'vault.version_' || owner;
+            next_version BIGINT := NULLIF(current_setting(setting, true), '')::BIGINT;
+        BEGIN
+            IF next_version IS NULL THEN
+                UPDATE users SET vault_version = vault_version + 1 WHERE id = owner
+                RETURNING vault_version INTO next_version;
+                IF next_version IS NOT NULL THEN
+                    PERFORM set_config(setting, next_version::TEXT, true);
+                END IF;
+            END IF;
+            RETURN next_version; -- NULL when the user is being deleted
+        END
+        $$ LANGUAGE plpgsql
+    ''')
+    cur.execute('''
+        CREATE OR REPLACE FUNCTION passwords_stamp_version() RETURNS trigger AS $$
+        BEGIN
+            NEW.version := vault_next_version(NEW.user_id);
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    ''')
+    cur.execute('''
+        CREATE OR REPLACE FUNCTION passwords_tombstone() RETURNS trigger AS $$
+        DECLARE
+            deleted_version BIGINT := vault_next_version(OLD.user_id);
+        BEGIN
+            IF deleted_version IS NOT NULL THEN
+                INSERT INTO password_tombstones (user_id, entry_id, version)
+                VALUES (OLD.user_id, OLD.id, deleted_version)
+                ON CONFLICT (user_id, entry_id) DO UPDATE SET version = EXCLUDED.version;
+            END IF;
+            RETURN OLD;
+        END
+        $$ LANGUAGE plpgsql
+    ''')
+    cur.execute('DROP TRIGGER IF EXISTS passwords_stamp_version ON passwords')
+    cur.execute('''
+        CREATE TRIGGER passwords_stamp_version BEFORE INSERT OR UPDATE ON passwords
+        FOR EACH ROW EXECUTE FUNCTION passwords_stamp_version()
+    ''')
+    cur.execute('DROP TRIGGER IF EXISTS passwords_tombstone ON passwords')
+    cur.execute('''
+        CREATE TRIGGER passwords_tombstone AFTER DELETE ON passwords
+        FOR EACH ROW EXECUTE FUNCTION passwords_tombstone()
+    ''')
+
+# 8. "Changed since N" lookups for /api/vault_changes
+def index_passwords_by_version(cur):
+    create_index_concurrently(cur, 'passwords_user_id_version_idx', 'passwords (user_id, version)')
+
+# 9. Envelope encryption: per-user data keys, wrapped by the master-password key (see vault_keys.py).
+# users.data_key_version NULL = not converted yet; passwords.key_version NULL = encrypted
+# with the account's original vault key (data key version 0 once converted).
+# A data key cannot be deleted while entries still use it. Like step 3, that foreign key is
+# added NOT VALID and committed (this step locks passwords exclusively for the new column),
+# and the scan of passwords runs in its own transaction.
+def add_data_keys(cur):
+    cur.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS data_key_version INTEGER')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS data_keys (
+            user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            version INTEGER NOT NULL,
+            wrapped_key TEXT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (user_id, version)
+        )
+    ''')
+    cur.execute('ALTER TABLE passwords ADD COLUMN IF NOT EXISTS key_version INTEGER')
+    cur.execute('ALTER TABLE passwords DROP CONSTRAINT IF EXISTS passwords_key_version_fkey')
+    cur.execute('''
+        ALTER TABLE passwords ADD CONSTRAINT passwords_key_version_fkey
+        FOREIGN KEY (user_id, key_version) REFERENCES data_keys (user_id, version) NOT VALID
+    ''')
+
+def validate_data_keys(cur):
+    cur.execute('ALTER TABLE passwords VALIDATE CONSTRAINT passwords_key_version_fkey')
+
+# 10. Finding entries on retired data keys (and the foreign key check when one is deleted)
+def index_passwords_by_key_version(cur):
+    create_index_concurrently(cur, 'passwords_user_id_key_version_idx', 'passwords (user_id, key_version)')
+
+# 11. Entries as binary envelopes (crypto_manager.EntryCipher) in a BYTEA column.
+# Old entries keep their Fernet token in encrypted_password until they are rewritten; the
+# keys that existed before this step are marked, so their vaults are converted on the next
+# unlock (see vault_keys.py). Every entry has exactly one of the two columns; like step 3,
+# that check is added NOT VALID and committed, and scanned for in its own transaction.
+def add_binary_ciphertext(cur):
+    cur.execute('ALTER TABLE passwords ADD COLUMN IF NOT EXISTS ciphertext BYTEA')
+    cur.execute('ALTER TABLE passwords ALTER COLUMN encrypted_password DROP NOT NULL')
+    cur.execute('ALTER TABLE passwords DROP CONSTRAINT IF EXISTS passwords_one_ciphertext')
+    cur.execute('''
+        ALTER TABLE passwords ADD CONSTRAINT passwords_one_ciphertext
+        CHECK (num_nonnulls(encrypted_password, ciphertext) = 1) NOT VALID
+    ''')
+    # Existing keys get true, keys created from now on false
+    cur.execute('ALTER TABLE data_keys ADD COLUMN IF NOT EXISTS fernet_entries BOOLEAN NOT NULL DEFAULT true')
+    cur.execute('ALTER TABLE data_keys ALTER COLUMN fernet_entries SET DEFAULT false')
+
+def validate_binary_ciphertext(cur):
+    cur.execute('ALTER TABLE passwords VALIDATE CONSTRAINT passwords_one_ciphertext')
+
+# 12. Entries that do not decrypt any more are set aside (see vault_keys.py) instead of being
+# retried by every re-encryption batch. They keep their key_version, so the foreign key keeps
+# the one data key that could read them. Adding a nullable column without a default is instant.
+def add_quarantined_entries(cur):
+    cur.execute('ALTER TABLE passwords ADD COLUMN IF NOT EXISTS quarantined_at TIMESTAMPTZ')
+
+# (version, description, function(s), runs outside a transaction, optional)
+# A tuple of functions runs as one transaction each, in order; the version is recorded with the last.
+# CONCURRENTLY builds do not block writes, but Postgres refuses them inside a transaction.
+# Optional steps that fail are skipped with a warning and retried on the next run.
+MIGRATIONS = [
+    (1, "users and passwords tables", create_base_tables, False, False),
+    (2, "index passwords by owner", index_passwords_by_owner, True, False),
+    (3, "cascade password deletes", (cascade_password_deletes, validate_cascade_password_deletes), False, False),
+    (4, "password timestamps", add_password_timestamps, False, False),
+    (5, "trigram search indexes", create_search_indexes, True, True),
+    (6, "per-user KDF settings", add_user_kdf_params, False, False),
+    (7, "vault versions and tombstones", add_vault_versions, False, False),
+    (8, "index passwords by version", index_passwords_by_version, True, False),
+    (9, "envelope encryption data keys", (add_data_keys, validate_data_keys), False, False),
+    (10, "index passwords by key version", index_passwords_by_key_version, True, False),
+    (11, "binary entry ciphertext", (add_binary_ciphertext, validate_binary_ciphertext), False, False),
+    (12, "quarantined entries", add_quarantined_entries, False, False),
+]
+
+# UTILITY: CREATE INDEX CONCURRENTLY, recovering from an earlier failed build
+# (a failed concurrent build leaves an INVALID index that IF NOT EXISTS would keep).
+def create_index_concurrently(cur, name, definition):
+    cur.execute('''
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND NOT i.indisvalid
+    ''', (name,))
+    if cur.fetchone():
+        cur.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+    cur.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}')
+
+def applied_versions(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    ''')
+    cur.execute('SELECT version FROM schema_migrations')
+    return {row[0] for row in cur.fetchall()}
+
+def migrate():
+    print("Connecting to Neon Database...")
+    conn = db_pool.get_connection()
+    conn.set_session(autocommit=True)
+    cur = conn.cursor()
+    try:
+        cur.execute('SELECT pg_advisory_lock(%s)', (MIGRATIONS_LOCK,))
+        applied = applied_versions(cur)
+
+        for version, description, steps, outside_transaction, optional in MIGRATIONS:
+            if version in applied:
+                continue
+            try:
+                # Inside a transaction the (last) step and its record commit together.
+                # Earlier steps of a tuple stay committed if a later one fails, so they must be safe to rerun.
+                conn.set_session(autocommit=outside_transaction)
+                steps = steps if isinstance(steps, tuple) else (steps,)
+                for step in steps[:-1]:
+                    step(cur)
+                    conn.commit()
+                steps[-1](cur)
+                cur.execute('INSERT INTO schema_migrations (version, description) VALUES (%s, %s)',
+                            (version, description))
+                conn.commit()
+                print(f"APPLIED: {version:03d} {description}")
+            except Exception as e:
+                conn.rollback()
+                if not optional:
+                    print(f"ERROR: Migration {version:03d} ({description}) failed: {e}")
+                    raise
+                print(f"WARNING: Skipped {version:03d} {description} ({e})")
+
+        print("SUCCESS: Database is up to date!")
+    finally:
+        conn.rollback()
+        conn.set_session(autocommit=True)
+        cur.execute('SELECT pg_advisory_unlock(%s)', (MIGRATIONS_LOCK,))
+        cur.close()
+        conn.set_session(autocommit=False)
+        conn.close()
 
 if __name__ == '__main__':
-    create_tables()
\ No newline at end of file
+    migrate()
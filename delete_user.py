@@ -1,9 +1,4 @@
-import psycopg2
-import os
-from dotenv import load_dotenv
-
-# Load the connection string from .env
-load_dotenv()
+import db_pool
 
 def force_delete_user():
     print("--- ADMIN: FORCE DELETE USER ---")
@@ -19,7 +14,7 @@ def force_delete_user():
         return
 
     try:
-        conn = psycopg2.connect(os.environ.get('DATABASE_URL'))
+        conn = db_pool.get_connection()
         cur = conn.cursor()
 
         # 1. Get User ID
@@ -32,11 +27,11 @@ def force_delete_user():
 
         user_id = user[0]
 
-        # 2. Delete all passwords belonging to this user (Foreign Key cleanup)
-        cur.execute("DELETE FROM passwords WHERE user_id = %s", (user_id,))
-        passwords_deleted = cur.rowcount
+        # 2. Count their passwords (for the report below)
+        cur.execute("SELECT COUNT(*) FROM passwords WHERE user_id = %s", (user_id,))
+        passwords_deleted = cur.fetchone()[0]
 
-        # 3. Delete the user record
+        # 3. Delete the user record (their passwords go with it: ON DELETE CASCADE)
         cur.execute("DELETE FROM users WHERE id = %s", (user_id,))
         
         conn.commit()
@@ -1,2 +1,36 @@
-workers = 4
-bind = "0.0.0.0:10000"
\ No newline at end of file
+import os
+import shutil
+import tempfile
+
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+bind = "0.0.0.0:10000"
+
+# Build the app once in the master and fork the workers from it: imports are paid once
+# (faster boots and worker recycles) and the loaded code is shared between workers.
+# `gunicorn -c gunicorn_config.py` needs no app argument.
+wsgi_app = "app:create_app()"
+preload_app = True
+
+# Threads let a worker keep serving cheap routes (check_session, static files)
+# while other requests wait on the KDF process pool.
+worker_class = "gthread"
+threads = 8
+
+# Share the cores between the workers' KDF pools instead of giving each worker all of them
+# (kdf_executor sizes its pool from this)
+os.environ['WEB_CONCURRENCY'] = str(workers)
+
+# Prometheus multiprocess mode: each worker writes its metrics to this directory
+# and /metrics sums them, so a scrape sees all workers whichever one answers.
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                                    os.path.join(tempfile.gettempdir(), 'password-vault-metrics'))
+
+# Start empty so numbers from a previous run are not added in. This runs when the
+# config is loaded, because the preloaded app already creates metric files before on_starting.
+shutil.rmtree(metrics_dir, ignore_errors=True)
+os.makedirs(metrics_dir, exist_ok=True)
+
+def child_exit(server, worker):
+    # Drop the live gauges (connections in use) of a worker that has gone
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,18 @@
+import os
+import tempfile
+
+# Config for the async serving mode:
+#   hypercorn --config python:hypercorn_config async_app:app
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+bind = ["0.0.0.0:10000"]
+worker_class = "asyncio"
+
+# Share the cores between the workers' KDF pools instead of giving each worker all of them
+# (kdf_executor sizes its pool from this)
+os.environ['WEB_CONCURRENCY'] = str(workers)
+
+# Prometheus multiprocess mode, as in gunicorn_config.py. Hypercorn has no
+# worker-exit hook, so clear this directory before each start.
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                                    os.path.join(tempfile.gettempdir(), 'password-vault-metrics'))
+os.makedirs(metrics_dir, exist_ok=True)
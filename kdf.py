@@ -0,0 +1,117 @@
+import argparse
+import os
+import time
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.argon2 import Argon2id
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+# Key derivation settings are stored per user (users.kdf_params) as one short string:
+#   pbkdf2-sha256$i=480000          PBKDF2-HMAC-SHA256, i iterations
+#   scrypt$n=131072,r=8,p=1         scrypt, memory = 128 * n * r bytes
+#   argon2id$t=3,m=65536,p=4        Argon2id, t passes over m KiB with p lanes
+# New accounts get KDF_PARAMS; older accounts move to it on their next login.
+# Pick KDF_PARAMS for your hardware with: python kdf.py calibrate
+
+LEGACY_PARAMS = 'pbkdf2-sha256$i=480000' # What every account used before per-user settings
+DEFAULT_PARAMS = os.environ.get('KDF_PARAMS', LEGACY_PARAMS)
+
+KEY_LENGTH = 32
+
+def parse(params):
+    algorithm, _, settings = params.partition('$')
+    values = {}
+    for item in settings.split(','):
+        name, _, value = item.partition('=')
+        values[name] = int(value)
+
+    if algorithm == 'pbkdf2-sha256' and set(values) == {'i'}:
+        return algorithm, values
+    if algorithm == 'scrypt' and set(values) == {'n', 'r', 'p'}:
+        return algorithm, values
+    if algorithm == 'argon2id' and set(values) == {'t', 'm', 'p'}:
+        return algorithm, values
+    raise ValueError(f"Unknown KDF parameters: {params}")
+
+def format_params(algorithm, values):
+    order = {'pbkdf2-sha256': 'i', 'scrypt': 'nrp', 'argon2id': 'tmp'}[algorithm]
+    return algorithm + '$' + ','.join(f"{name}={values[name]}" for name in order)
+
+def derive(params, plain_password, salt_bytes):
+    algorithm, values = parse(params)
+    if algorithm == 'pbkdf2-sha256':
+        kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=KEY_LENGTH, salt=salt_bytes, iterations=values['i'])
+    elif algorithm == 'scrypt':
+        kdf = Scrypt(salt=salt_bytes, length=KEY_LENGTH, n=values['n'], r=values['r'], p=values['p'])
+    else:
+        kdf = Argon2id(salt=salt_bytes, length=KEY_LENGTH, iterations=values['t'],
+                       lanes=values['p'], memory_cost=values['m'])
+    return kdf.derive(plain_password.encode())
+
+# --- CALIBRATION ---
+# Finds the most expensive settings that still derive within the target time on this machine.
+# Run it on the production hardware (with the server idle) and put the result in KDF_PARAMS.
+
+def time_derive(params, runs=3):
+    salt = os.urandom(16)
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        derive(params, 'calibration-password', salt)
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+def calibrate_pbkdf2(target_ms):
+    # Cost grows linearly with the iteration count
+    sample = 100_000
+    per_iteration = time_derive(format_params('pbkdf2-sha256', {'i': sample})) / sample
+    iterations = max(100_000, int(target_ms / per_iteration) // 10_000 * 10_000)
+    return format_params('pbkdf2-sha256', {'i': iterations})
+
+def calibrate_scrypt(target_ms, max_memory_mib):
+    # Double n (memory and time together) while it stays under the target
+    values = {'n': 2 ** 14, 'r': 8, 'p': 1}
+    while 128 * values['n'] * 2 * values['r'] <= max_memory_mib * 1024 * 1024:
+        if time_derive(format_params('scrypt', dict(values, n=values['n'] * 2))) > target_ms:
+            break
+        values['n'] *= 2
+    return format_params('scrypt', values)
+
+def calibrate_argon2id(target_ms, max_memory_mib, lanes):
+    # Fix the memory, then add passes until the target is reached.
+    # If even one pass is too slow, halve the memory instead.
+    values = {'t': 1, 'm': max_memory_mib * 1024, 'p': lanes}
+    while values['m'] > 8 * 1024 and time_derive(format_params('argon2id', values)) > target_ms:
+        values['m'] //= 2
+    while time_derive(format_params('argon2id', dict(values, t=values['t'] + 1))) <= target_ms:
+        values['t'] += 1
+    return format_params('argon2id', values)
+
+def calibrate(algorithm, target_ms, max_memory_mib=64, lanes=4):
+    if algorithm == 'pbkdf2-sha256':
+        return calibrate_pbkdf2(target_ms)
+    if algorithm == 'scrypt':
+        return calibrate_scrypt(target_ms, max_memory_mib)
+    return calibrate_argon2id(target_ms, max_memory_mib, lanes)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Key derivation tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    cal = commands.add_parser('calibrate', help="pick KDF_PARAMS for this machine")
+    cal.add_argument('--algorithm', choices=['argon2id', 'scrypt', 'pbkdf2-sha256'], default='argon2id')
+    cal.add_argument('--target-ms', type=float, default=250, help="time one derivation should take")
+    cal.add_argument('--max-memory-mib', type=int, default=64,
+                     help="memory per derivation (each KDF pool process needs this much)")
+    cal.add_argument('--lanes', type=int, default=4, help="Argon2id parallelism")
+
+    bench = commands.add_parser('time', help="time the given (or current) KDF_PARAMS")
+    bench.add_argument('params', nargs='?', default=DEFAULT_PARAMS)
+
+    args = parser.parse_args()
+    if args.command == 'calibrate':
+        params = calibrate(args.algorithm, args.target_ms, args.max_memory_mib, args.lanes)
+        print(f"{params}  ({time_derive(params):.0f} ms)")
+        print(f"\nAdd to .env:\nKDF_PARAMS={params}")
+    else:
+        print(f"{args.params}: {time_derive(args.params):.0f} ms")
@@ -0,0 +1,139 @@
+import asyncio
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import crypto_manager
+import metrics
+
+# The slow KDF runs in a separate process pool so web threads
+# only wait on it, and a bounded queue turns overload into a fast 503
+# instead of a pile-up that stalls every other route.
+# Every web worker has its own pool, so by default the cores are shared between
+# WEB_CONCURRENCY workers (the variable gunicorn also reads for its worker count).
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+KDF_POOL_SIZE = int(os.environ.get('KDF_POOL_SIZE', max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY)))
+KDF_QUEUE_MAX = int(os.environ.get('KDF_QUEUE_MAX', KDF_POOL_SIZE * 2))
+KDF_RETRY_AFTER = int(os.environ.get('KDF_RETRY_AFTER', 2)) # Seconds, sent back with the 503
+
+class KDFBusy(Exception):
+    pass
+
+def _timed_derive(plain_password, salt_bytes, kdf_params):
+    # Runs inside the pool process; the timestamps let the caller split
+    # queue wait from actual KDF time.
+    started_at = time.time()
+    master_secret = crypto_manager.derive_master_secret(plain_password, salt_bytes, kdf_params)
+    return master_secret, started_at, time.time()
+
+class KDFExecutor:
+    def __init__(self, pool_size=KDF_POOL_SIZE, queue_max=KDF_QUEUE_MAX):
+        self.pool_size = pool_size
+        self.queue_max = queue_max
+
+        # 'spawn' keeps the pool processes clean of the web worker's threads and sockets
+        self._executor = ProcessPoolExecutor(max_workers=pool_size,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        self._slots = threading.BoundedSemaphore(pool_size + queue_max)
+        self._lock = threading.Lock()
+
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._run_total = 0.0
+
+    def derive_master_secret(self, plain_password, salt_bytes, kdf_params):
+        submitted_at = self._admit()
+        try:
+            future = self._executor.submit(_timed_derive, plain_password, salt_bytes, kdf_params)
+            master_secret, started_at, finished_at = future.result()
+        finally:
+            self._release()
+        self._record(submitted_at, started_at, finished_at)
+        return master_secret
+
+    async def derive_master_secret_async(self, plain_password, salt_bytes, kdf_params):
+        # Same as above for the asyncio app: awaiting the pool keeps the event loop free
+        submitted_at = self._admit()
+        try:
+            future = self._executor.submit(_timed_derive, plain_password, salt_bytes, kdf_params)
+            master_secret, started_at, finished_at = await asyncio.wrap_future(future)
+        finally:
+            self._release()
+        self._record(submitted_at, started_at, finished_at)
+        return master_secret
+
+    def _admit(self):
+        # Admission control: never block here, reject straight away when full
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            metrics.KDF_RUNS.labels('rejected').inc()
+            raise KDFBusy("KDF queue is full")
+
+        with self._lock:
+            self._in_flight += 1
+        return time.time()
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def _record(self, submitted_at, started_at, finished_at):
+        waited = max(0.0, started_at - submitted_at)
+        with self._lock:
+            self._completed += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            self._run_total += finished_at - started_at
+        metrics.KDF_RUNS.labels('ok').inc()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pool_size": self.pool_size,
+                "queue_max": self.queue_max,
+                "running": min(self._in_flight, self.pool_size),
+                "queue_depth": max(0, self._in_flight - self.pool_size),
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "wait_avg_ms": round(self._wait_total / self._completed * 1000, 3) if self._completed else 0.0,
+                "wait_max_ms": round(self._wait_max * 1000, 3),
+                "run_avg_ms": round(self._run_total / self._completed * 1000, 3) if self._completed else 0.0,
+            }
+
+# One executor per process, created on first use (after gunicorn forks)
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                warn_if_unsized()
+                _executor = KDFExecutor()
+                _executor_pid = os.getpid()
+    return _executor
+
+# Under a multi-worker server without either setting, every worker would get a process per core
+def warn_if_unsized():
+    if 'KDF_POOL_SIZE' in os.environ or 'WEB_CONCURRENCY' in os.environ:
+        return
+    if os.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn') or 'hypercorn' in os.path.basename(sys.argv[0]):
+        print(f"KDF Pool Warning: neither WEB_CONCURRENCY nor KDF_POOL_SIZE is set, so each worker "
+              f"starts {KDF_POOL_SIZE} KDF processes; set WEB_CONCURRENCY to the number of workers") # Log internally
+
+def derive_master_secret(plain_password, salt_bytes, kdf_params):
+    with metrics.phase('kdf'):
+        return get_executor().derive_master_secret(plain_password, salt_bytes, kdf_params)
+
+async def derive_master_secret_async(plain_password, salt_bytes, kdf_params):
+    with metrics.phase('kdf'):
+        return await get_executor().derive_master_secret_async(plain_password, salt_bytes, kdf_params)
@@ -0,0 +1,373 @@
+import argparse
+import json
+import queue
+import random
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+import pyotp
+import requests
+
+# Unattended load generator for a running server (test_login.py / test_vault.py are the manual versions).
+#   python loadgen.py --url http://127.0.0.1:5000 --users 50 --concurrency 20 --duration 60
+#   python loadgen.py --rate 200 --mix check_session=30,list=40,add=10,update=10,delete=5,login=5
+#   add --json results.json to keep the numbers
+# Synthetic users are registered through the API, log in with TOTP codes computed from their
+# secrets, and keep their session cookies like a browser. Each worker picks a free user, runs one
+# operation from the weighted mix and hands the user back. The run ends with throughput and
+# p50/p95/p99 latency per endpoint; the users are deleted again unless --keep-users is given.
+#
+# Registration, login and vault unlocks run the KDF, so the server's RATE_LIMIT_PER_IP has to
+# allow that many per window (429s are retried after Retry-After while provisioning).
+
+DEFAULT_MIX = "login=5,check_session=25,list=35,add=15,update=12,delete=8"
+ENTRIES_PER_USER = 20 # Seeded into every vault, so list/update/delete have something to work on
+LIST_LIMIT = 100
+PROVISION_RETRIES = 5
+
+class LoadError(Exception):
+    pass
+
+# UTILITY: Latencies and status codes per endpoint (shared by all workers)
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {} # endpoint -> [ms]
+        self.statuses = {}  # endpoint -> Counter({status: n})
+        self.errors = Counter()
+
+    def add(self, endpoint, ms, status, ok):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(ms)
+            self.statuses.setdefault(endpoint, Counter())[status] += 1
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def summary(self, elapsed):
+        results = {}
+        for endpoint in sorted(self.latencies):
+            timings = sorted(self.latencies[endpoint])
+            results[endpoint] = {
+                "requests": len(timings),
+                "errors": self.errors[endpoint],
+                "rps": round(len(timings) / elapsed, 2),
+                "p50_ms": round(percentile(timings, 50), 2),
+                "p95_ms": round(percentile(timings, 95), 2),
+                "p99_ms": round(percentile(timings, 99), 2),
+                "max_ms": round(timings[-1], 2),
+                "statuses": {str(status): n for status, n in sorted(self.statuses[endpoint].items(), key=str)},
+            }
+        return results
+
+# Nearest-rank percentile of an already sorted list
+def percentile(sorted_values, pct):
+    rank = max(1, -(-len(sorted_values) * pct // 100)) # ceil
+    return sorted_values[int(rank) - 1]
+
+# UTILITY: Spaces requests out to `rate` per second across all workers (None = as fast as possible)
+# Latency is timed from each request's scheduled start, so a server that falls behind shows up
+# in the percentiles instead of just slowing the generator down (no coordinated omission).
+class Pacer:
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return time.perf_counter()
+        with self._lock:
+            slot = self._next
+            self._next = slot + self.interval
+        delay = slot - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        return slot
+
+# 1. SYNTHETIC USERS
+# One browser-like session per user: cookies (token, unlock, recent write) persist between requests.
+class VirtualUser:
+    def __init__(self, base_url, username, password):
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.secret = None
+        self.entry_ids = []
+        self.session = requests.Session()
+
+    def request(self, method, path, **kwargs):
+        return self.session.request(method, self.base_url + path, timeout=30, **kwargs)
+
+    def register(self):
+        resp = with_retry(lambda: self.request('POST', '/api/register', json={"username": self.username, "password": self.password}))
+        if resp.status_code != 201:
+            raise LoadError(f"Register {self.username} failed: {resp.status_code} {resp.text[:200]}")
+        self.secret = resp.json()['secret']
+
+    def login(self):
+        return self.request('POST', '/api/login', json={
+            "username": self.username,
+            "password": self.password,
+            "2fa_code": pyotp.TOTP(self.secret).now()
+        })
+
+    # Like vaultFetch in static/app.js: use the unlocked session, unlock again (one KDF run) on 401
+    def vault_request(self, method, path, payload, unlock_session=True):
+        if unlock_session and self.session.cookies.get('vault_unlock'):
+            resp = self.request(method, path, json=payload)
+            if resp.status_code != 401:
+                return resp
+        return self.request(method, path, json={**payload, "master_password": self.password,
+                                                  "unlock_session": unlock_session})
+
+    def seed(self, count):
+        operations = [{"op": "add", "site_name": f"site-{i}.example", "site_username": f"{self.username}@example.com",
+                       "site_password": secrets.token_urlsafe(12)} for i in range(count)]
+        resp = with_retry(lambda: self.vault_request('POST', '/api/batch', {"operations": operations}))
+        if resp.status_code != 200:
+            raise LoadError(f"Seeding {self.username} failed: {resp.status_code} {resp.text[:200]}")
+        self.entry_ids = resp.json()['added']
+
+    def delete_account(self):
+        if not self.session.cookies.get('token'):
+            with_retry(self.login)
+        resp = with_retry(lambda: self.request('DELETE', '/api/delete_account', json={"password": self.password}))
+        if resp.status_code != 200:
+            raise LoadError(f"Deleting {self.username} failed: {resp.status_code} {resp.text[:200]}")
+
+# UTILITY: Retry a provisioning call the server rate limited or was too busy for
+def with_retry(send):
+    for _ in range(PROVISION_RETRIES):
+        resp = send()
+        if resp.status_code not in (429, 503):
+            return resp
+        time.sleep(float(resp.headers.get('Retry-After') or 1))
+    return resp
+
+def new_users(base_url, count):
+    prefix = f"load-{secrets.token_hex(3)}-"
+    return [VirtualUser(base_url, f"{prefix}{i}", secrets.token_urlsafe(16)) for i in range(count)]
+
+def provision_users(users, entries, workers):
+    def setup(user):
+        user.register()
+        resp = with_retry(user.login)
+        if resp.status_code != 200:
+            raise LoadError(f"Login {user.username} failed: {resp.status_code} {resp.text[:200]}")
+        if entries:
+            user.seed(entries)
+
+    run_parallel(setup, users, workers)
+
+# Only users that got registered (a failed provisioning run cleans up too)
+def delete_users(users, workers):
+    registered = [user for user in users if user.secret]
+    failures = run_parallel(VirtualUser.delete_account, registered, workers, stop_on_error=False)
+    for error in failures:
+        print(f"WARNING: {error}")
+    print(f"Deleted {len(registered) - len(failures)} of {len(registered)} synthetic users")
+
+# UTILITY: Call func(item) for every item on `workers` threads
+# Re-raises the first failure, or with stop_on_error=False runs everything and returns the failures.
+def run_parallel(func, items, workers, stop_on_error=True):
+    pending = queue.Queue()
+    for item in items:
+        pending.put(item)
+    failures = []
+
+    def worker():
+        while not (failures and stop_on_error):
+            try:
+                item = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                func(item)
+            except Exception as e:
+                failures.append(e)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(min(workers, len(items)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if failures and stop_on_error:
+        raise failures[0]
+    return failures
+
+# 2. OPERATIONS
+# Each returns (endpoint, response, expected status)
+def op_login(user, unlock_session):
+    return 'POST /api/login', user.login(), 200
+
+def op_check_session(user, unlock_session):
+    return 'GET /api/check_session', user.request('GET', '/api/check_session'), 200
+
+def op_list(user, unlock_session):
+    resp = user.request('GET', '/api/list_entries', params={"limit": LIST_LIMIT})
+    if resp.status_code == 200:
+        user.entry_ids = [entry['id'] for entry in resp.json()['entries']]
+    return 'GET /api/list_entries', resp, 200
+
+def op_get_passwords(user, unlock_session):
+    return 'POST /api/get_passwords', user.vault_request('POST', '/api/get_passwords', {}, unlock_session), 200
+
+def op_add(user, unlock_session):
+    resp = user.vault_request('POST', '/api/add_password', {
+        "site_name": f"site-{secrets.token_hex(4)}.example",
+        "site_username": f"{user.username}@example.com",
+        "site_password": secrets.token_urlsafe(12)
+    }, unlock_session)
+    return 'POST /api/add_password', resp, 201
+
+# Update/delete need an entry id; a user whose vault is empty adds one instead
+def op_update(user, unlock_session):
+    if not user.entry_ids:
+        return op_add(user, unlock_session)
+    resp = user.vault_request('PUT', '/api/update_password', {
+        "id": random.choice(user.entry_ids),
+        "site_name": f"site-{secrets.token_hex(4)}.example",
+        "site_username": f"{user.username}@example.com",
+        "site_password": secrets.token_urlsafe(12)
+    }, unlock_session)
+    return 'PUT /api/update_password', resp, 200
+
+def op_delete(user, unlock_session):
+    if not user.entry_ids:
+        return op_add(user, unlock_session)
+    entry_id = user.entry_ids.pop(random.randrange(len(user.entry_ids)))
+    return 'DELETE /api/delete_password', user.request('DELETE', '/api/delete_password', json={"id": entry_id}), 200
+
+OPERATIONS = {
+    'login': op_login,
+    'check_session': op_check_session,
+    'list': op_list,
+    'get_passwords': op_get_passwords,
+    'add': op_add,
+    'update': op_update,
+    'delete': op_delete,
+}
+
+# "list=40,add=10" -> ([op functions], [weights])
+def parse_mix(text):
+    names, weights = [], []
+    for part in text.split(','):
+        name, _, weight = part.strip().partition('=')
+        if name not in OPERATIONS:
+            raise LoadError(f"Unknown operation '{name}' (choose from {', '.join(OPERATIONS)})")
+        try:
+            weight = float(weight)
+        except ValueError:
+            raise LoadError(f"Operation '{name}' needs a weight, e.g. {name}=10")
+        if weight > 0:
+            names.append(name)
+            weights.append(weight)
+    if not names:
+        raise LoadError("The mix is empty")
+    return [OPERATIONS[name] for name in names], weights
+
+# 3. RUN
+def run_load(users, mix, concurrency, duration, rate, unlock_session):
+    operations, weights = mix
+    recorder = Recorder()
+    pacer = Pacer(rate)
+    idle_users = queue.Queue()
+    for user in users:
+        idle_users.put(user)
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        rng = random.Random()
+        while True:
+            started = pacer.wait()
+            if started >= deadline:
+                return
+            user = idle_users.get() # A user runs one request at a time, like one browser tab
+            operation = rng.choices(operations, weights)[0]
+            try:
+                endpoint, resp, expected = operation(user, unlock_session)
+                ms = (time.perf_counter() - started) * 1000
+                recorder.add(endpoint, ms, resp.status_code, resp.status_code == expected)
+            except requests.RequestException as e:
+                ms = (time.perf_counter() - started) * 1000
+                recorder.add(f"{operation.__name__[3:]} (no response)", ms, type(e).__name__, False)
+            finally:
+                idle_users.put(user)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, time.perf_counter() - started
+
+def print_report(results, elapsed):
+    total = sum(row['requests'] for row in results.values())
+    errors = sum(row['errors'] for row in results.values())
+    print(f"\n{total} requests in {elapsed:.1f} s = {total / elapsed:.1f} req/s, {errors} errors\n")
+    print(f"  {'endpoint':<30}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for endpoint, row in results.items():
+        print(f"  {endpoint:<30}{row['requests']:>9}{row['errors']:>8}{row['rps']:>9.1f}"
+              f"{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['max_ms']:>9.1f}")
+    for endpoint, row in results.items():
+        unexpected = {status: n for status, n in row['statuses'].items() if not status.startswith('2')}
+        if unexpected:
+            print(f"  {endpoint}: {unexpected}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test a running Password Vault server")
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help="server base URL")
+    parser.add_argument('--users', type=int, help="synthetic users (default: --concurrency)")
+    parser.add_argument('--concurrency', type=int, default=10, help="requests in flight at once")
+    parser.add_argument('--duration', type=float, default=30, help="seconds to run")
+    parser.add_argument('--rate', type=float, help="total requests per second (default: as fast as possible)")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"operation weights (default: {DEFAULT_MIX}; also get_passwords)")
+    parser.add_argument('--entries', type=int, default=ENTRIES_PER_USER, help="entries seeded into each vault")
+    parser.add_argument('--no-unlock-session', action='store_true',
+                        help="send the master password on every vault call (one KDF run each)")
+    parser.add_argument('--keep-users', action='store_true', help="do not delete the synthetic users afterwards")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    users_count = args.users or args.concurrency
+    if args.concurrency < 1 or users_count < 1 or args.duration <= 0 or (args.rate is not None and args.rate <= 0):
+        sys.exit("ERROR: --users, --concurrency, --duration and --rate must be positive")
+    if users_count < args.concurrency:
+        print(f"NOTE: only {users_count} users, so at most {users_count} requests run at once")
+
+    try:
+        mix = parse_mix(args.mix)
+    except LoadError as e:
+        sys.exit(f"ERROR: {e}")
+
+    base_url = args.url.rstrip('/')
+    users = new_users(base_url, users_count)
+    try:
+        print(f"Provisioning {users_count} users with {args.entries} entries each...")
+        provision_started = time.perf_counter()
+        provision_users(users, args.entries, args.concurrency)
+        print(f"  ...done in {time.perf_counter() - provision_started:.1f} s")
+
+        print(f"Running for {args.duration:g} s at concurrency {args.concurrency}"
+              + (f", {args.rate:g} req/s" if args.rate else "") + "...")
+        recorder, elapsed = run_load(users, mix, args.concurrency, args.duration, args.rate, not args.no_unlock_session)
+        results = recorder.summary(elapsed)
+        print_report(results, elapsed)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({"url": base_url, "users": users_count, "concurrency": args.concurrency,
+                           "duration": args.duration, "rate": args.rate, "mix": args.mix,
+                           "elapsed": round(elapsed, 3), "endpoints": results}, f, indent=2)
+            print(f"\nResults written to {args.json}")
+    except LoadError as e:
+        print(f"ERROR: {e}")
+    except requests.ConnectionError:
+        print(f"ERROR: Could not connect to {args.url}. Is the server running?")
+    finally:
+        if args.keep_users:
+            print(f"Kept users {users[0].username} .. {users[-1].username}")
+        else:
+            delete_users(users, args.concurrency)
@@ -1,5 +1,4 @@
-import qrcode
-import pyotp
+import totp_qr
 
 def make_qr():
     print("--- 2FA QR GENERATOR ---")
@@ -10,24 +9,15 @@ def make_qr():
     
     # 2. Create the Provisioning URI
     # This creates the link: otpauth://totp/PasswordVault:admin?secret=...
-    uri = pyotp.totp.TOTP(secret).provisioning_uri(
-        name=username, 
-        issuer_name='PasswordVault'
-    )
+    uri = totp_qr.provisioning_uri(username, secret, issuer='PasswordVault')
     
-    # 3. Create the QR Code Image
-    # We create a standard QR code object
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(uri)
-    qr.make(fit=True)
-    
-    # 4. Save it to a file
-    img = qr.make_image(fill='black', back_color='white')
-    filename = "2fa_qr.png"
-    img.save(filename)
+    # 3. Create the QR Code Image (same SVG renderer as the /api/2fa_qr endpoint)
+    filename = "2fa_qr.svg"
+    with open(filename, 'w') as f:
+        f.write(totp_qr.render_svg(uri))
     
     print(f"\nSUCCESS: '{filename}' has been created in your folder.")
-    print("Open this image file and scan it with your Authenticator App (Google/Authy/etc).")
+    print("Open this image file (in a browser) and scan it with your Authenticator App (Google/Authy/etc).")
 
 if __name__ == '__main__':
     make_qr()
\ No newline at end of file
@@ -0,0 +1,106 @@
+import contextvars
+import hmac
+import os
+import time
+from contextlib import contextmanager
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest, multiprocess
+
+# Request instrumentation.
+# Each request gets a RequestTimer; code on the hot path wraps its work in
+# `with metrics.phase('kdf'):` (or db_wait, db, crypto, json), and the totals end up in
+# the Server-Timing header and in the Prometheus histograms served at /metrics.
+#
+# Under gunicorn every worker writes its numbers to PROMETHEUS_MULTIPROC_DIR
+# (set in gunicorn_config.py) and /metrics adds them up, so any worker gives the full picture.
+
+# /metrics needs "Authorization: Bearer <METRICS_TOKEN>" and answers 404 while no token is set,
+# so a deployment never exposes its numbers by accident
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUEST_SECONDS = Histogram('vault_request_seconds', 'Request latency (until the last byte is sent)',
+                            ['route', 'method'], buckets=LATENCY_BUCKETS)
+PHASE_SECONDS = Histogram('vault_request_phase_seconds', 'Time spent per phase of a request',
+                          ['route', 'phase'], buckets=LATENCY_BUCKETS)
+REQUESTS = Counter('vault_requests_total', 'Requests by response status', ['route', 'method', 'status'])
+ERRORS = Counter('vault_errors_total', 'Server-side errors (5xx responses and failed streams)', ['route'])
+KDF_RUNS = Counter('vault_kdf_total', 'Key derivations by outcome', ['outcome'])
+RATE_LIMITED = Counter('vault_rate_limited_total', 'Requests turned away by the KDF rate limiter', ['scope'])
+DB_CHECKOUTS = Counter('vault_db_checkouts_total', 'Connections taken from the pool')
+DB_TIMEOUTS = Counter('vault_db_pool_timeouts_total', 'Requests that found no free connection in time')
+DB_IN_USE = Gauge('vault_db_connections_in_use', 'Connections currently checked out',
+                  multiprocess_mode='livesum')
+DB_REPLICA_READS = Counter('vault_db_replica_reads_total', 'Read-only checkouts by where they went',
+                           ['target']) # replica, primary (no replica configured/usable), recent_write
+DB_REPLICA_FAILURES = Counter('vault_db_replica_failures_total', 'Replicas taken out of rotation after a failed connect')
+
+_current = contextvars.ContextVar('vault_request_timer', default=None)
+
+class RequestTimer:
+    def __init__(self, route, method):
+        self.route = route
+        self.method = method
+        self.started = time.perf_counter()
+        self.phases = {}
+
+    def add(self, phase_name, seconds):
+        self.phases[phase_name] = self.phases.get(phase_name, 0.0) + seconds
+
+    def server_timing(self):
+        # e.g. "kdf;dur=312.4, db;dur=2.1, total;dur=318.0"
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.phases.items()]
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ', '.join(parts)
+
+    def finish(self, status):
+        REQUEST_SECONDS.labels(self.route, self.method).observe(time.perf_counter() - self.started)
+        REQUESTS.labels(self.route, self.method, str(status)).inc()
+        if status >= 500:
+            ERRORS.labels(self.route).inc()
+        for name, seconds in self.phases.items():
+            PHASE_SECONDS.labels(self.route, name).observe(seconds)
+
+def start_request(route, method):
+    timer = RequestTimer(route, method)
+    _current.set(timer)
+    return timer
+
+def current():
+    return _current.get()
+
+@contextmanager
+def phase(name):
+    # No-op outside a request (scripts, worker threads without a timer)
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - started)
+
+def count_error():
+    # For failures the status code cannot show (e.g. a stream that broke after a 200)
+    timer = _current.get()
+    ERRORS.labels(timer.route if timer else 'none').inc()
+
+def render():
+    # Returns (body, content type) for the /metrics endpoint
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+def enabled():
+    return bool(METRICS_TOKEN)
+
+def authorized(auth_header):
+    if not METRICS_TOKEN:
+        return False
+    return hmac.compare_digest((auth_header or '').encode(), f"Bearer {METRICS_TOKEN}".encode())
@@ -0,0 +1,95 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import metrics
+
+# Token-bucket limiter for everything that runs the (deliberately slow) KDF.
+# Buckets live in a small SQLite file, so all gunicorn workers on the host
+# share them without an external service. Each key (client IP, username or
+# account) holds up to <limit> tokens, refilling at <limit> per RATE_LIMIT_WINDOW
+# seconds; a KDF run costs one token from every key involved.
+# Requests that are turned away do not use up tokens.
+
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT', '1') == '1'
+RATE_LIMIT_DB = os.environ.get('RATE_LIMIT_DB', os.path.join(tempfile.gettempdir(), 'password-vault-ratelimit.db'))
+RATE_LIMIT_WINDOW = float(os.environ.get('RATE_LIMIT_WINDOW', 60))
+RATE_LIMIT_PER_IP = int(os.environ.get('RATE_LIMIT_PER_IP', 30))
+RATE_LIMIT_PER_USER = int(os.environ.get('RATE_LIMIT_PER_USER', 20)) # Per username (login) and per account
+
+CLEANUP_CHANCE = 0.01 # Share of calls that also delete idle (full) buckets
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Rate limited, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+_local = threading.local()
+
+# UTILITY: One SQLite connection per thread (and per process, in case of a fork)
+def _connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        conn = sqlite3.connect(RATE_LIMIT_DB, timeout=1, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=OFF') # Losing buckets in a power cut is fine
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL
+            )
+        ''')
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+# Takes a token from every bucket, or from none of them.
+# `limits` is a list of (key, scope, limit), e.g. ('ip:1.2.3.4', 'ip', 30).
+# Raises RateLimited with the seconds until the emptiest bucket has a token again.
+def hit(limits):
+    if not RATE_LIMIT_ENABLED or not limits:
+        return
+
+    try:
+        conn = _connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            refilled = []
+            for key, scope, limit in limits:
+                rate = limit / RATE_LIMIT_WINDOW
+                row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+                tokens = limit if row is None else min(limit, row[0] + (now - row[1]) * rate)
+                if tokens < 1:
+                    conn.execute('ROLLBACK')
+                    metrics.RATE_LIMITED.labels(scope).inc()
+                    raise RateLimited(max(1, round((1 - tokens) / rate)))
+                refilled.append((key, tokens - 1))
+
+            conn.executemany('''
+                INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated
+            ''', [(key, tokens, now) for key, tokens in refilled])
+
+            if random.random() < CLEANUP_CHANCE:
+                # Untouched for a whole window = full again, same as having no row
+                conn.execute('DELETE FROM buckets WHERE updated < ?', (now - RATE_LIMIT_WINDOW,))
+            conn.execute('COMMIT')
+        except sqlite3.Error:
+            conn.execute('ROLLBACK')
+            raise
+    except sqlite3.Error as e:
+        # Fail open: a broken limiter must not lock everybody out
+        print(f"Rate Limit Error: {e}") # Log internally
+
+def ip_limit(address):
+    return (f"ip:{address}", 'ip', RATE_LIMIT_PER_IP)
+
+def username_limit(username):
+    return (f"user:{username.lower()}", 'user', RATE_LIMIT_PER_USER)
+
+def account_limit(user_id):
+    return (f"account:{user_id}", 'user', RATE_LIMIT_PER_USER)
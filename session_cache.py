@@ -0,0 +1,49 @@
+import hashlib
+import os
+from cryptography.fernet import Fernet, InvalidToken
+from cache import TTLCache
+
+# "Unlocked session" mode: after one successful master password check the
+# vault key is kept in memory so later requests can skip the KDF.
+# The key is never stored in the clear: it is wrapped with a per-session
+# secret that only the browser holds (in an HttpOnly cookie).
+UNLOCK_ENABLED = os.environ.get('UNLOCK_SESSIONS', '0') == '1'
+UNLOCK_TTL_SECONDS = int(os.environ.get('UNLOCK_TTL_SECONDS', 300)) # Matches the 5-minute inactivity logout in app.js
+UNLOCK_MAX_SESSIONS = int(os.environ.get('UNLOCK_MAX_SESSIONS', 1000))
+
+_sessions = TTLCache(UNLOCK_MAX_SESSIONS, UNLOCK_TTL_SECONDS)
+
+def _session_id(token):
+    # Key the cache by a hash so the raw JWT is not kept around
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def store_key(token, encryption_key, wrap_secret=None):
+    # Reuse the browser's existing wrap secret so every worker agrees on it
+    if wrap_secret:
+        try:
+            wrapper = Fernet(wrap_secret)
+        except ValueError:
+            wrap_secret = None
+    if not wrap_secret:
+        wrap_secret = Fernet.generate_key().decode()
+        wrapper = Fernet(wrap_secret)
+
+    _sessions.set(_session_id(token), wrapper.encrypt(encryption_key))
+    return wrap_secret
+
+def load_key(token, wrap_secret):
+    if not UNLOCK_ENABLED or not token or not wrap_secret:
+        return None
+
+    wrapped = _sessions.get(_session_id(token))
+    if wrapped is None:
+        return None
+
+    try:
+        return Fernet(wrap_secret).decrypt(wrapped)
+    except (InvalidToken, ValueError):
+        return None
+
+def clear(token):
+    if token:
+        _sessions.pop(_session_id(token))
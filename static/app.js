@@ -13,6 +13,11 @@ window.onload = async function() {
     document.onclick = resetTimer;
     document.onscroll = resetTimer;
     document.ontouchstart = resetTimer; 
+
+    // Offline shell: on repeat visits the page, styles and script come from the service worker's cache
+    if ('serviceWorker' in navigator) {
+        navigator.serviceWorker.register('/sw.js').catch(e => console.log("Service worker unavailable", e));
+    }
     
     const bannedChars = /[\s\\^~"'\[\]{};|]/;
 
@@ -53,6 +58,7 @@ window.onload = async function() {
             } else {
                 sessionStorage.removeItem('masterKey');
                 sessionStorage.removeItem('currentUser');
+                sessionStorage.removeItem('vaultUnlocked');
             }
         } catch(e) { console.log("Server unreachable"); }
     }
@@ -113,23 +119,26 @@ function closeConfirm() {
 }
 
 /* --- FILTER LOGIC --- */
+// Searching happens on the server (indexed), so it works without loading the whole vault.
+let searchTimer;
+
 function filterPasswords() {
-    const searchInput = document.getElementById('search-filter');
-    const filter = searchInput.value.toLowerCase();
-    const list = document.getElementById('password-list');
-    const items = list.getElementsByClassName('vault-item');
-
-    for (let i = 0; i < items.length; i++) {
-        const siteElement = items[i].getElementsByClassName('vault-site')[0];
-        if (siteElement) {
-            const txtValue = siteElement.textContent || siteElement.innerText;
-            if (txtValue.toLowerCase().startsWith(filter)) {
-                items[i].classList.remove('hidden');
-            } else {
-                items[i].classList.add('hidden');
-            }
-        }
-    }
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(() => loadPasswords(), 200);
+}
+
+async function searchPasswords(query) {
+    const response = await fetch(`/api/search?q=${encodeURIComponent(query)}&limit=${SEARCH_LIMIT}`);
+    if (response.status === 401) return logout();
+    if (!response.ok) return;
+
+    const result = await response.json();
+    // Ignore stale answers if the user kept typing
+    if (document.getElementById('search-filter').value.trim() !== query) return;
+
+    const listDiv = document.getElementById('password-list');
+    listDiv.innerHTML = "";
+    result.results.forEach(p => listDiv.appendChild(renderPasswordItem(p)));
 }
 
 /* --- TIMEOUT LOGIC --- */
@@ -217,6 +226,7 @@ async function logout() {
     await fetch('/api/logout', { method: 'POST' });
     sessionStorage.removeItem('masterKey');
     sessionStorage.removeItem('currentUser');
+    sessionStorage.removeItem('vaultUnlocked');
     location.reload();
 }
 
@@ -273,9 +283,9 @@ async function registerUser() {
             document.getElementById('register-section').classList.add('hidden');
             document.getElementById('setup-2fa-section').classList.remove('hidden');
             
-            document.getElementById('qr-image').src = "data:image/png;base64," + result.qr_code;
             document.getElementById('secret-code-display').innerText = result.secret;
             document.getElementById('otp-link').href = result.totp_uri;
+            loadQrCode(result.qr_token);
             
         } else {
             document.getElementById('reg-error').innerText = result.error;
@@ -289,6 +299,23 @@ async function registerUser() {
     }
 }
 
+// The QR code is fetched separately so registration stays fast; the secret is shown either way
+async function loadQrCode(qrToken) {
+    const img = document.getElementById('qr-image');
+    try {
+        const response = await fetch('/api/2fa_qr', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({ qr_token: qrToken })
+        });
+        if (!response.ok) return;
+        if (img.src.startsWith('blob:')) URL.revokeObjectURL(img.src);
+        img.src = URL.createObjectURL(await response.blob());
+    } catch(e) {
+        console.log("QR code unavailable", e);
+    }
+}
+
 function finishRegistration() {
     const newUser = document.getElementById('reg-user').value.trim();
 
@@ -357,6 +384,7 @@ async function updateAccount() {
             const result = await response.json();
 
             if (response.ok) {
+                clearSnapshot();
                 openAlert("Account Updated! Please log in with your new credentials.", "Success", logout);
             } else {
                 openAlert("Error: " + result.error, "Error");
@@ -371,6 +399,73 @@ async function updateAccount() {
     });
 }
 
+async function importPasswords() {
+    const fileInput = document.getElementById('import-file');
+    const status = document.getElementById('import-status');
+    if (!fileInput.files.length) return openAlert("Choose a CSV or backup file first.", "Error");
+
+    const form = new FormData();
+    form.append('file', fileInput.files[0]);
+    form.append('master_password', sessionStorage.getItem('masterKey'));
+    status.innerText = "Uploading...";
+
+    try {
+        const response = await fetch('/api/import', { method: 'POST', body: form });
+        if (!response.ok) {
+            const result = await response.json();
+            status.innerText = "";
+            return openAlert("Import Failed: " + (result.error || "Unknown error"), "Error");
+        }
+
+        // The server streams one progress object per line
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            lines.filter(line => line.trim()).forEach(line => {
+                const progress = JSON.parse(line);
+                if (progress.error) status.innerText = `${progress.error} (${progress.imported} imported)`;
+                else if (progress.done) status.innerText = `Done: ${progress.imported} imported, ${progress.skipped} skipped.`;
+                else if (progress.imported !== undefined) status.innerText = `Imported ${progress.imported}...`;
+            });
+        }
+        fileInput.value = "";
+        loadPasswords(sessionStorage.getItem('masterKey'));
+    } catch (e) {
+        status.innerText = "";
+        openAlert("Server Error", "Error");
+    }
+}
+
+// Downloads stream straight to disk: a plain form post into a hidden frame,
+// so the browser's own download manager handles the file.
+function exportVault(format) {
+    const submit = () => {
+        const form = document.createElement('form');
+        form.method = 'POST';
+        form.action = '/api/export';
+        form.target = 'export-frame';
+        [['format', format], ['master_password', sessionStorage.getItem('masterKey')]].forEach(([name, value]) => {
+            const input = document.createElement('input');
+            input.type = 'hidden';
+            input.name = name;
+            input.value = value;
+            form.appendChild(input);
+        });
+        document.body.appendChild(form);
+        form.submit();
+        form.remove();
+    };
+
+    if (format === 'csv') openConfirm("The CSV file will contain all your passwords in plain text. Continue?", submit);
+    else submit();
+}
+
 async function deleteAccount() {
     openConfirm("⚠️ DANGER: This will permanently delete your account and ALL saved passwords. This cannot be undone.", () => {
         // Use custom Prompt Modal instead of native prompt()
@@ -385,6 +480,7 @@ async function deleteAccount() {
                 });
 
                 if (response.ok) {
+                    clearSnapshot();
                     openAlert("Account Deleted.", "Goodbye", logout);
                 } else {
                     const result = await response.json();
@@ -398,6 +494,29 @@ async function deleteAccount() {
 }
 
 /* --- API CALLS --- */
+
+// Vault calls skip the master password once the server has unlocked this session.
+// If the server has no key for us (expired, or another worker), retry with the password.
+async function vaultFetch(url, method, payload) {
+    const send = (body) => fetch(url, {
+        method: method,
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify(body)
+    });
+
+    let response;
+    if (sessionStorage.getItem('vaultUnlocked')) {
+        response = await send(payload);
+        if (response.status !== 401) return response;
+        sessionStorage.removeItem('vaultUnlocked');
+    }
+
+    const masterKey = sessionStorage.getItem('masterKey');
+    response = await send({ ...payload, master_password: masterKey, unlock_session: true });
+    if (response.headers.get('X-Vault-Unlocked')) sessionStorage.setItem('vaultUnlocked', '1');
+    return response;
+}
+
 async function attemptLogin() {
     const user = document.getElementById('login-user').value.trim();
     const pass = document.getElementById('login-pass').value.trim();
@@ -425,75 +544,215 @@ async function attemptLogin() {
     } finally { btn.innerText = "Unlock Vault"; }
 }
 
+const PAGE_SIZE = 500; // Server maximum per page
+const SEARCH_LIMIT = 50;
+
 async function loadPasswords(masterKey) {
-    const response = await fetch('/api/get_passwords', {
-        method: 'POST',
-        headers: {'Content-Type': 'application/json'},
-        body: JSON.stringify({ master_password: masterKey })
-    });
-    
-    if (response.status === 401) return logout();
+    // Keep showing search results while a search is active
+    const query = document.getElementById('search-filter').value.trim();
+    if (query) return searchPasswords(query);
+
+    // Only metadata here: no key, no decryption. Passwords are revealed one at a time on demand.
+    // With a local snapshot, show it straight away and only fetch what changed since.
+    const snapshot = await loadSnapshot();
+    if (snapshot) {
+        renderEntries(snapshot.entries);
+        const response = await fetch(`/api/vault_changes?since=${snapshot.version}`, {
+            headers: {'If-None-Match': `"v${snapshot.version}"`},
+            cache: 'no-store'
+        });
+        if (response.status === 304) return;
+        if (response.status === 401) return logout();
+        if (response.ok) {
+            const delta = await response.json();
+            if (!delta.reset) {
+                delta.deleted.forEach(id => delete snapshot.entries[id]);
+                delta.changed.forEach(p => snapshot.entries[p.id] = p);
+                snapshot.version = delta.version;
+                renderEntries(snapshot.entries);
+                return saveSnapshot(snapshot);
+            }
+        }
+    }
 
-    const passwords = await response.json();
     const listDiv = document.getElementById('password-list');
-    listDiv.innerHTML = ""; 
+    const fresh = { version: null, entries: {} };
+    let cursor = null;
+
+    do {
+        const query = `limit=${PAGE_SIZE}` + (cursor ? `&cursor=${cursor}` : "");
+        const response = await fetch(`/api/list_entries?${query}`, { cache: 'no-store' });
+        if (response.status === 401) return logout();
+        if (!response.ok) return;
+
+        const page = await response.json();
+        if (fresh.version === null) {
+            listDiv.innerHTML = "";
+            fresh.version = page.version; // From the first page: later changes come in the next delta
+        }
+        page.entries.forEach(p => {
+            fresh.entries[p.id] = p;
+            listDiv.appendChild(renderPasswordItem(p));
+        });
+        cursor = page.next_cursor;
+    } while (cursor);
 
-    passwords.forEach(p => {
-        const item = document.createElement('div');
-        item.className = 'vault-item';
-        item.id = `row-${p.id}`;
-        
-        item.innerHTML = `
-            <div id="display-${p.id}" style="display:flex; justify-content:space-between; width:100%; align-items:center;">
-                <div class="vault-info">
-                    <span class="vault-site">${p.site}</span>
-                    <span class="vault-user">${p.username}</span>
-                </div>
-                <div class="vault-actions">
-                    <button class="btn-icon" onclick="copyToClipboard('${p.password}')" title="Copy">
-                        <svg width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2" stroke-linecap="round" stroke-linejoin="round"><rect x="9" y="9" width="13" height="13" rx="2" ry="2"></rect><path d="M5 15H4a2 2 0 0 1-2-2V4a2 2 0 0 1 2-2h9a2 2 0 0 1 2 2v1"></path></svg>
-                    </button>
-                    <button class="btn-icon" onclick="toggleEdit(${p.id})" title="Edit" style="color: var(--primary);">
-                        <svg width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2" stroke-linecap="round" stroke-linejoin="round"><path d="M11 4H4a2 2 0 0 0-2 2v14a2 2 0 0 0 2 2h14a2 2 0 0 0 2-2v-7"></path><path d="M18.5 2.5a2.121 2.121 0 0 1 3 3L12 15l-4 1 1-4 9.5-9.5z"></path></svg>
-                    </button>
-                    <button class="btn-icon" onclick="deletePassword(${p.id})" title="Delete" style="color: var(--danger);">
-                        <svg width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2" stroke-linecap="round" stroke-linejoin="round"><polyline points="3 6 5 6 21 6"></polyline><path d="M19 6v14a2 2 0 0 1-2 2H7a2 2 0 0 1-2-2V6m3 0V4a2 2 0 0 1 2-2h4a2 2 0 0 1 2 2v2"></path></svg>
-                    </button>
-                </div>
-            </div>
+    await saveSnapshot(fresh);
+}
 
-            <div id="edit-${p.id}" class="edit-mode-inputs hidden">
-                <input type="text" id="edit-site-${p.id}" value="${p.site}">
-                <input type="text" id="edit-user-${p.id}" value="${p.username}">
-                <div class="password-wrapper">
-                    <input type="password" id="edit-pass-${p.id}" value="${p.password}">
-                    <button class="btn-eye" onclick="togglePassword('edit-pass-${p.id}', this)" type="button">
-                        <svg width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2" stroke-linecap="round" stroke-linejoin="round"><path d="M1 12s4-8 11-8 11 8 11 8-4 8-11 8-11-8-11-8z"></path><circle cx="12" cy="12" r="3"></circle></svg>
-                    </button>
-                </div>
-                <div style="display:flex; gap:10px; margin-top:5px;">
-                    <button class="btn btn-primary" onclick="saveEdit(${p.id})" style="padding: 5px;">Save</button>
-                    <button class="btn btn-danger" onclick="toggleEdit(${p.id})" style="padding: 5px; color: var(--text-main);">Cancel</button>
-                </div>
-            </div>
-        `;
-        listDiv.appendChild(item);
-    });
+function renderEntries(entries) {
+    const listDiv = document.getElementById('password-list');
+    listDiv.innerHTML = "";
+    Object.values(entries)
+        .sort((a, b) => a.id - b.id)
+        .forEach(p => listDiv.appendChild(renderPasswordItem(p)));
+}
+
+/* --- LOCAL SNAPSHOT --- */
+
+// The entry list (ids, sites, usernames; never passwords) is kept in localStorage,
+// encrypted with AES-GCM under a key derived from the master password, together with
+// the vault version it reflects. Reopening the vault then costs one small delta request.
+const SNAPSHOT_ITERATIONS = 210000;
+let snapshotKeyCache = null; // { salt, masterKey, key }: derive once per page load
+
+function snapshotStorageKey() {
+    return 'vaultSnapshot:' + (sessionStorage.getItem('currentUser') || '');
+}
+
+function clearSnapshot() {
+    localStorage.removeItem(snapshotStorageKey());
+    snapshotKeyCache = null;
+}
+
+function bytesToBase64(bytes) {
+    let binary = "";
+    bytes.forEach(b => binary += String.fromCharCode(b));
+    return btoa(binary);
+}
+
+function base64ToBytes(text) {
+    return Uint8Array.from(atob(text), c => c.charCodeAt(0));
+}
+
+async function snapshotKey(salt) {
+    const masterKey = sessionStorage.getItem('masterKey');
+    if (!masterKey || !window.crypto || !crypto.subtle) return null;
+    if (snapshotKeyCache && snapshotKeyCache.salt === salt && snapshotKeyCache.masterKey === masterKey) {
+        return snapshotKeyCache.key;
+    }
+
+    const material = await crypto.subtle.importKey('raw', new TextEncoder().encode(masterKey), 'PBKDF2', false, ['deriveKey']);
+    const key = await crypto.subtle.deriveKey(
+        { name: 'PBKDF2', hash: 'SHA-256', salt: base64ToBytes(salt), iterations: SNAPSHOT_ITERATIONS },
+        material, { name: 'AES-GCM', length: 256 }, false, ['encrypt', 'decrypt']
+    );
+    snapshotKeyCache = { salt: salt, masterKey: masterKey, key: key };
+    return key;
+}
+
+async function loadSnapshot() {
+    const stored = localStorage.getItem(snapshotStorageKey());
+    if (!stored) return null;
+    try {
+        const box = JSON.parse(stored);
+        const key = await snapshotKey(box.salt);
+        if (!key) return null;
+        const plain = await crypto.subtle.decrypt({ name: 'AES-GCM', iv: base64ToBytes(box.iv) }, key, base64ToBytes(box.data));
+        return JSON.parse(new TextDecoder().decode(plain));
+    } catch (e) {
+        // Damaged, or from an old master password: start over with a full load
+        clearSnapshot();
+        return null;
+    }
+}
+
+async function saveSnapshot(snapshot) {
+    if (snapshot.version === null || snapshot.version === undefined) return;
+    try {
+        const salt = snapshotKeyCache ? snapshotKeyCache.salt : bytesToBase64(crypto.getRandomValues(new Uint8Array(16)));
+        const key = await snapshotKey(salt);
+        if (!key) return;
+        const iv = crypto.getRandomValues(new Uint8Array(12));
+        const data = await crypto.subtle.encrypt({ name: 'AES-GCM', iv: iv }, key, new TextEncoder().encode(JSON.stringify(snapshot)));
+        localStorage.setItem(snapshotStorageKey(), JSON.stringify({
+            salt: salt, iv: bytesToBase64(iv), data: bytesToBase64(new Uint8Array(data))
+        }));
+    } catch (e) {
+        // Storage full or unavailable: the vault still works, just without the shortcut
+        console.log("Could not save vault snapshot", e);
+    }
+}
+
+async function revealPassword(id) {
+    const response = await vaultFetch('/api/reveal_password', 'POST', { id: id });
+    if (response.status === 401) { logout(); return null; }
+    if (!response.ok) return null;
+    const result = await response.json();
+    return result.password;
+}
+
+async function copyEntryPassword(id) {
+    const password = await revealPassword(id);
+    if (password !== null) copyToClipboard(password);
+}
+
+function renderPasswordItem(p) {
+    const item = document.createElement('div');
+    item.className = 'vault-item';
+    item.id = `row-${p.id}`;
     
-    // Re-apply filter after loading
-    filterPasswords();
+    item.innerHTML = `
+        <div id="display-${p.id}" style="display:flex; justify-content:space-between; width:100%; align-items:center;">
+            <div class="vault-info">
+                <span class="vault-site">${p.site}</span>
+                <span class="vault-user">${p.username}</span>
+            </div>
+            <div class="vault-actions">
+                <button class="btn-icon" onclick="copyEntryPassword(${p.id})" title="Copy">
+                    <svg width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2" stroke-linecap="round" stroke-linejoin="round"><rect x="9" y="9" width="13" height="13" rx="2" ry="2"></rect><path d="M5 15H4a2 2 0 0 1-2-2V4a2 2 0 0 1 2-2h9a2 2 0 0 1 2 2v1"></path></svg>
+                </button>
+                <button class="btn-icon" onclick="toggleEdit(${p.id})" title="Edit" style="color: var(--primary);">
+                    <svg width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2" stroke-linecap="round" stroke-linejoin="round"><path d="M11 4H4a2 2 0 0 0-2 2v14a2 2 0 0 0 2 2h14a2 2 0 0 0 2-2v-7"></path><path d="M18.5 2.5a2.121 2.121 0 0 1 3 3L12 15l-4 1 1-4 9.5-9.5z"></path></svg>
+                </button>
+                <button class="btn-icon" onclick="deletePassword(${p.id})" title="Delete" style="color: var(--danger);">
+                    <svg width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2" stroke-linecap="round" stroke-linejoin="round"><polyline points="3 6 5 6 21 6"></polyline><path d="M19 6v14a2 2 0 0 1-2 2H7a2 2 0 0 1-2-2V6m3 0V4a2 2 0 0 1 2-2h4a2 2 0 0 1 2 2v2"></path></svg>
+                </button>
+            </div>
+        </div>
+
+        <div id="edit-${p.id}" class="edit-mode-inputs hidden">
+            <input type="text" id="edit-site-${p.id}" value="${p.site}">
+            <input type="text" id="edit-user-${p.id}" value="${p.username}">
+            <div class="password-wrapper">
+                <input type="password" id="edit-pass-${p.id}" value="">
+                <button class="btn-eye" onclick="togglePassword('edit-pass-${p.id}', this)" type="button">
+                    <svg width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2" stroke-linecap="round" stroke-linejoin="round"><path d="M1 12s4-8 11-8 11 8 11 8-4 8-11 8-11-8-11-8z"></path><circle cx="12" cy="12" r="3"></circle></svg>
+                </button>
+            </div>
+            <div style="display:flex; gap:10px; margin-top:5px;">
+                <button class="btn btn-primary" onclick="saveEdit(${p.id})" style="padding: 5px;">Save</button>
+                <button class="btn btn-danger" onclick="toggleEdit(${p.id})" style="padding: 5px; color: var(--text-main);">Cancel</button>
+            </div>
+        </div>
+    `;
+    return item;
 }
 
-function toggleEdit(id) {
+async function toggleEdit(id) {
     const displayRow = document.getElementById(`display-${id}`);
     const editRow = document.getElementById(`edit-${id}`);
+    const passInput = document.getElementById(`edit-pass-${id}`);
     
     if (displayRow.classList.contains('hidden')) {
         displayRow.classList.remove('hidden');
         editRow.classList.add('hidden');
+        passInput.value = ""; // Don't leave plaintext in the page
     } else {
         displayRow.classList.add('hidden');
         editRow.classList.remove('hidden');
+        const password = await revealPassword(id);
+        if (password !== null) passInput.value = password;
     }
 }
 
@@ -503,16 +762,13 @@ async function saveEdit(id) {
     const pass = document.getElementById(`edit-pass-${id}`).value;
     const masterKey = sessionStorage.getItem('masterKey');
 
-    const response = await fetch('/api/update_password', {
-        method: 'PUT',
-        headers: {'Content-Type': 'application/json'},
-        body: JSON.stringify({
-            id: id,
-            master_password: masterKey,
-            site_name: site,
-            site_username: user,
-            site_password: pass
-        })
+    if (!pass) return openAlert("Password is required", "Error");
+
+    const response = await vaultFetch('/api/update_password', 'PUT', {
+        id: id,
+        site_name: site,
+        site_username: user,
+        site_password: pass
     });
 
     if (response.ok) {
@@ -530,15 +786,10 @@ async function addPassword() {
 
     if(!site || !pass) return openAlert("Site and Password are required", "Error");
 
-    const response = await fetch('/api/add_password', {
-        method: 'POST',
-        headers: {'Content-Type': 'application/json'},
-        body: JSON.stringify({
-            master_password: masterKey,
-            site_name: site,
-            site_username: user,
-            site_password: pass
-        })
+    const response = await vaultFetch('/api/add_password', 'POST', {
+        site_name: site,
+        site_username: user,
+        site_password: pass
     });
 
     if (response.ok) {
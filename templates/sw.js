@@ -0,0 +1,37 @@
+// Service worker for the app shell, generated by /sw.js (see assets.py).
+// Shell files are served from the cache; API calls and everything else go to the network untouched.
+const CACHE_PREFIX = 'vault-shell-';
+const CACHE_NAME = CACHE_PREFIX + {{ version|tojson }};
+const SHELL = {{ shell|tojson }};
+
+self.addEventListener('install', event => {
+    event.waitUntil(
+        caches.open(CACHE_NAME)
+            .then(cache => cache.addAll(SHELL))
+            .then(() => self.skipWaiting())
+    );
+});
+
+// A new version drops the caches of older ones
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.keys()
+            .then(names => Promise.all(names
+                .filter(name => name.startsWith(CACHE_PREFIX) && name !== CACHE_NAME)
+                .map(name => caches.delete(name))))
+            .then(() => self.clients.claim())
+    );
+});
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    if (request.method !== 'GET') return;
+    const url = new URL(request.url);
+    if (url.origin !== self.location.origin || !SHELL.includes(url.pathname + url.search)) return;
+
+    event.respondWith(
+        caches.open(CACHE_NAME)
+            .then(cache => cache.match(request, { ignoreVary: true }))
+            .then(cached => cached || fetch(request))
+    );
+});
@@ -0,0 +1,131 @@
+import uuid
+import pytest
+import crypto_manager
+import db_pool
+import kdf
+import vault_keys
+
+# Data key rotation against DATABASE_URL (skipped without it, see conftest.py).
+# Each test creates a throwaway user with three entries on data key version 1 and deletes it afterwards.
+
+@pytest.fixture
+def conn(database):
+    conn = db_pool.get_connection()
+    yield conn
+    conn.close()
+
+# Returns (user_id, kek, keyring on version 1)
+@pytest.fixture
+def vault(conn):
+    keyring = vault_keys.new_keyring()
+    salt = crypto_manager.generate_salt()
+    master_secret = crypto_manager.derive_master_secret(uuid.uuid4().hex, salt, kdf.DEFAULT_PARAMS)
+    kek = crypto_manager.encryption_key_from_secret(master_secret)
+
+    cur = conn.cursor()
+    cur.execute('''
+        INSERT INTO users (username, password_hash, salt, two_factor_secret, kdf_params, data_key_version)
+        VALUES (%s, %s, %s, %s, %s, %s) RETURNING id
+    ''', (f"rotation-test-{uuid.uuid4().hex[:8]}", crypto_manager.auth_hash_from_secret(master_secret),
+          salt.hex(), 'NOTUSED', kdf.DEFAULT_PARAMS, keyring.current_version))
+    user_id = cur.fetchone()[0]
+    vault_keys.insert_keys(cur, user_id, kek, keyring)
+    for i in range(3):
+        cur.execute('''
+            INSERT INTO passwords (user_id, site_name, site_username, ciphertext, key_version)
+            VALUES (%s, %s, %s, %s, %s)
+        ''', (user_id, f"site{i}", "user", keyring.encrypt(f"password{i}"), keyring.current_version))
+    conn.commit()
+    try:
+        yield user_id, kek, keyring
+    finally:
+        conn.rollback()
+        cur.execute('DELETE FROM users WHERE id = %s', (user_id,))
+        conn.commit()
+        cur.close()
+
+def rotate(conn, user_id, kek, keyring):
+    keyring = keyring.rotated()
+    cur = conn.cursor()
+    cur.execute('UPDATE users SET data_key_version = %s WHERE id = %s', (keyring.current_version, user_id))
+    vault_keys.insert_keys(cur, user_id, kek, keyring, [keyring.current_version])
+    conn.commit()
+    cur.close()
+    return keyring
+
+# Damages the AES-GCM tag of the user's first entry
+def corrupt_first_entry(conn, user_id):
+    cur = conn.cursor()
+    cur.execute('''
+        UPDATE passwords SET ciphertext = overlay(ciphertext PLACING '\\xff'::bytea FROM length(ciphertext))
+        WHERE id = (SELECT min(id) FROM passwords WHERE user_id = %s)
+    ''', (user_id,))
+    conn.commit()
+    cur.close()
+
+def key_versions(conn, user_id):
+    cur = conn.cursor()
+    cur.execute('SELECT version FROM data_keys WHERE user_id = %s ORDER BY version', (user_id,))
+    versions = [row[0] for row in cur.fetchall()]
+    conn.commit()
+    cur.close()
+    return versions
+
+# (ciphertext, key_version, quarantined) per entry, in insert order
+def entries(conn, user_id):
+    cur = conn.cursor()
+    cur.execute('''
+        SELECT ciphertext, key_version, quarantined_at IS NOT NULL FROM passwords WHERE user_id = %s ORDER BY id
+    ''', (user_id,))
+    rows = [(bytes(ciphertext), key_version, quarantined) for ciphertext, key_version, quarantined in cur.fetchall()]
+    conn.commit()
+    cur.close()
+    return rows
+
+def test_rotation_moves_every_entry_and_drops_the_old_key(conn, vault):
+    user_id, kek, keyring = vault
+    keyring = rotate(conn, user_id, kek, keyring)
+
+    assert vault_keys.reencrypt_batch(conn, user_id, keyring) == 3
+    assert vault_keys.reencrypt_batch(conn, user_id, keyring) == 0
+
+    assert key_versions(conn, user_id) == [keyring.current_version]
+    rows = entries(conn, user_id)
+    assert [(key_version, quarantined) for _, key_version, quarantined in rows] == [(keyring.current_version, False)] * 3
+    assert [keyring.decrypt(ciphertext, key_version) for ciphertext, key_version, _ in rows] == ["password0", "password1", "password2"]
+
+def test_undecryptable_entry_survives_a_batch_and_keeps_its_key(conn, vault):
+    user_id, kek, keyring = vault
+    corrupt_first_entry(conn, user_id)
+    damaged = entries(conn, user_id)[0][0]
+    keyring = rotate(conn, user_id, kek, keyring)
+
+    # One batch covers all three entries: the good ones move, the damaged one is quarantined
+    assert vault_keys.reencrypt_batch(conn, user_id, keyring) == 3
+    rows = entries(conn, user_id)
+    assert [(key_version, quarantined) for _, key_version, quarantined in rows] == [
+        (vault_keys.FIRST_KEY_VERSION, True), (keyring.current_version, False), (keyring.current_version, False)]
+    assert rows[0][0] == damaged
+    assert [keyring.decrypt(ciphertext, key_version) for ciphertext, key_version, _ in rows[1:]] == ["password1", "password2"]
+
+    # Later batches skip it, and the only key that could read it is never deleted
+    assert vault_keys.reencrypt_batch(conn, user_id, keyring) == 0
+    assert key_versions(conn, user_id) == [vault_keys.FIRST_KEY_VERSION, keyring.current_version]
+    with pytest.raises(vault_keys.UNREADABLE_ENTRY_ERRORS):
+        keyring.decrypt(rows[0][0], rows[0][1])
+
+def test_quarantined_entry_does_not_hold_back_small_batches(conn, vault):
+    user_id, kek, keyring = vault
+    corrupt_first_entry(conn, user_id)
+    keyring = rotate(conn, user_id, kek, keyring)
+
+    # The damaged entry comes first; one entry per batch still gets through the rest
+    for _ in range(10):
+        if vault_keys.reencrypt_batch(conn, user_id, keyring, limit=1) == 0:
+            break
+    else:
+        pytest.fail("Re-encryption never finished")
+
+    assert [(key_version, quarantined) for _, key_version, quarantined in entries(conn, user_id)] == [
+        (vault_keys.FIRST_KEY_VERSION, True), (keyring.current_version, False), (keyring.current_version, False)]
+    assert key_versions(conn, user_id) == [vault_keys.FIRST_KEY_VERSION, keyring.current_version]
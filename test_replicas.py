@@ -0,0 +1,162 @@
+import datetime
+import os
+import time
+import uuid
+import jwt
+import psycopg2
+import pytest
+from prometheus_client import REGISTRY
+import app as vault_app
+import db_pool
+
+# Read routing against a real primary + streaming replica (see "Testing with a read replica"
+# in readme.md). Skipped unless DATABASE_URL and DATABASE_REPLICA_URLS are both set.
+pytestmark = pytest.mark.skipif(
+    not (os.environ.get('DATABASE_URL') and db_pool.replica_dsns()),
+    reason="needs DATABASE_URL and DATABASE_REPLICA_URLS")
+
+UNREACHABLE_REPLICA = 'postgresql://postgres@127.0.0.1:1/postgres'
+
+def reads(target):
+    return REGISTRY.get_sample_value('vault_db_replica_reads_total', {'target': target}) or 0.0
+
+def replica_failures():
+    return REGISTRY.get_sample_value('vault_db_replica_failures_total') or 0.0
+
+# Fresh replica set per test, so a replica marked down by one test does not affect the next
+@pytest.fixture
+def replicas(database, monkeypatch):
+    db_pool.get_pool()
+    replica_set = db_pool.ReplicaSet(db_pool.replica_dsns())
+    monkeypatch.setattr(db_pool, '_replicas', replica_set)
+    return replica_set
+
+@pytest.fixture
+def primary():
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    yield conn
+    conn.close()
+
+@pytest.fixture
+def replica():
+    conn = psycopg2.connect(db_pool.replica_dsns()[0])
+    conn.autocommit = True
+    yield conn
+    conn.close()
+
+# A user with two entries (metadata only, nothing here decrypts) and a logged-in test client
+@pytest.fixture
+def vault(replicas, primary):
+    cur = primary.cursor()
+    cur.execute('''
+        INSERT INTO users (username, password_hash, salt, two_factor_secret)
+        VALUES (%s, 'unused', '00', 'unused') RETURNING id
+    ''', (f"replica-test-{uuid.uuid4().hex[:8]}",))
+    user_id = cur.fetchone()[0]
+    cur.execute('''
+        INSERT INTO passwords (user_id, site_name, site_username, ciphertext)
+        VALUES (%s, 'one', 'u', '\\x00'), (%s, 'two', 'u', '\\x00') RETURNING id
+    ''', (user_id, user_id))
+    entry_ids = [row[0] for row in cur.fetchall()]
+
+    app = vault_app.create_app({'TESTING': True, 'SECRET_KEY': os.environ.get('SECRET_KEY') or uuid.uuid4().hex})
+    client = app.test_client()
+    client.set_cookie('token', jwt.encode({
+        'user_id': user_id,
+        'exp': datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=5)
+    }, app.config['SECRET_KEY'], algorithm="HS256"))
+    try:
+        yield client, user_id, entry_ids
+    finally:
+        cur.execute('DELETE FROM users WHERE id = %s', (user_id,))
+        cur.close()
+
+def wait_for_replay(primary, replica, timeout=10):
+    cur = primary.cursor()
+    cur.execute('SELECT pg_current_wal_lsn()')
+    target = cur.fetchone()[0]
+    cur.close()
+    cur = replica.cursor()
+    deadline = time.monotonic() + timeout
+    try:
+        while time.monotonic() < deadline:
+            cur.execute('SELECT pg_last_wal_replay_lsn() >= %s::pg_lsn', (target,))
+            if cur.fetchone()[0]:
+                return
+            time.sleep(0.05)
+    finally:
+        cur.close()
+    pytest.fail("The replica did not catch up")
+
+def list_sites(client):
+    resp = client.get('/api/list_entries')
+    assert resp.status_code == 200
+    return [entry['site'] for entry in resp.get_json()['entries']]
+
+def test_reads_go_to_a_replica(vault, primary, replica):
+    client, _, _ = vault
+    wait_for_replay(primary, replica)
+
+    before = reads('replica')
+    assert list_sites(client) == ['one', 'two']
+    assert reads('replica') == before + 1
+
+def test_reads_after_a_write_go_to_the_primary(vault, primary, replica):
+    client, _, entry_ids = vault
+    wait_for_replay(primary, replica)
+    replica.cursor().execute('SELECT pg_wal_replay_pause()')
+    try:
+        resp = client.delete('/api/delete_password', json={'id': entry_ids[0]})
+        assert resp.status_code == 200
+        assert client.get_cookie(vault_app.RECENT_WRITE_COOKIE) is not None
+
+        # The paused replica still has the entry; the primary does not
+        before = reads('recent_write')
+        assert list_sites(client) == ['two']
+        assert reads('recent_write') == before + 1
+
+        # Without the cookie the same client reads the replica again
+        client.delete_cookie(vault_app.RECENT_WRITE_COOKIE)
+        before = reads('replica')
+        assert list_sites(client) == ['one', 'two']
+        assert reads('replica') == before + 1
+    finally:
+        replica.cursor().execute('SELECT pg_wal_replay_resume()')
+
+def test_reads_fall_back_to_the_primary_when_the_replica_is_down(vault, monkeypatch):
+    client, _, _ = vault
+    monkeypatch.setattr(db_pool, '_replicas', db_pool.ReplicaSet([UNREACHABLE_REPLICA]))
+
+    before, failures = reads('primary'), replica_failures()
+    assert list_sites(client) == ['one', 'two']
+    assert reads('primary') == before + 1
+    assert replica_failures() == failures + 1
+    assert not db_pool.get_replicas().stats()['replicas'][0]['healthy']
+
+def test_reads_fall_back_to_the_primary_when_the_replica_lags(vault, primary, replica, monkeypatch):
+    client, user_id, _ = vault
+    wait_for_replay(primary, replica)
+    monkeypatch.setattr(db_pool, 'REPLICA_MAX_LAG_SECONDS', 0.5)
+    replica.cursor().execute('SELECT pg_wal_replay_pause()')
+    try:
+        primary.cursor().execute('''
+            INSERT INTO passwords (user_id, site_name, site_username, ciphertext) VALUES (%s, 'three', 'u', '\\x00')
+        ''', (user_id,))
+        # Lag counts once the replica has received WAL it has not replayed
+        cur = replica.cursor()
+        deadline = time.monotonic() + 10
+        while True:
+            cur.execute(db_pool.REPLICA_LAG_QUERY)
+            if float(cur.fetchone()[0]) > 1:
+                break
+            assert time.monotonic() < deadline, "The replica never fell behind"
+            time.sleep(0.1)
+        cur.close()
+
+        before, failures = reads('primary'), replica_failures()
+        assert list_sites(client) == ['one', 'two', 'three']
+        assert reads('primary') == before + 1
+        assert replica_failures() == failures + 1
+    finally:
+        replica.cursor().execute('SELECT pg_wal_replay_resume()')
@@ -2,22 +2,35 @@ import requests
 
 BASE_URL = 'http://127.0.0.1:5000/api'
 
+# Manual check against a running server (loadgen.py is the unattended version)
 def run_test():
     print("--- VAULT OPERATION TEST ---")
     user = input("Username: ")
     master_pw = input("Master Password: ")
-    
-    # 1. ADD A PASSWORD
+    code = input("Current 6-digit 2FA Code from Phone: ")
+
+    # The session keeps the login cookie, like the browser does
+    session = requests.Session()
+
+    # 1. LOG IN
+    print("\nLogging in...")
+    resp = session.post(f"{BASE_URL}/login", json={"username": user, "password": master_pw, "2fa_code": code})
+    print(f"Login Status: {resp.status_code}")
+    if resp.status_code != 200:
+        print(f"Login Response: {resp.json()}")
+        print("Stopping test due to error.")
+        return
+
+    # 2. ADD A PASSWORD
     print("\nAttempting to add 'Netflix'...")
     payload_add = {
-        "username": user,
         "master_password": master_pw,
         "site_name": "Netflix",
         "site_username": "cool_guy@email.com",
         "site_password": "SuperSecretNetflixPassword123"
     }
-    
-    resp = requests.post(f"{BASE_URL}/add_password", json=payload_add)
+
+    resp = session.post(f"{BASE_URL}/add_password", json=payload_add)
     print(f"Add Status: {resp.status_code}")
     print(f"Add Response: {resp.json()}")
 
@@ -25,15 +38,14 @@ def run_test():
         print("Stopping test due to error.")
         return
 
-    # 2. RETRIEVE PASSWORDS
+    # 3. RETRIEVE PASSWORDS
     print("\nAttempting to retrieve passwords...")
     payload_get = {
-        "username": user,
         "master_password": master_pw
     }
-    
-    resp = requests.post(f"{BASE_URL}/get_passwords", json=payload_get)
-    
+
+    resp = session.post(f"{BASE_URL}/get_passwords", json=payload_get)
+
     if resp.status_code == 200:
         passwords = resp.json()
         print(f"\nSUCCESS! Found {len(passwords)} entries:")
@@ -46,4 +58,4 @@ def run_test():
         print(resp.json())
 
 if __name__ == '__main__':
-    run_test()
\ No newline at end of file
+    run_test()
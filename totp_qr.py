@@ -0,0 +1,79 @@
+import datetime
+import hashlib
+import os
+import jwt
+import pyotp
+from cache import TTLCache
+
+# 2FA setup QR codes, rendered as a small SVG (one path, one run per row of dark modules).
+# qrcode is only imported on the first render and Pillow is not needed at all.
+# Renders are cached per provisioning URI for the setup window, so reloading
+# the setup screen does not render again. The URI holds the TOTP secret, so the
+# cache is keyed by its hash and the images must never be cached by browsers.
+# /api/2fa_qr only renders URIs the server handed out: register returns a short-lived
+# setup token (signed with SECRET_KEY, so any worker can read it) instead of trusting
+# whatever URI a caller posts.
+
+ISSUER = "Password Vault"
+SETUP_TOKEN_AUDIENCE = "2fa_qr" # Keeps setup tokens and session tokens apart
+QR_CACHE_TTL_SECONDS = int(os.environ.get('QR_CACHE_TTL_SECONDS', 600))
+QR_CACHE_MAX = int(os.environ.get('QR_CACHE_MAX', 256))
+QR_BORDER = 2 # Quiet zone, in modules
+
+_rendered = TTLCache(QR_CACHE_MAX, QR_CACHE_TTL_SECONDS, sliding=False)
+
+def provisioning_uri(username, two_factor_secret, issuer=ISSUER):
+    return pyotp.totp.TOTP(two_factor_secret).provisioning_uri(name=username, issuer_name=issuer)
+
+def setup_token(uri, secret_key):
+    return jwt.encode({
+        'totp_uri': uri,
+        'aud': SETUP_TOKEN_AUDIENCE,
+        'exp': datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=QR_CACHE_TTL_SECONDS)
+    }, secret_key, algorithm="HS256")
+
+# None for anything that is not an unexpired setup token from this server
+def uri_from_setup_token(token, secret_key):
+    if not isinstance(token, str):
+        return None
+    try:
+        data = jwt.decode(token, secret_key, algorithms=["HS256"], audience=SETUP_TOKEN_AUDIENCE)
+    except jwt.InvalidTokenError:
+        return None
+    uri = data.get('totp_uri')
+    return uri if isinstance(uri, str) and uri.startswith('otpauth://totp/') else None
+
+def cached_svg(uri):
+    return _rendered.get(hashlib.sha256(uri.encode()).hexdigest())
+
+def svg(uri):
+    key = hashlib.sha256(uri.encode()).hexdigest()
+    image = _rendered.get(key)
+    if image is None:
+        image = render_svg(uri)
+        _rendered.set(key, image)
+    return image
+
+def render_svg(uri):
+    import qrcode
+
+    qr = qrcode.QRCode(border=QR_BORDER)
+    qr.add_data(uri)
+    qr.make(fit=True)
+    matrix = qr.get_matrix()
+    size = len(matrix)
+
+    path = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < size:
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < size and row[x]:
+                x += 1
+            path.append(f"M{start} {y}h{x - start}v1h-{x - start}")
+
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+            f'<rect width="{size}" height="{size}" fill="#fff"/><path d="{"".join(path)}"/></svg>')
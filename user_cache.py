@@ -0,0 +1,28 @@
+import os
+from cache import TTLCache
+
+# Per-worker cache of "who is this session": user id -> {'id', 'username'}.
+# /api/check_session runs on every page load; with a warm cache it answers
+# from the JWT and this cache without taking a database connection.
+#
+# Entries live for a fixed USER_CACHE_TTL_SECONDS (not extended on reads).
+# This worker drops an entry as soon as the account is renamed or deleted;
+# other gunicorn workers see the change once their copy expires.
+# Credentials (salt, hash, KDF settings) are deliberately not cached: they are
+# always read fresh, so a password change is effective in every worker at once.
+USER_CACHE_TTL_SECONDS = int(os.environ.get('USER_CACHE_TTL_SECONDS', 60))
+USER_CACHE_MAX = int(os.environ.get('USER_CACHE_MAX', 10000))
+
+_users = TTLCache(USER_CACHE_MAX, USER_CACHE_TTL_SECONDS, sliding=False)
+
+def get(user_id):
+    return _users.get(user_id)
+
+def put(user):
+    # Accepts a full users row; only the public fields are kept
+    record = {'id': user['id'], 'username': user['username']}
+    _users.set(user['id'], record)
+    return record
+
+def invalidate(user_id):
+    _users.pop(user_id)
@@ -0,0 +1,98 @@
+import argparse
+import getpass
+import sys
+import crypto_manager
+import db_pool
+import vault_export
+import vault_import
+import vault_keys
+
+# Admin backup tool, using the same streaming code as /api/export and /api/import:
+#   python vault_backup.py export alice backup.pvault         (encrypted archive)
+#   python vault_backup.py export alice export.csv --csv      (plain CSV, handle with care)
+#   python vault_backup.py restore alice backup.pvault        (archive or CSV export)
+# Rows are read/written in batches, so memory stays flat for any vault size.
+
+def unlock_user(conn, username):
+    cur = conn.cursor()
+    cur.execute('SELECT id, salt, password_hash, kdf_params FROM users WHERE username = %s', (username,))
+    user = cur.fetchone()
+    cur.close()
+    if not user:
+        sys.exit(f"ERROR: User '{username}' not found.")
+
+    user_id, salt_hex, password_hash, kdf_params = user
+    master_password = getpass.getpass("Master password: ")
+    kek = crypto_manager.unlock_vault(master_password, salt_hex, password_hash, kdf_params)
+    if kek is None:
+        sys.exit("ERROR: Invalid password.")
+
+    # None/KeyringError: the password changed in between, or the data keys do not open.
+    # Going on would write a "successful" backup without a single entry.
+    try:
+        keyring = vault_keys.open_keyring(conn, user_id, kek)
+    except vault_keys.KeyringError as e:
+        sys.exit(f"ERROR: Could not open the vault's data keys ({e}).")
+    if keyring is None:
+        sys.exit("ERROR: Could not open the vault (the password changed meanwhile?). Try again.")
+    return user_id, keyring, master_password
+
+def export_vault(username, path, as_csv):
+    conn = db_pool.get_connection()
+    try:
+        user_id, keyring, master_password = unlock_user(conn, username)
+        entries = vault_export.decrypted_entries(vault_export.iter_vault_rows(conn, user_id), keyring)
+
+        if as_csv:
+            lines = vault_export.csv_lines(entries)
+        else:
+            archive_password = getpass.getpass("Archive password (blank = master password): ") or master_password
+            header, archive_key = vault_export.new_archive(archive_password)
+            lines = vault_export.archive_lines(entries, header, archive_key)
+
+        count = -1 # Header line
+        with open(path, 'w', encoding='utf-8', newline='') as out:
+            for line in lines:
+                out.write(line)
+                count += 1
+        print(f"SUCCESS: Exported {count} entries to {path}")
+    finally:
+        conn.close()
+
+def restore_vault(username, path):
+    conn = db_pool.get_connection()
+    try:
+        user_id, keyring, master_password = unlock_user(conn, username)
+
+        with open(path, encoding='utf-8-sig', newline='') as text_stream:
+            first_line = text_stream.readline()
+            text_stream.seek(0)
+            if vault_export.is_archive(first_line):
+                importer = vault_export.ArchiveReader(text_stream)
+                archive_password = getpass.getpass("Archive password (blank = master password): ") or master_password
+                if not importer.unlock(archive_password):
+                    sys.exit("ERROR: Invalid archive password.")
+            else:
+                importer = vault_import.CsvImporter(text_stream)
+
+            imported = 0
+            for imported in vault_import.import_entries(conn, user_id, keyring, importer):
+                print(f"  ...{imported} entries")
+        print(f"SUCCESS: Restored {imported} entries ({importer.format}), skipped {importer.skipped}")
+    except (vault_import.ImportFormatError, vault_export.ArchiveError) as e:
+        sys.exit(f"ERROR: {e}")
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Back up or restore one user's vault")
+    parser.add_argument('action', choices=['export', 'restore'])
+    parser.add_argument('username')
+    parser.add_argument('path')
+    parser.add_argument('--csv', action='store_true', help="export as plain CSV instead of an encrypted archive")
+    args = parser.parse_args()
+
+    if args.action == 'export':
+        export_vault(args.username, args.path, args.csv)
+    else:
+        restore_vault(args.username, args.path)
@@ -0,0 +1,150 @@
+import csv
+import io
+import json
+from cryptography.fernet import Fernet, InvalidToken
+from psycopg2.extras import RealDictCursor
+import crypto_manager
+import kdf
+import metrics
+
+# Encrypted backup format (one JSON object per line, so it can be written and read as a stream):
+#   {"format": "password-vault-archive", "version": 1, "kdf": "<kdf.py params>", "salt": "...", "check": "..."}
+#   {"entry": "<Fernet token of {"site": ..., "username": ..., "password": ...}>"}
+#   ...
+# The archive key comes from a password + its own fresh salt, so a backup
+# stays readable after the account password (and vault key) change.
+ARCHIVE_FORMAT = 'password-vault-archive'
+ARCHIVE_VERSION = 1
+ARCHIVE_LEGACY_KDF = 'pbkdf2-sha256' # First archives only named the algorithm (480k iterations)
+ARCHIVE_CHECK = b'password-vault archive'
+
+# Same columns as a Chrome export, so the CSV can be imported here or elsewhere
+CSV_HEADER = ['name', 'url', 'username', 'password']
+
+EXPORT_BATCH = 200 # Rows fetched per round-trip from the server-side cursor
+
+class ArchiveError(Exception):
+    pass
+
+# UTILITY: Read a user's vault through a server-side cursor (EXPORT_BATCH rows at a time)
+# The cursor is closed when the generator finishes or is closed.
+def iter_vault_rows(conn, user_id, batch_size=EXPORT_BATCH):
+    cur = conn.cursor(name='export_rows', cursor_factory=RealDictCursor)
+    cur.itersize = batch_size
+    try:
+        cur.execute('''
+            SELECT id, site_name, site_username, encrypted_password, ciphertext, key_version FROM passwords
+            WHERE user_id = %s ORDER BY id
+        ''', (user_id,))
+        for row in cur:
+            yield row
+    finally:
+        cur.close()
+
+# `keyring` is the vault's vault_keys.Keyring
+def decrypted_entries(rows, keyring):
+    # Entries that do not decrypt are left out, like get_passwords does
+    for row in rows:
+        try:
+            with metrics.phase('crypto'):
+                password = keyring.decrypt_entry(row)
+        except Exception: continue
+        yield row['site_name'], row['site_username'], password
+
+# 1. WRITING
+# `derive` is the KDF to use (the web app passes the KDF pool's version).
+def new_archive(archive_password, derive=crypto_manager.derive_master_secret, kdf_params=kdf.DEFAULT_PARAMS):
+    salt = crypto_manager.generate_salt()
+    return archive_from_secret(salt, derive(archive_password, salt, kdf_params), kdf_params)
+
+def archive_from_secret(salt, master_secret, kdf_params):
+    archive_key = crypto_manager.encryption_key_from_secret(master_secret)
+    header = {
+        "format": ARCHIVE_FORMAT,
+        "version": ARCHIVE_VERSION,
+        "kdf": kdf_params,
+        "salt": salt.hex(),
+        "check": Fernet(archive_key).encrypt(ARCHIVE_CHECK).decode()
+    }
+    return header, archive_key
+
+def archive_lines(entries, header, archive_key):
+    yield json.dumps(header) + '\n'
+    yield from archive_entry_lines(entries, archive_key)
+
+def archive_entry_lines(entries, archive_key):
+    f = Fernet(archive_key)
+    for site_name, site_username, password in entries:
+        payload = json.dumps({"site": site_name, "username": site_username, "password": password})
+        yield json.dumps({"entry": f.encrypt(payload.encode()).decode()}) + '\n'
+
+def csv_lines(entries):
+    yield csv_line(CSV_HEADER)
+    yield from csv_entry_lines(entries)
+
+def csv_entry_lines(entries):
+    for site_name, site_username, password in entries:
+        yield csv_line([site_name, '', site_username, password])
+
+def csv_line(values):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue()
+
+# 2. READING
+def is_archive(first_line):
+    try:
+        header = json.loads(first_line)
+    except ValueError:
+        return False
+    return isinstance(header, dict) and header.get('format') == ARCHIVE_FORMAT
+
+# Reads an archive one line at a time. Same interface as vault_import.CsvImporter:
+# iterating yields (site_name, site_username, password), bad lines are counted in `skipped`.
+class ArchiveReader:
+    format = 'archive'
+
+    def __init__(self, text_stream):
+        self._stream = text_stream
+        try:
+            header = json.loads(text_stream.readline())
+        except ValueError:
+            raise ArchiveError("Not a vault archive")
+        if not isinstance(header, dict) or header.get('format') != ARCHIVE_FORMAT:
+            raise ArchiveError("Not a vault archive")
+        if header.get('version') != ARCHIVE_VERSION:
+            raise ArchiveError("Unsupported archive version")
+
+        try:
+            self.salt = bytes.fromhex(header['salt'])
+            self._check = header['check']
+            self.kdf_params = kdf.LEGACY_PARAMS if header['kdf'] == ARCHIVE_LEGACY_KDF else header['kdf']
+            kdf.parse(self.kdf_params)
+        except (KeyError, TypeError, ValueError):
+            raise ArchiveError("Damaged archive header")
+        self._fernet = None
+        self.skipped = 0
+
+    # Returns False when the archive password is wrong
+    def unlock(self, archive_password, derive=crypto_manager.derive_master_secret):
+        return self.unlock_with_secret(derive(archive_password, self.salt, self.kdf_params))
+
+    def unlock_with_secret(self, master_secret):
+        f = Fernet(crypto_manager.encryption_key_from_secret(master_secret))
+        try:
+            f.decrypt(self._check.encode())
+        except InvalidToken:
+            return False
+        self._fernet = f
+        return True
+
+    def __iter__(self):
+        if self._fernet is None:
+            raise ArchiveError("Archive is locked")
+        for line in self._stream:
+            if not line.strip(): continue
+            try:
+                entry = json.loads(self._fernet.decrypt(json.loads(line)['entry'].encode()))
+                yield entry['site'], entry['username'], entry['password']
+            except (ValueError, KeyError, TypeError, InvalidToken):
+                self.skipped += 1
@@ -0,0 +1,113 @@
+import csv
+from urllib.parse import urlparse
+from psycopg2.extras import execute_values
+import metrics
+
+IMPORT_CHUNK = 500 # Rows per INSERT/commit
+
+# Column names used by common password manager CSV exports (compared in lowercase).
+# Each format: which column holds the site, the login, the password, and an optional fallback URL.
+CSV_FORMATS = {
+    # Chrome / Edge / Brave: name,url,username,password,note
+    'chrome': {'site': 'name', 'username': 'username', 'password': 'password', 'url': 'url'},
+    # Bitwarden: folder,favorite,type,name,notes,fields,reprompt,login_uri,login_username,login_password,login_totp
+    'bitwarden': {'site': 'name', 'username': 'login_username', 'password': 'login_password', 'url': 'login_uri'},
+    # 1Password: Title,Url,Username,Password,OTPAuth,Favorite,Archived,Tags,Notes
+    '1password': {'site': 'title', 'username': 'username', 'password': 'password', 'url': 'url'},
+}
+
+class ImportFormatError(Exception):
+    pass
+
+def detect_format(header):
+    columns = {name.strip().lower() for name in header}
+    if 'login_password' in columns:
+        return 'bitwarden'
+    if 'title' in columns and 'password' in columns:
+        return '1password'
+    if 'name' in columns and 'password' in columns:
+        return 'chrome'
+    raise ImportFormatError("Unrecognised CSV export (expected Chrome, Bitwarden or 1Password columns)")
+
+# Reads a CSV export one row at a time, so memory stays flat however big the file is.
+# Iterating yields (site_name, site_username, password); rows that cannot be
+# imported are counted in `skipped`.
+class CsvImporter:
+    def __init__(self, text_stream):
+        self._reader = csv.reader(text_stream)
+        header = next(self._reader, None)
+        if not header:
+            raise ImportFormatError("The CSV file is empty")
+
+        self.format = detect_format(header)
+        self.skipped = 0
+
+        positions = {name.strip().lower(): i for i, name in enumerate(header)}
+        columns = CSV_FORMATS[self.format]
+        self._site = positions.get(columns['site'])
+        self._username = positions.get(columns['username'])
+        self._password = positions[columns['password']]
+        self._url = positions.get(columns['url'])
+        self._type = positions.get('type') if self.format == 'bitwarden' else None
+
+    def __iter__(self):
+        for row in self._reader:
+            entry = self._parse_row(row)
+            if entry is None:
+                self.skipped += 1
+            else:
+                yield entry
+
+    def _parse_row(self, row):
+        def cell(index):
+            return row[index].strip() if index is not None and index < len(row) else ''
+
+        # Bitwarden exports cards, notes and identities too; only logins have passwords
+        if self._type is not None and cell(self._type) not in ('', 'login'):
+            return None
+
+        password = cell(self._password)
+        if not password:
+            return None
+
+        site_name = cell(self._site) or site_from_url(cell(self._url))
+        if not site_name:
+            return None
+        return site_name, cell(self._username), password
+
+def site_from_url(url):
+    if not url:
+        return ''
+    host = urlparse(url if '://' in url else 'https://' + url).hostname or ''
+    return host[4:] if host.startswith('www.') else host
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# Encrypts and inserts (site_name, site_username, password) entries one chunk
+# at a time (with the current key of `keyring`, see vault_keys.py), committing each chunk.
+# Yields the running total after every chunk.
+def import_entries(conn, user_id, keyring, entries, chunk_size=IMPORT_CHUNK):
+    cur = conn.cursor()
+    imported = 0
+    try:
+        for chunk in chunked(entries, chunk_size):
+            with metrics.phase('crypto'):
+                rows = [(user_id, site_name, site_username, keyring.encrypt(password), keyring.current_version)
+                        for site_name, site_username, password in chunk]
+            execute_values(cur, '''
+                INSERT INTO passwords (user_id, site_name, site_username, ciphertext, key_version)
+                VALUES %s
+            ''', rows, page_size=chunk_size)
+            conn.commit()
+            imported += len(rows)
+            yield imported
+    finally:
+        cur.close()
@@ -0,0 +1,237 @@
+import datetime
+import os
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import InvalidToken
+from psycopg2.extras import execute_values
+import crypto_manager
+
+# Envelope encryption: entries are encrypted with a random per-user data key, and only
+# that data key is encrypted ("wrapped") with the key derived from the master password
+# (the KEK). A password or KDF change therefore rewraps a few small keys in data_keys
+# instead of re-encrypting the whole vault.
+#
+# Data keys have versions, and every entry records the version it was written with
+# (passwords.key_version). New writes always use the current version. When the current
+# key gets older than DATA_KEY_MAX_AGE_DAYS, the next unlock adds a new version; entries
+# on older ("retired") versions are moved over one batch at a time after vault requests,
+# and a retired key is deleted once no entry uses it.
+#
+# Accounts from before envelope encryption are converted on their next unlock: their old
+# vault key becomes data key version 0 (their entries have key_version NULL) and a new
+# random key becomes version 1, so nothing is re-encrypted up front.
+#
+# Entries are stored in the binary envelope of crypto_manager.EntryCipher. Entries from
+# before it are Fernet tokens, and only keys created before it can have such entries
+# (data_keys.fernet_entries). Such a key is rotated out on the next unlock like an old
+# one, so the same batches rewrite its entries in the new format.
+#
+# An entry that does not decrypt (corrupted at rest) cannot be moved. The batches set it aside
+# (passwords.quarantined_at) and skip it from then on, but it keeps its key_version, so its
+# data key is kept too: it is the only key that could ever read the entry. Clearing
+# quarantined_at puts the entry back into the next batch.
+
+LEGACY_KEY_VERSION = 0
+FIRST_KEY_VERSION = 1
+DATA_KEY_MAX_AGE_DAYS = int(os.environ.get('DATA_KEY_MAX_AGE_DAYS', 365)) # 0 = never rotate
+REENCRYPT_BATCH = int(os.environ.get('DATA_KEY_REENCRYPT_BATCH', 500)) # Entries moved per request
+
+# What EntryCipher.decrypt raises for a damaged entry (Fernet token / envelope format, AES-GCM tag)
+UNREADABLE_ENTRY_ERRORS = (InvalidToken, InvalidTag)
+
+# The wrapped keys do not open with this KEK (the password changed in the meantime)
+class KeyringError(Exception):
+    pass
+
+class Keyring:
+    def __init__(self, keys, current_version, created_at=None, fernet_entries=False):
+        self.keys = keys # {version: Fernet key}
+        self.current_version = current_version
+        self.created_at = created_at # Of the current key; None = just created
+        self.fernet_entries = fernet_entries # The current key may have entries in the old format
+        self._ciphers = {} # {version: EntryCipher}, built on first use
+
+    # `rows` are (version, wrapped_key, created_at, fernet_entries) from data_keys
+    @classmethod
+    def unwrap(cls, kek, current_version, rows):
+        keys, created_at, fernet_entries = {}, None, False
+        try:
+            for version, wrapped_key, created, fernet in rows:
+                keys[version] = crypto_manager.unwrap_key(kek, wrapped_key)
+                if version == current_version:
+                    created_at, fernet_entries = created, fernet
+        except InvalidToken:
+            raise KeyringError("Data keys do not open with this key")
+        if current_version not in keys:
+            raise KeyringError("Current data key is missing")
+        return cls(keys, current_version, created_at, fernet_entries)
+
+    def cipher(self, version):
+        cipher = self._ciphers.get(version)
+        if cipher is None:
+            cipher = self._ciphers[version] = crypto_manager.EntryCipher(self.keys[version])
+        return cipher
+
+    # Envelope bytes for passwords.ciphertext
+    def encrypt(self, plain_text):
+        return self.cipher(self.current_version).encrypt(plain_text)
+
+    def decrypt(self, stored, key_version):
+        version = LEGACY_KEY_VERSION if key_version is None else key_version
+        return self.cipher(version).decrypt(stored)
+
+    # A passwords row with ciphertext, encrypted_password (old format) and key_version
+    def decrypt_entry(self, row):
+        stored = row['ciphertext'] if row['ciphertext'] is not None else row['encrypted_password']
+        return self.decrypt(stored, row['key_version'])
+
+    # False for a version deleted after this keyring was opened, or one added since
+    def has_version(self, key_version):
+        return (LEGACY_KEY_VERSION if key_version is None else key_version) in self.keys
+
+    def retired_versions(self):
+        return sorted(version for version in self.keys if version != self.current_version)
+
+    def needs_rotation(self):
+        if self.fernet_entries:
+            return True
+        if DATA_KEY_MAX_AGE_DAYS <= 0 or self.created_at is None:
+            return False
+        age = datetime.datetime.now(datetime.timezone.utc) - self.created_at
+        return age > datetime.timedelta(days=DATA_KEY_MAX_AGE_DAYS)
+
+    # Same keys plus a fresh current one (the old current key becomes retired)
+    def rotated(self):
+        version = max(self.keys) + 1
+        return Keyring({**self.keys, version: crypto_manager.generate_data_key()}, version)
+
+    # [(version, wrapped_key)] for data_keys
+    def wrapped(self, kek, versions=None):
+        return [(version, crypto_manager.wrap_key(kek, self.keys[version]))
+                for version in (versions if versions is not None else sorted(self.keys))]
+
+# A new account's keyring, or a legacy account's (its old vault key kept as version 0)
+def new_keyring(legacy_key=None):
+    keys = {FIRST_KEY_VERSION: crypto_manager.generate_data_key()}
+    if legacy_key is not None:
+        keys[LEGACY_KEY_VERSION] = legacy_key
+    return Keyring(keys, FIRST_KEY_VERSION)
+
+def insert_keys(cur, user_id, kek, keyring, versions=None):
+    execute_values(cur, 'INSERT INTO data_keys (user_id, version, wrapped_key) VALUES %s',
+                   [(user_id, version, wrapped) for version, wrapped in keyring.wrapped(kek, versions)])
+
+# UTILITY: The keyring for a request, opened with an already checked KEK (None = KEK is stale)
+# Converts legacy accounts and rotates an old current key on the way, committing those writes.
+# They only happen while the password hash is still the one the KEK matched, so a password
+# change in between cannot leave a key behind that is wrapped with the old KEK.
+def open_keyring(conn, user_id, kek):
+    cur = conn.cursor()
+    try:
+        cur.execute('SELECT password_hash, data_key_version FROM users WHERE id = %s', (user_id,))
+        user = cur.fetchone()
+        if user is None or not crypto_manager.key_matches_hash(kek, user[0]):
+            return None
+        password_hash, current_version = user
+
+        if current_version is None:
+            keyring = new_keyring(legacy_key=kek)
+            versions = None
+        else:
+            cur.execute('SELECT version, wrapped_key, created_at, fernet_entries FROM data_keys WHERE user_id = %s', (user_id,))
+            keyring = Keyring.unwrap(kek, current_version, cur.fetchall())
+            if not keyring.needs_rotation():
+                return keyring
+            keyring = keyring.rotated()
+            versions = [keyring.current_version]
+
+        cur.execute('''
+            UPDATE users SET data_key_version = %s
+            WHERE id = %s AND data_key_version IS NOT DISTINCT FROM %s AND password_hash = %s
+        ''', (keyring.current_version, user_id, current_version, password_hash))
+        if cur.rowcount == 0:
+            # Another request converted/rotated first (or the password changed): use what is there now
+            conn.rollback()
+            return open_keyring(conn, user_id, kek)
+        insert_keys(cur, user_id, kek, keyring, versions)
+        conn.commit()
+        return keyring
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+# UTILITY: Wrap the keyring with a new KEK after a password or KDF change (caller commits)
+# The user row is locked first, so no conversion or rotation can add a key wrapped with the old KEK.
+def rewrap(conn, user_id, old_kek, new_kek):
+    cur = conn.cursor()
+    try:
+        cur.execute('SELECT data_key_version FROM users WHERE id = %s FOR UPDATE', (user_id,))
+        current_version = cur.fetchone()[0]
+
+        if current_version is None:
+            keyring = new_keyring(legacy_key=old_kek)
+            cur.execute('UPDATE users SET data_key_version = %s WHERE id = %s', (keyring.current_version, user_id))
+            insert_keys(cur, user_id, new_kek, keyring)
+            return keyring
+
+        cur.execute('SELECT version, wrapped_key, created_at, fernet_entries FROM data_keys WHERE user_id = %s', (user_id,))
+        keyring = Keyring.unwrap(old_kek, current_version, cur.fetchall())
+        execute_values(cur, '''
+            UPDATE data_keys AS k SET wrapped_key = v.wrapped_key
+            FROM (VALUES %s) AS v (user_id, version, wrapped_key)
+            WHERE k.user_id = v.user_id AND k.version = v.version
+        ''', [(user_id, version, wrapped) for version, wrapped in keyring.wrapped(new_kek)])
+        return keyring
+    finally:
+        cur.close()
+
+# UTILITY: Move up to `limit` entries from retired keys to the current key (commits).
+# When none are left, retired keys that no entry uses are deleted. Returns the number of entries
+# moved or quarantined.
+def reencrypt_batch(conn, user_id, keyring, limit=REENCRYPT_BATCH):
+    retired = keyring.retired_versions()
+    if not retired:
+        return 0
+
+    cur = conn.cursor()
+    try:
+        # SKIP LOCKED: two workers running a batch for the same vault split the work
+        cur.execute('''
+            SELECT id, encrypted_password, ciphertext, key_version FROM passwords
+            WHERE user_id = %s AND COALESCE(key_version, 0) = ANY(%s) AND quarantined_at IS NULL
+            ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED
+        ''', (user_id, retired, limit))
+        rows, unreadable = [], []
+        for entry_id, encrypted, ciphertext, key_version in cur.fetchall():
+            try:
+                plain_text = keyring.decrypt(ciphertext if ciphertext is not None else encrypted, key_version)
+            except UNREADABLE_ENTRY_ERRORS:
+                print(f"Re-encrypt Error: entry {entry_id} does not decrypt, quarantined") # Log internally
+                unreadable.append(entry_id)
+                continue
+            rows.append((entry_id, keyring.encrypt(plain_text), keyring.current_version))
+
+        if rows:
+            execute_values(cur, '''
+                UPDATE passwords AS p
+                SET ciphertext = v.ciphertext, encrypted_password = NULL, key_version = v.key_version
+                FROM (VALUES %s) AS v (id, ciphertext, key_version)
+                WHERE p.id = v.id
+            ''', rows, page_size=limit)
+        if unreadable:
+            cur.execute('UPDATE passwords SET quarantined_at = now() WHERE id = ANY(%s)', (unreadable,))
+        if not rows and not unreadable:
+            cur.execute('''
+                DELETE FROM data_keys AS k
+                WHERE k.user_id = %s AND k.version = ANY(%s)
+                  AND NOT EXISTS (SELECT 1 FROM passwords AS p
+                                  WHERE p.user_id = k.user_id AND COALESCE(p.key_version, 0) = k.version)
+            ''', (user_id, retired))
+        conn.commit()
+        return len(rows) + len(unreadable)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()